@@ -0,0 +1,325 @@
+"""
+Measure OUModulesBackend lookup latency and upstream traffic, against local
+stand-ins of the open.ac.uk upstreams (see fake_upstreams.py):
+
+    poetry run python benchmarks/backend_latency.py [--compare OLD.json]
+
+Each scenario runs with a fresh backend, and reports p50/p95/p99 latency of
+`find_result_for_code` calls, and the number of requests each upstream
+received - including background ones started by the lookups. Results are
+saved as JSON, to be compared with later runs with --compare.
+"""
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import os
+import statistics
+import string
+import subprocess
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from fake_upstreams import (
+    FAILURE_ERROR,
+    FAILURE_MODES,
+    OUDA,
+    SPARQL,
+    UPSTREAMS,
+    WWW,
+    Catalogue,
+    FakeUpstreams,
+    UpstreamConfig,
+)
+
+from oumodulesbot.backend import OUModulesBackend, get_cache
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# Rough latencies of the real upstreams, in milliseconds:
+DEFAULT_LATENCIES = {WWW: 80, SPARQL: 400, OUDA: 150}
+
+Scenario = Callable[[OUModulesBackend], Awaitable[List[float]]]
+
+
+def synthetic_codes(prefix: str, count: int) -> List[str]:
+    """
+    Return `count` module codes which aren't in cache.json.
+    """
+    return [
+        f"{prefix}{letter}{number}"
+        for letter, number in itertools.islice(
+            itertools.product(string.ascii_uppercase, range(100, 800)), count
+        )
+    ]
+
+
+async def timed_lookup(backend: OUModulesBackend, code: str) -> float:
+    start = time.perf_counter()
+    await backend.find_result_for_code(code)
+    return time.perf_counter() - start
+
+
+def sequential(codes: Sequence[str]) -> Scenario:
+    async def run(backend: OUModulesBackend) -> List[float]:
+        return [await timed_lookup(backend, code) for code in codes]
+
+    return run
+
+
+def bursts(code_groups: Sequence[Sequence[str]]) -> Scenario:
+    async def run(backend: OUModulesBackend) -> List[float]:
+        latencies: List[float] = []
+        for codes in code_groups:
+            latencies += await asyncio.gather(
+                *(timed_lookup(backend, code) for code in codes)
+            )
+        return latencies
+
+    return run
+
+
+def make_scenarios(
+    catalogue: Catalogue,
+    iterations: int,
+    burst_size: int,
+    burst_count: int,
+) -> Dict[str, Scenario]:
+    active, old = list(catalogue.active), list(catalogue.old)
+    unknown = synthetic_codes("ZQX", len(active))
+    cache = get_cache()
+    with_url = [code for code, (_, url) in cache.items() if url]
+    without_url = [code for code, (_, url) in cache.items() if not url]
+    # a mix of all kinds of misses, different in each burst:
+    mixed = iter(
+        [code for codes in zip(active, old, unknown) for code in codes]
+    )
+    return {
+        "cache_hit": sequential(with_url[:iterations]),
+        "cache_hit_null_url": sequential(without_url[:iterations]),
+        "miss_active": sequential(active[:iterations]),
+        "miss_old": sequential(old[:iterations]),
+        "miss_not_found": sequential(unknown[:iterations]),
+        "burst_same_code": bursts(
+            [[code] * burst_size for code in active[:burst_count]]
+        ),
+        "burst_distinct_codes": bursts(
+            [
+                list(itertools.islice(mixed, burst_size))
+                for _ in range(burst_count)
+            ]
+        ),
+    }
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    ms = [latency * 1000 for latency in latencies]
+    percentiles = statistics.quantiles(ms, n=100, method="inclusive")
+    return {
+        "p50_ms": percentiles[49],
+        "p95_ms": percentiles[94],
+        "p99_ms": percentiles[98],
+        "max_ms": max(ms),
+    }
+
+
+async def run_scenario(scenario: Scenario, upstreams: FakeUpstreams) -> dict:
+    upstreams.requests.clear()
+    async with OUModulesBackend(proxy=upstreams.proxy_url) as backend:
+        latencies = await scenario(backend)
+        # background URL checks count towards the scenario's traffic:
+        await backend.wait_for_background_tasks()
+        stats = dict(backend.stats)
+    requests = {
+        upstream: upstreams.requests[upstream] for upstream in UPSTREAMS
+    }
+    return {
+        "lookups": len(latencies),
+        **summarize(latencies),
+        "upstream_requests": requests,
+        "upstream_requests_per_lookup": (
+            sum(requests.values()) / len(latencies)
+        ),
+        "backend_stats": stats,
+    }
+
+
+async def run_benchmarks(
+    configs: Dict[str, UpstreamConfig],
+    iterations: int,
+    burst_size: int,
+    burst_count: int,
+    selected: Optional[Sequence[str]],
+    seed: int,
+) -> Dict[str, dict]:
+    needed = max(iterations, burst_size * burst_count)
+    catalogue = Catalogue(
+        active={
+            code: f"Benchmark module {code}"
+            for code in synthetic_codes("ZQA", needed)
+        },
+        old={
+            code: f"Old benchmark module {code}"
+            for code in synthetic_codes("ZQO", needed)
+        },
+    )
+    scenarios = make_scenarios(catalogue, iterations, burst_size, burst_count)
+    results = {}
+    async with FakeUpstreams(catalogue, configs, seed) as upstreams:
+        for name, scenario in scenarios.items():
+            if selected and name not in selected:
+                continue
+            results[name] = await run_scenario(scenario, upstreams)
+            print_result(name, results[name])
+    return results
+
+
+def print_result(name: str, result: dict) -> None:
+    requests = ", ".join(
+        f"{upstream} {count}"
+        for upstream, count in result["upstream_requests"].items()
+    )
+    print(
+        f"{name:<22} p50 {result['p50_ms']:8.2f} ms"
+        f"  p95 {result['p95_ms']:8.2f} ms"
+        f"  p99 {result['p99_ms']:8.2f} ms"
+        f"  requests: {requests}"
+    )
+
+
+def compare(results: Dict[str, dict], previous_path: str) -> None:
+    with open(previous_path) as f:
+        previous = json.load(f)["scenarios"]
+    print(f"\nChange since {previous_path}:")
+    for name, result in results.items():
+        if name not in previous:
+            continue
+        old = previous[name]
+        changes = [
+            f"{key[:3]} {result[key] - old[key]:+8.2f} ms"
+            for key in ("p50_ms", "p95_ms", "p99_ms")
+        ]
+        per_lookup = "upstream_requests_per_lookup"
+        changes.append(
+            f"requests/lookup {result[per_lookup] - old[per_lookup]:+.2f}"
+        )
+        print(f"{name:<22} " + "  ".join(changes))
+
+
+def get_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_failure(value: str) -> tuple:
+    """
+    Parse --fail UPSTREAM:RATE[:MODE].
+    """
+    upstream, rate, *mode = value.split(":")
+    if upstream not in UPSTREAMS or (mode and mode[0] not in FAILURE_MODES):
+        raise argparse.ArgumentTypeError(f"invalid failure: {value}")
+    return upstream, float(rate), mode[0] if mode else FAILURE_ERROR
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--burst-size", type=int, default=30)
+    parser.add_argument("--bursts", type=int, default=5)
+    for upstream in UPSTREAMS:
+        parser.add_argument(
+            f"--{upstream}-latency",
+            type=float,
+            default=DEFAULT_LATENCIES[upstream],
+            help=f"{upstream} response time, in ms",
+        )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.2,
+        help="standard deviation of response times, as a fraction of them",
+    )
+    parser.add_argument(
+        "--fail",
+        type=parse_failure,
+        action="append",
+        default=[],
+        metavar="UPSTREAM:RATE[:MODE]",
+        help=(
+            f"fail RATE of requests to UPSTREAM ({', '.join(UPSTREAMS)}),"
+            f" with MODE ({', '.join(FAILURE_MODES)}, default"
+            f" {FAILURE_ERROR})"
+        ),
+    )
+    parser.add_argument("--scenario", action="append", dest="scenarios")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="default: benchmarks/results/")
+    parser.add_argument("--compare", help="results of a previous run")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.CRITICAL
+    )
+    configs = {
+        upstream: UpstreamConfig(
+            latency=getattr(args, f"{upstream}_latency") / 1000,
+            jitter=getattr(args, f"{upstream}_latency") / 1000 * args.jitter,
+        )
+        for upstream in UPSTREAMS
+    }
+    for upstream, rate, mode in args.fail:
+        configs[upstream].failure_rate = rate
+        configs[upstream].failure_mode = mode
+
+    results = asyncio.run(
+        run_benchmarks(
+            configs,
+            args.iterations,
+            args.burst_size,
+            args.bursts,
+            args.scenarios,
+            args.seed,
+        )
+    )
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"backend_latency-{timestamp}.json")
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "revision": get_revision(),
+                "created_at": datetime.datetime.now().isoformat(),
+                "arguments": {
+                    key: value
+                    for key, value in vars(args).items()
+                    if key not in ("output", "compare", "verbose")
+                },
+                "scenarios": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"\nResults saved in {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compare startup time and memory of the JSON and binary cache loaders.
+
+Each loader runs in a fresh interpreter, so that neither benefits from the
+other's imports or allocations:
+
+    poetry run python benchmarks/cache_loading.py [--runs N]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import oumodulesbot
+from oumodulesbot.binary_cache import dump_binary_cache, get_digest
+
+LOADER_SCRIPT = """
+import json, sys, time
+
+def rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+
+from oumodulesbot import backend
+
+rss_before = rss_kb()
+start = time.perf_counter()
+cache = backend.get_cache(sys.argv[1] or None)
+loaded = time.perf_counter()
+for code in ("M208", "MST125", "TM129", "XYZ999"):
+    cache.get(code)
+looked_up = time.perf_counter()
+print(json.dumps({
+    "loader": type(cache).__name__,
+    "load_ms": (loaded - start) * 1000,
+    "lookups_ms": (looked_up - loaded) * 1000,
+    "rss_delta_kb": rss_kb() - rss_before,
+}))
+"""
+
+
+def run_loader(binary_cache_path: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", LOADER_SCRIPT, binary_cache_path],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    json_path = os.path.join(
+        os.path.dirname(oumodulesbot.__file__), "cache.json"
+    )
+    with open(json_path, "rb") as f:
+        json_bytes = f.read()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        binary_path = os.path.join(tmp, "cache.bin")
+        with open(binary_path, "wb") as f:
+            f.write(
+                dump_binary_cache(
+                    json.loads(json_bytes), get_digest(json_bytes)
+                )
+            )
+        for name, path in (("json", ""), ("binary", binary_path)):
+            runs = [run_loader(path) for _ in range(args.runs)]
+            print(
+                f"{name} ({runs[0]['loader']}):"
+                " load {:.2f} ms, 4 lookups {:.3f} ms, RSS +{} KiB".format(
+                    statistics.median(run["load_ms"] for run in runs),
+                    statistics.median(run["lookups_ms"] for run in runs),
+                    statistics.median(run["rss_delta_kb"] for run in runs),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Local stand-ins for the upstreams used by OUModulesBackend: module pages on
+www.open.ac.uk, the data.open.ac.uk SPARQL endpoint and OUDA.
+
+They're served by a single HTTP server acting as a proxy, so that the
+backend can use them unmodified, with the real URLs, by passing the server's
+URL as its `proxy`.
+"""
+
+import asyncio
+import dataclasses
+import random
+import re
+from typing import Counter, Dict, Optional
+
+from aiohttp import web
+
+WWW = "www"
+SPARQL = "sparql"
+OUDA = "ouda"
+UPSTREAMS = (WWW, SPARQL, OUDA)
+
+# How to fail injected failures:
+FAILURE_ERROR = "error"  # respond with 503
+FAILURE_TIMEOUT = "timeout"  # don't respond until the client gives up
+FAILURE_MODES = (FAILURE_ERROR, FAILURE_TIMEOUT)
+TIMEOUT_HANG = 60
+
+SPARQL_ID_RE = re.compile(r'"([^"]+)"')
+SPARQL_LIMIT_RE = re.compile(r"limit (\d+)\s*$")
+OUDA_PATH_PREFIX = "/library/digital-archive/module/xcri:"
+
+
+@dataclasses.dataclass
+class UpstreamConfig:
+    latency: float = 0.05  # seconds
+    jitter: float = 0.0  # standard deviation of latency, in seconds
+    failure_rate: float = 0.0
+    failure_mode: str = FAILURE_ERROR
+
+
+@dataclasses.dataclass
+class Catalogue:
+    """
+    Codes known to the stand-ins, by code:
+
+     * active modules have a page on www.open.ac.uk and are in the xcri
+       SPARQL graph,
+     * old modules are in OUDA and in the oldcourses graph.
+
+    Any other code is unknown to all upstreams.
+    """
+
+    active: Dict[str, str] = dataclasses.field(default_factory=dict)
+    old: Dict[str, str] = dataclasses.field(default_factory=dict)
+
+    @staticmethod
+    def module_url(code: str) -> str:
+        return f"http://www.open.ac.uk/courses/modules/{code.lower()}"
+
+
+class FakeUpstreams:
+    """
+    HTTP proxy server answering requests to the open.ac.uk hosts from a
+    `Catalogue`, after a configurable delay, and failing a configurable
+    fraction of them. Counts requests received by each upstream.
+    """
+
+    def __init__(
+        self,
+        catalogue: Catalogue,
+        configs: Optional[Dict[str, UpstreamConfig]] = None,
+        seed: int = 0,
+    ):
+        self.catalogue = catalogue
+        self.configs = {
+            upstream: (configs or {}).get(upstream, UpstreamConfig())
+            for upstream in UPSTREAMS
+        }
+        self.requests: Counter[str] = Counter()
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.proxy_url = ""
+
+    async def start(self) -> str:
+        """
+        Start serving on a random local port, and return the proxy URL.
+        """
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self._handle)
+        self._runner = web.AppRunner(
+            app, access_log=None, handler_cancellation=True
+        )
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        (address,) = self._runner.addresses
+        self.proxy_url = f"http://127.0.0.1:{address[1]}"
+        return self.proxy_url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "FakeUpstreams":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    def _upstream(self, request: web.Request) -> Optional[str]:
+        if request.host == "data.open.ac.uk":
+            return SPARQL
+        if request.host == "www.open.ac.uk":
+            if request.path.startswith(OUDA_PATH_PREFIX):
+                return OUDA
+            return WWW
+        return None
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        upstream = self._upstream(request)
+        if upstream is None:
+            return web.Response(status=502, text=f"Unknown {request.host}")
+        self.requests[upstream] += 1
+        config = self.configs[upstream]
+        delay = self._random.gauss(config.latency, config.jitter)
+        await asyncio.sleep(max(0, delay))
+        if self._random.random() < config.failure_rate:
+            if config.failure_mode == FAILURE_TIMEOUT:
+                await asyncio.sleep(TIMEOUT_HANG)
+            return web.Response(status=503, text="Injected failure")
+        if upstream == SPARQL:
+            return self._sparql(request.query.get("query", ""))
+        if upstream == OUDA:
+            return self._ouda(request.path.removeprefix(OUDA_PATH_PREFIX))
+        return self._www(request.path)
+
+    def _sparql(self, query: str) -> web.Response:
+        if "context/xcri>" in query:
+            known = self.catalogue.active
+        elif "context/oldcourses>" in query:
+            known = self.catalogue.old
+        else:
+            known = {}
+        # other quoted strings (type prefixes) just don't match any code:
+        codes = SPARQL_ID_RE.findall(query)
+        limit = (
+            int(match[1]) if (match := SPARQL_LIMIT_RE.search(query)) else 0
+        )
+        bindings = []
+        for code in codes:
+            if title := known.get(code):
+                binding = {"id": code, "title": title}
+                if known is self.catalogue.active:
+                    binding["url"] = self.catalogue.module_url(code)
+                bindings.append(
+                    {
+                        k: {"type": "literal", "value": v}
+                        for k, v in binding.items()
+                    }
+                )
+        if limit:
+            bindings = bindings[:limit]
+        return web.json_response(
+            {"head": {"vars": []}, "results": {"bindings": bindings}},
+            content_type="application/sparql-results+json",
+        )
+
+    def _ouda(self, code: str) -> web.Response:
+        if title := self.catalogue.old.get(code.upper()):
+            html_title = f"{code.upper()} {title}"
+            html_title += " - Open University Digital Archive"
+        else:
+            html_title = "Open University Digital Archive"
+        return web.Response(
+            text=f"<html><title>{html_title}</title></html>",
+            content_type="text/html",
+        )
+
+    def _www(self, path: str) -> web.Response:
+        code = path.rstrip("/").rsplit("/", 1)[-1].upper()
+        title = self.catalogue.active.get(code)
+        if title and path == f"/courses/modules/{code.lower()}":
+            return web.Response(
+                text=(
+                    f"<html><title>{code} | {title} | Open University"
+                    "</title></html>"
+                ),
+                content_type="text/html",
+            )
+        if title and path == f"/courses/qualifications/details/{code.lower()}":
+            # moved, but to a page for the same module:
+            raise web.HTTPMovedPermanently(self.catalogue.module_url(code))
+        if path == "/courses/":
+            return web.Response(
+                text="<html><title>Courses</title></html>",
+                content_type="text/html",
+            )
+        # OU's masked 404:
+        raise web.HTTPFound("http://www.open.ac.uk/courses/")
@@ -0,0 +1,52 @@
+"""
+Measure how long building the title index of cache.json takes, and the
+latency of `!find` searches in it:
+
+    poetry run python benchmarks/title_search.py [--runs N]
+"""
+
+import argparse
+import statistics
+import time
+
+from oumodulesbot.backend import get_cache_json
+from oumodulesbot.title_search import TitleIndex
+
+QUERIES = (
+    "calculus",
+    "pure maths",
+    "introduction to computing and information technology",
+    "the one about the history of art and design in the modern world",
+    "nothing like that",
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=1000)
+    args = parser.parse_args()
+
+    titles = [(code, title) for code, (title, _) in get_cache_json().items()]
+    start = time.perf_counter()
+    index = TitleIndex.from_titles(titles)
+    print(
+        f"index of {len(index)} titles built in"
+        f" {(time.perf_counter() - start) * 1000:.1f} ms"
+    )
+
+    for query in QUERIES:
+        latencies = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            index.search(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        print(
+            f"{query!r}: p50 {statistics.median(latencies):.3f} ms,"
+            f" p99 {latencies[int(len(latencies) * 0.99)]:.3f} ms,"
+            f" max {latencies[-1]:.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
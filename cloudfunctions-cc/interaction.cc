@@ -8,6 +8,7 @@
 #include <string>
 
 #include "interaction_lib.h"
+#include "ou_names.h"
 #include "verify_ed25519.h"
 
 namespace gcf = ::google::cloud::functions;
@@ -71,5 +72,7 @@ gcf::HttpResponse interactions(const gcf::HttpRequest request) {
 }
 
 int main(int argc, char* argv[]) {
+  // Load the cache before serving, rather than in the first request:
+  ou_modules_bot::OUCacheLoader::Get().Current();
   return gcf::Run(argc, argv, gcf::MakeFunction(interactions));
 }
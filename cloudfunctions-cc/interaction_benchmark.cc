@@ -0,0 +1,81 @@
+// Measures per-request latency of Handler::Handle, i.e. of everything the
+// fast path does for an interaction, apart from parsing the request and
+// publishing to Pub/Sub. Run from a directory with cache.json:
+//
+//   interaction_benchmark [iterations]
+
+#include <algorithm>
+#include <chrono>
+#include <cstdio>
+#include <cstdlib>
+#include <string>
+#include <vector>
+
+#include <nlohmann/json.hpp>
+
+#include "interaction_lib.h"
+
+namespace {
+
+nlohmann::json MakeRequest(const std::string &content) {
+  nlohmann::json request = R"({
+        "data": {
+            "target_id": "foo",
+            "resolved": {"messages": {"foo": {"channel_id": "bar"}}}
+        },
+        "guild_id": "baz",
+        "token": "token",
+        "id": "id"
+    })"_json;
+  request["data"]["resolved"]["messages"]["foo"]["content"] = content;
+  return request;
+}
+
+struct Scenario {
+  const char *name;
+  const char *content;
+};
+
+constexpr Scenario kScenarios[] = {
+    {"one_known", "Is M208 worth it?"},
+    {"five_known", "M208, MST124, MST125, MU123 and TM129 - in this order?"},
+    {"unknown", "What about XYZ999?"},
+    {"no_codes", "Thanks, that's really helpful!"},
+};
+
+double Percentile(std::vector<double> &sorted, double quantile) {
+  size_t index = std::min(sorted.size() - 1,
+                          static_cast<size_t>(sorted.size() * quantile));
+  return sorted[index];
+}
+
+} // namespace
+
+int main(int argc, char *argv[]) {
+  int iterations = argc > 1 ? std::atoi(argv[1]) : 1000;
+  std::printf("%-12s %10s %10s %10s %10s\n", "scenario", "first_us",
+              "p50_us", "p99_us", "mean_us");
+  for (const Scenario &scenario : kScenarios) {
+    nlohmann::json request = MakeRequest(scenario.content);
+    std::vector<double> latencies;
+    latencies.reserve(iterations);
+    for (int i = 0; i < iterations; ++i) {
+      auto start = std::chrono::steady_clock::now();
+      ou_modules_bot_interaction::Handler handler(request);
+      std::string result = handler.Handle();
+      std::chrono::duration<double, std::micro> elapsed =
+          std::chrono::steady_clock::now() - start;
+      latencies.push_back(elapsed.count());
+    }
+    double first = latencies[0];
+    double total = 0;
+    for (double latency : latencies) {
+      total += latency;
+    }
+    std::sort(latencies.begin(), latencies.end());
+    std::printf("%-12s %10.1f %10.1f %10.1f %10.1f\n", scenario.name, first,
+                Percentile(latencies, 0.5), Percentile(latencies, 0.99),
+                total / iterations);
+  }
+  return 0;
+}
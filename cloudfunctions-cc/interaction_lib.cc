@@ -28,15 +28,18 @@ public:
     std::set<std::string> seen;
     ou_modules_bot::OUNames::Iterator it = names.GetIterator();
     while (it.NextItem(item)) {
-      if (item.is_null()) {
+      items_.push_back(item);
+      if (!item.contains("full_name")) {
+        // Resolved by the slow bot, along with the items found so far.
         should_pubsub_ = true;
-        return MakePubSubResult();
-      }
-      if (seen.find(item["code"]) == seen.end()) {
+      } else if (seen.find(item["code"]) == seen.end()) {
         seen.insert(item["code"]);
         fields_.push_back(CreateEmbedField(item));
       }
     }
+    if (should_pubsub_) {
+      return MakePubSubResult();
+    }
 
     return MakeResult(item);
   }
@@ -47,6 +50,9 @@ public:
     pubsub_json["message"] = message_;
     pubsub_json["token"] = token_;
     pubsub_json["interaction_id"] = interaction_id_;
+    // All codes found in the message, in order - with their full names and
+    // urls, except for the unknown ones:
+    pubsub_json["items"] = items_;
     return pubsub_json;
   }
   bool ShouldForwardToSlowBot() { return should_pubsub_; }
@@ -116,6 +122,7 @@ private:
   std::string token_;
   std::string interaction_id_;
   nlohmann::json message_;
+  std::vector<nlohmann::json> items_;
   std::vector<nlohmann::json> fields_;
   std::array<nlohmann::json, 1> embeds_ = {nlohmann::json()};
   bool should_pubsub_;
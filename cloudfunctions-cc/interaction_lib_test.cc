@@ -2,8 +2,13 @@
 #include <gtest/gtest.h>
 #include <nlohmann/json.hpp>
 #include <nlohmann/json_fwd.hpp>
+#include <chrono>
+#include <filesystem>
+#include <fstream>
 #include <string>
 
+#include "ou_names.h"
+
 nlohmann::json MakeRequest(std::string content) {
   nlohmann::json request = R"({
         "data": {
@@ -102,13 +107,14 @@ TEST(InteractionLibTest, Handler_Handle_ForwardToSlowBot) {
   EXPECT_EQ(nlohmann::json::parse(handler.PubSubJsonDump()), R"({
     "interaction_id": "fake_request_id",
     "message": {"channel_id": "fake_channel_id", "content": "M999"},
+    "items": [{"code": "M999"}],
     "target_id": "foo",
     "guild_id": "fake_guild_id",
     "token": "fake_token"})"_json);
 }
 
-TEST(InteractionLibTest, Handler_Handle_ForwardToSlowBot_3Modules) {
-  nlohmann::json request = MakeRequest("T313 & T329 & M999");
+TEST(InteractionLibTest, Handler_Handle_ForwardToSlowBot_WithResolvedItems) {
+  nlohmann::json request = MakeRequest("t313 & T329 & M208 & M999 & m208");
   ou_modules_bot_interaction::Handler handler(request);
 
   EXPECT_EQ(handler.Handle(), R"({"type": 5})");
@@ -116,12 +122,108 @@ TEST(InteractionLibTest, Handler_Handle_ForwardToSlowBot_3Modules) {
   EXPECT_TRUE(handler.ShouldForwardToSlowBot());
   EXPECT_EQ(nlohmann::json::parse(handler.PubSubJsonDump()), R"({
     "interaction_id": "fake_request_id",
-    "message": {"channel_id": "fake_channel_id", "content": "T313 & T329 & M999"},
+    "message": {"channel_id": "fake_channel_id", "content": "t313 & T329 & M208 & M999 & m208"},
+    "items": [
+      {"code": "T313", "full_name": "Renewable energy",
+       "url": "http://www.open.ac.uk/courses/modules/t313"},
+      {"code": "T329"},
+      {"code": "M208", "full_name": "Pure mathematics",
+       "url": "http://www.open.ac.uk/courses/modules/m208"},
+      {"code": "M999"},
+      {"code": "M208", "full_name": "Pure mathematics",
+       "url": "http://www.open.ac.uk/courses/modules/m208"}
+    ],
     "target_id": "foo",
     "guild_id": "fake_guild_id",
     "token": "fake_token"})"_json);
 }
 
+TEST(OUCacheTest, Find) {
+  ou_modules_bot::OUCache cache(R"({
+    "M208": ["Pure mathematics", "http://www.open.ac.uk/courses/modules/m208"],
+    "M203": ["Pure mathematics", null],
+    "A01": ["Some qualification", false]
+  })"_json);
+
+  auto found = cache.Find("m208");
+  ASSERT_TRUE(found);
+  EXPECT_EQ(found->code, "M208");
+  EXPECT_EQ(found->full_name, "Pure mathematics");
+  EXPECT_EQ(found->url, "http://www.open.ac.uk/courses/modules/m208");
+
+  found = cache.Find("M203");
+  ASSERT_TRUE(found);
+  EXPECT_FALSE(found->url);
+
+  found = cache.Find("a01");
+  ASSERT_TRUE(found);
+  EXPECT_FALSE(found->url);
+  EXPECT_FALSE(cache.Find("M2"));
+  EXPECT_FALSE(cache.Find("M2088"));
+  EXPECT_FALSE(cache.Find("ABCDEF123-ABCDEF"));
+  // Misses don't add anything:
+  EXPECT_EQ(cache.size(), 3);
+}
+
+void WriteFile(const std::filesystem::path &path, const std::string &data) {
+  std::ofstream file(path);
+  file << data;
+  file.close();
+  // Make sure each write is seen as a change:
+  static auto modified = std::filesystem::file_time_type::clock::now();
+  modified += std::chrono::seconds(1);
+  std::filesystem::last_write_time(path, modified);
+}
+
+TEST(OUCacheLoaderTest, DeltaOnTopOfBase) {
+  auto dir = std::filesystem::temp_directory_path() / "ou_cache_loader_test";
+  std::filesystem::create_directories(dir);
+  WriteFile(dir / "cache.json", R"({
+    "M208": ["Pure mathematics", null],
+    "MST124": ["Essential mathematics 1", null]
+  })");
+  std::filesystem::remove(dir / "delta.json");
+  ou_modules_bot::OUCacheLoader loader(
+      dir / "cache.json", dir / "delta.json", std::chrono::seconds(0));
+
+  // No delta yet:
+  EXPECT_FALSE(loader.Current().Find("M999"));
+  EXPECT_EQ(loader.Current().Find("M208")->url, std::nullopt);
+
+  WriteFile(dir / "delta.json", R"({
+    "format": 1,
+    "version": 2,
+    "entries": {
+      "M208": ["Pure mathematics", "http://www.open.ac.uk/courses/modules/m208"],
+      "M999": ["Learned module", null]
+    }
+  })");
+  auto cache = loader.Current();
+  EXPECT_EQ(cache.Find("M999")->full_name, "Learned module");
+  EXPECT_EQ(cache.Find("M208")->url,
+            "http://www.open.ac.uk/courses/modules/m208");
+  EXPECT_EQ(cache.Find("MST124")->full_name, "Essential mathematics 1");
+  EXPECT_EQ(loader.delta_version(), 2);
+
+  // Older versions, and invalid or incomplete files are ignored:
+  WriteFile(dir / "delta.json",
+            R"({"format": 1, "version": 1, "entries": {}})");
+  EXPECT_TRUE(loader.Current().Find("M999"));
+  WriteFile(dir / "delta.json", R"({"format": 1, "version": 3, "entr)");
+  EXPECT_TRUE(loader.Current().Find("M999"));
+  WriteFile(dir / "delta.json",
+            R"({"format": 2, "version": 3, "entries": {}})");
+  EXPECT_TRUE(loader.Current().Find("M999"));
+  EXPECT_EQ(loader.delta_version(), 2);
+  // A request keeps using the delta it started with:
+  WriteFile(dir / "delta.json",
+            R"({"format": 1, "version": 3, "entries": {}})");
+  EXPECT_FALSE(loader.Current().Find("M999"));
+  EXPECT_TRUE(cache.Find("M999"));
+
+  std::filesystem::remove_all(dir);
+}
+
 int main(int argc, char **argv) {
   ::testing::InitGoogleTest(&argc, argv);
   return RUN_ALL_TESTS();
@@ -2,10 +2,21 @@
 #define __OUMODULESBOT_CLOUDFUNCTIONS_CC_INTERACTION_OU_NAMES_H_
 
 #include "boost/regex/v5/match_flags.hpp"
+#include <algorithm>
+#include <array>
 #include <cctype>
+#include <chrono>
+#include <cstdint>
+#include <cstdlib>
+#include <filesystem>
 #include <fstream>
 #include <iterator>
+#include <memory>
+#include <mutex>
+#include <optional>
+#include <string>
 #include <string_view>
+#include <vector>
 
 #include <boost/regex.hpp>
 #include <nlohmann/json.hpp>
@@ -20,15 +31,214 @@ inline boost::regex &GetOURegex() {
 }
 } // namespace
 
-class OUNames {
+// Immutable table of cache.json entries, sorted by code, with all strings
+// in a single buffer - so that it can be shared by all requests, and
+// looked up without allocating.
+class OUCache {
+public:
+  // Longest code matched by GetOURegex.
+  static constexpr size_t kMaxCodeSize = 15;
+
+  struct Entry {
+    std::string_view code;
+    std::string_view full_name;
+    std::optional<std::string_view> url;
+  };
+
+  // `json` maps codes to [full name, url], like cache.json - where the url
+  // can also be null or false, if there's none.
+  explicit OUCache(const nlohmann::json &json) {
+    for (const auto &[code, item] : json.items()) {
+      Row row;
+      row.code = Append(code);
+      row.full_name = Append(item[0].get<std::string>());
+      row.has_url = item[1].is_string();
+      if (row.has_url) {
+        row.url = Append(item[1].get<std::string>());
+      }
+      rows_.push_back(row);
+    }
+    std::sort(rows_.begin(), rows_.end(), [this](const Row &a, const Row &b) {
+      return View(a.code) < View(b.code);
+    });
+  }
+
+  static OUCache Load(const std::string &path) {
+    std::ifstream file(path);
+    return OUCache(nlohmann::json::parse(file));
+  }
+
+  // Looks `name` up case-insensitively.
+  std::optional<Entry> Find(std::string_view name) const {
+    std::array<char, kMaxCodeSize> buffer;
+    if (name.size() > buffer.size()) {
+      return std::nullopt;
+    }
+    std::transform(name.begin(), name.end(), buffer.begin(),
+                   [](unsigned char c) { return std::toupper(c); });
+    std::string_view code(buffer.data(), name.size());
+    auto it = std::lower_bound(rows_.begin(), rows_.end(), code,
+                               [this](const Row &row, std::string_view code) {
+                                 return View(row.code) < code;
+                               });
+    if (it == rows_.end() || View(it->code) != code) {
+      return std::nullopt;
+    }
+    Entry entry{View(it->code), View(it->full_name), std::nullopt};
+    if (it->has_url) {
+      entry.url = View(it->url);
+    }
+    return entry;
+  }
+
+  size_t size() const { return rows_.size(); }
+
+private:
+  struct Span {
+    uint32_t offset = 0;
+    uint32_t size = 0;
+  };
+
+  struct Row {
+    Span code;
+    Span full_name;
+    Span url;
+    bool has_url = false;
+  };
+
+  Span Append(const std::string &value) {
+    Span span{static_cast<uint32_t>(strings_.size()),
+              static_cast<uint32_t>(value.size())};
+    strings_ += value;
+    return span;
+  }
+
+  std::string_view View(Span span) const {
+    return std::string_view(strings_).substr(span.offset, span.size);
+  }
+
+  std::string strings_;
+  std::vector<Row> rows_;
+};
+
+// Entries learned by the slow bot, on top of cache.json.
+class LayeredOUCache {
+public:
+  LayeredOUCache(std::shared_ptr<const OUCache> base,
+                 std::shared_ptr<const OUCache> delta)
+      : base_(std::move(base)), delta_(std::move(delta)) {}
+
+  std::optional<OUCache::Entry> Find(std::string_view name) const {
+    if (delta_) {
+      if (auto entry = delta_->Find(name)) {
+        return entry;
+      }
+    }
+    return base_->Find(name);
+  }
+
+private:
+  std::shared_ptr<const OUCache> base_;
+  // Kept alive by each request using it, even if reloaded meanwhile.
+  std::shared_ptr<const OUCache> delta_;
+};
+
+// Loads cache.json once, and the delta file exported from the slow bot's
+// learned entries (see oumodulesbot/cache_delta.py) on top of it - checking
+// for a newer version of the delta every `reload_interval`.
+class OUCacheLoader {
 public:
-  OUNames(std::string message) : message_(message) {
-    std::ifstream file("cache.json");
-    file >> cache_;
+  static constexpr int kDeltaFormat = 1;
+
+  OUCacheLoader(const std::string &base_path, std::string delta_path,
+                std::chrono::steady_clock::duration reload_interval)
+      : base_(std::make_shared<const OUCache>(OUCache::Load(base_path))),
+        delta_path_(std::move(delta_path)),
+        reload_interval_(reload_interval) {}
+
+  // The loader for all requests handled by this process. The delta is read
+  // from OU_BOT_CACHE_DELTA, or cache_delta.json, if it exists.
+  static OUCacheLoader &Get() {
+    static OUCacheLoader loader("cache.json", GetDeltaPath(),
+                                std::chrono::seconds(60));
+    return loader;
+  }
+
+  LayeredOUCache Current() {
+    auto now = std::chrono::steady_clock::now();
+    std::unique_lock<std::mutex> lock(mutex_);
+    if (now >= next_check_) {
+      // Other requests carry on with the current delta in the meantime:
+      next_check_ = now + reload_interval_;
+      lock.unlock();
+      Reload();
+      lock.lock();
+    }
+    return LayeredOUCache(base_, delta_);
+  }
+
+  int64_t delta_version() {
+    std::lock_guard<std::mutex> lock(mutex_);
+    return delta_version_;
+  }
+
+private:
+  static std::string GetDeltaPath() {
+    const char *path = std::getenv("OU_BOT_CACHE_DELTA");
+    return path ? path : "cache_delta.json";
+  }
+
+  void Reload() {
+    std::error_code error;
+    auto modified = std::filesystem::last_write_time(delta_path_, error);
+    if (error || modified == delta_modified_) {
+      return;
+    }
+    delta_modified_ = modified;
+    std::ifstream file(delta_path_);
+    auto json = nlohmann::json::parse(file, /*cb=*/nullptr,
+                                      /*allow_exceptions=*/false);
+    // Partially written, or from an incompatible exporter - the current
+    // delta is kept:
+    if (!json.is_object() || json.value("format", 0) != kDeltaFormat ||
+        !json["version"].is_number_integer() ||
+        !json["entries"].is_object()) {
+      return;
+    }
+    int64_t version = json["version"];
+    std::shared_ptr<const OUCache> delta;
+    try {
+      delta = std::make_shared<const OUCache>(json["entries"]);
+    } catch (const nlohmann::json::exception &) {
+      return;
+    }
+    std::lock_guard<std::mutex> lock(mutex_);
+    if (version > delta_version_) {
+      delta_ = std::move(delta);
+      delta_version_ = version;
+    }
   }
 
+  const std::shared_ptr<const OUCache> base_;
+  const std::string delta_path_;
+  const std::chrono::steady_clock::duration reload_interval_;
+  // Only used by the thread reloading the delta:
+  std::filesystem::file_time_type delta_modified_;
+
+  std::mutex mutex_;
+  std::shared_ptr<const OUCache> delta_;
+  int64_t delta_version_ = 0;
+  std::chrono::steady_clock::time_point next_check_;
+};
+
+class OUNames {
+public:
+  OUNames(std::string message,
+          LayeredOUCache cache = OUCacheLoader::Get().Current())
+      : message_(message), cache_(std::move(cache)) {}
+
   struct Iterator {
-    Iterator(const std::string& message, nlohmann::json *cache) {
+    Iterator(const std::string& message, const LayeredOUCache *cache) {
       cache_ = cache;
       flags_ = boost::match_default;
       message_ = message;
@@ -42,8 +252,8 @@ public:
                               flags_)) {
         flags_ |= boost::match_prev_avail;
         flags_ |= boost::match_not_bob;
-        item = ResolveItem(std::string((const char *)match_[0].first,
-                                       match_[0].second - match_[0].first));
+        item = ResolveItem(std::string_view(
+            &*match_[0].first, match_[0].second - match_[0].first));
         return true;
       }
       return false;
@@ -52,30 +262,36 @@ public:
   private:
     friend class OUNames;
 
-    nlohmann::json ResolveItem(const std::string &name) {
-      std::string uppercase = name;
-      std::transform(name.begin(), name.end(), uppercase.begin(),
-                     [](unsigned char c) { return std::toupper(c); });
-      auto result = (*cache_)[uppercase];
-      if (result.is_null()) {
-        return nullptr;
+    // Returns the code's entry, or just its uppercase code if it's unknown.
+    nlohmann::json ResolveItem(std::string_view name) {
+      std::optional<OUCache::Entry> entry = cache_->Find(name);
+      if (!entry) {
+        std::string uppercase(name);
+        std::transform(name.begin(), name.end(), uppercase.begin(),
+                       [](unsigned char c) { return std::toupper(c); });
+        return {{"code", std::move(uppercase)}};
+      }
+      nlohmann::json url = nullptr;
+      if (entry->url) {
+        url = std::string(*entry->url);
       }
-      return {
-          {"code", uppercase}, {"full_name", result[0]}, {"url", result[1]}};
+      return {{"code", std::string(entry->code)},
+              {"full_name", std::string(entry->full_name)},
+              {"url", std::move(url)}};
     }
 
     std::string message_;
     boost::match_flag_type flags_;
     boost::match_results<std::string_view::const_iterator> match_;
 
-    nlohmann::json *cache_;
+    const LayeredOUCache *cache_;
   };
 
   Iterator GetIterator() { return Iterator(message_, &cache_); }
 
 private:
   std::string message_;
-  nlohmann::json cache_;
+  LayeredOUCache cache_;
 };
 
 } // namespace ou_modules_bot
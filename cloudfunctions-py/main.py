@@ -1,124 +1,106 @@
 import asyncio
+import atexit
 import base64
 import dataclasses
+import functools
 import json
 import logging
 import os
-import re
-from typing import List
+import threading
 
 import httpx
-from flask import Flask, request  # type: ignore
-from google.cloud import pubsub_v1  # type: ignore
-
-from oumodulesbot.main import (
-    OUModulesBackend,
-    OUModulesBot,
-    Result,
-    claim_message,
-)
-from oumodulesbot.ou_utils import MODULE_OR_QUALIFICATION_CODE_RE_TEMPLATE
-
-MODULE_OR_QUALIFICATION_CODE_RE = re.compile(
-    MODULE_OR_QUALIFICATION_CODE_RE_TEMPLATE
-)
-APPLICATION_ID = 511181619785236500
-backend = OUModulesBackend()
-pubsub_client = pubsub_v1.PublisherClient()
-topic_path = pubsub_client.topic_path("ou-modules-bot", "interactions")
+from flask import Flask, Response, request  # type: ignore
+
+# Only import-light modules - not oumodulesbot.main, which needs discord.py:
+from oumodulesbot.backend import OUModulesBackend
+from oumodulesbot.claims import get_claim_store
+from oumodulesbot.http_client import make_client
+from oumodulesbot.interactions import find_modules
+from oumodulesbot.metrics import CONTENT_TYPE
+
+# Pub/Sub pushes handled at once by each instance - the server needs at
+# least as many request threads, e.g. Cloud Run concurrency:
+CONCURRENCY = int(os.environ.get("OU_BOT_CONCURRENCY", 16))
+claim_store = get_claim_store()
 
 log = logging.getLogger("main")
+# All coroutines run on a single event loop in a dedicated thread, so that
+# pushes handled by different request threads share it - along with the
+# backend's and webhook's pooled HTTP clients bound to it (see Clients):
 event_loop = asyncio.new_event_loop()
-asyncio.set_event_loop(event_loop)
+threading.Thread(
+    target=event_loop.run_forever, name="event-loop", daemon=True
+).start()
+
+
+def run_in_loop(coroutine):
+    """
+    Run `coroutine` on `event_loop`, blocking the calling thread until it's
+    done - without blocking the other threads' coroutines.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, event_loop).result()
+
+
+semaphore = asyncio.Semaphore(CONCURRENCY)
+
+
+@dataclasses.dataclass(frozen=True)
+class Clients:
+    backend: OUModulesBackend
+    webhook: httpx.AsyncClient
+
+
+_clients_lock = threading.Lock()
+
+
+@functools.cache
+def _connect() -> Clients:
+    backend = OUModulesBackend(
+        store_path=os.environ.get("OU_BOT_CACHE_DB"),
+        binary_cache_path=os.environ.get("OU_BOT_BINARY_CACHE"),
+        # titles aren't searched here, so not indexed upfront:
+        index_titles=False,
+    )
+    run_in_loop(backend.start())
+    return Clients(backend, make_client())
+
+
+def get_clients() -> Clients:
+    """
+    Return the backend and the webhook client, created on first use rather
+    than at import time, to keep cold starts fast. Called from request
+    threads only - not from `event_loop`, which it may wait for.
+    """
+    with _clients_lock:
+        return _connect()
+
+
+@atexit.register
+def close_clients():
+    with _clients_lock:
+        clients = _connect() if _connect.cache_info().currsize else None
+
+    async def close():
+        if clients:
+            await clients.backend.aclose()
+            await clients.webhook.aclose()
+        await claim_store.aclose()
+
+    run_in_loop(close())
+    event_loop.call_soon_threadsafe(event_loop.stop)
 
 
 def handle_pubsub(data):
     logging.basicConfig(level=logging.INFO)
     decoded = base64.b64decode(data["message"]["data"])
     log.info("Received request: %s", decoded)
-    event_loop.run_until_complete(find_modules(json.loads(decoded)))
-
-
-async def find_modules(data):
-    message = data["message"]
-    content = message["content"]
-    results = []
-    calls = []
-    codes = MODULE_OR_QUALIFICATION_CODE_RE.findall(content)[
-        : OUModulesBot.MODULES_COUNT_LIMIT
-    ]
-    async with claim_message(
-        f'{data["target_id"]}_{data["interaction_id"]}'
-    ) as claimed:
-        if not claimed:
-            # Avoid replying twice by two instances.
-            return
-        seen = set()
-        for code in codes:
-            if code in seen:  # Avoid duplicates.
-                continue
-            seen.add(code)
-            calls.append(backend.find_result_for_code(code.upper()))
-        for code, result in zip(codes, await asyncio.gather(*calls)):
-            if result:
-                results.append(result)
-            else:
-                results.append(Result(code.upper(), "Not found", None))
-        response = FoundModules(results).as_response_json(data)
-        log.info("Sending response: %s", response)
-        result = httpx.patch(
-            "https://discord.com/api/v10/webhooks/"
-            f"{APPLICATION_ID}/{data['token']}/messages/@original",
-            json=response,
-        )
-        log.info("Result: %s", result.text)
-
-
-@dataclasses.dataclass
-class FoundModules:
-    modules_list: List[Result]
-
-    def as_response_json(self, input_data):
-        guild_id = input_data["guild_id"]
-        channel_id = input_data["message"]["channel_id"]
-        target_id = input_data["target_id"]
-        url = (
-            f"https://discord.com/channels/{guild_id}/{channel_id}/{target_id}"
-        )
-        data = {
-            "components": [
-                {
-                    "type": 1,
-                    "components": [
-                        {
-                            "type": 2,
-                            "style": 5,
-                            "label": "Jump to referenced message",
-                            "url": url,
-                        }
-                    ],
-                }
-            ],
-        }
-        if len(self.modules_list) > 1:
-            data["content"] = "Multiple results found."
-            data["embeds"] = self._multiple_modules_embeds()
-        else:
-            data["content"] = OUModulesBot.format_result(self.modules_list[0])
-        return data
-
-    def _multiple_modules_embeds(self):
-        return [
-            {
-                "fields": [
-                    {
-                        "name": m.code,
-                        "value": OUModulesBot.format_result(m, for_embed=True),
-                    }
-                    for m in self.modules_list
-                ],
-            }
-        ]
+    run_in_loop(handle_interaction(json.loads(decoded), get_clients()))
+
+
+async def handle_interaction(data, clients):
+    # pushes beyond the limit wait here, without holding any connections:
+    async with semaphore:
+        await find_modules(data, clients.backend, clients.webhook, claim_store)
 
 
 app = Flask(__name__)
@@ -130,5 +112,12 @@ def interaction():
     return "OK"
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(
+        get_clients().backend.metrics.render(), content_type=CONTENT_TYPE
+    )
+
+
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
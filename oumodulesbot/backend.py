@@ -1,20 +1,58 @@
 import asyncio
+import dataclasses
+import functools
 import importlib
 import json
 import logging
 import re
-from typing import Dict, Optional, Tuple
+import time
+from typing import (
+    Awaitable,
+    Callable,
+    ChainMap,
+    Coroutine,
+    Counter,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
 import httpx
+import pylru
 
 import oumodulesbot
-from oumodulesbot.ou_sparql_utils import find_module_or_qualification
+from oumodulesbot.binary_cache import BinaryCache, get_digest
+from oumodulesbot.cache_store import LEARNED_MAX_AGE, CacheItem, CacheStore
+from oumodulesbot.circuit_breaker import (
+    FAILURE_THRESHOLD,
+    RESET_TIMEOUT,
+    CircuitBreaker,
+)
+from oumodulesbot.http_client import (
+    KEEPALIVE_EXPIRY,
+    MAX_CONNECTIONS,
+    MAX_CONNECTIONS_PER_HOST,
+    make_client,
+    raise_for_server_error,
+)
+from oumodulesbot.metrics import BackendMetrics
+from oumodulesbot.ou_sparql_utils import (
+    find_module_or_qualification,
+    find_modules_or_qualifications,
+)
 from oumodulesbot.ou_utils import (
     MODULE_CODE_RE_TEMPLATE,
     MODULE_OR_QUALIFICATION_CODE_RE_TEMPLATE,
     Result,
     get_possible_urls_from_code,
 )
+from oumodulesbot.source_scheduler import SourceScheduler
+from oumodulesbot.title_search import TitleIndex
 
 MODULE_TITLE_OUDA_RE = re.compile(
     r"<title>" + MODULE_CODE_RE_TEMPLATE + r" (.*?)"
@@ -49,9 +87,95 @@ HTML_TITLE_TAG_RES = [
 ]
 
 
+# How long to remember codes which couldn't be found by any source:
+NEGATIVE_CACHE_TTL = 15 * 60
+# Shorter TTL used when at least one source failed instead of answering,
+# because the code might still be found once the upstream recovers:
+NEGATIVE_CACHE_TRANSIENT_TTL = 60
+NEGATIVE_CACHE_SIZE = 1000
+# Minimum time between background checks whether a cached module without
+# URL became active again:
+REVALIDATE_INTERVAL = 24 * 60 * 60
+# How long `find_result_for_code` waits for upstream sources, at most:
+LOOKUP_DEADLINE = 10
+SEARCH_RESULTS_LIMIT = 5
+
+# Reasons why a source didn't provide a result:
+FAILURE_NOT_FOUND = "not found"
+FAILURE_TIMEOUT = "timeout"
+FAILURE_ERROR = "error"
+FAILURE_CIRCUIT_OPEN = "circuit open"
+
+UPSTREAM_SOURCES = ("sparql", "url", "ouda")
+
 logger = logging.getLogger(__name__)
 
-CacheItem = Tuple[str, Optional[str]]  # title, url
+
+@dataclasses.dataclass(frozen=True)
+class NegativeCacheEntry:
+    expires_at: float
+    # source name -> one of the FAILURE_* reasons:
+    failures: Dict[str, str]
+
+
+class SparqlBatch:
+    """
+    A single SPARQL query for multiple codes, shared by their lookups.
+
+    It's sent by the first of them to get to SPARQL as planned by the
+    scheduler - not at all, if they're all answered by other sources
+    first. It's sent at most once, if its circuit breaker allows it, and its
+    outcome is recorded in the breaker once for the whole batch, rather
+    than by each code's lookup.
+    """
+
+    def __init__(
+        self,
+        codes: Sequence[str],
+        client: httpx.AsyncClient,
+        breaker: CircuitBreaker,
+    ):
+        self.codes = codes
+        self.client = client
+        self.breaker = breaker
+        self.task: Optional[asyncio.Task] = None
+        self.allowed: Optional[bool] = None
+
+    def start(self) -> bool:
+        """
+        Send the query, unless it was already tried. Returns whether it was
+        sent, i.e. whether its circuit allowed it.
+        """
+        if self.allowed is None:
+            self.allowed = self.breaker.allow()
+            if self.allowed:
+                self.task = asyncio.create_task(
+                    find_modules_or_qualifications(self.codes, self.client)
+                )
+                self.task.add_done_callback(self._record_outcome)
+        return self.allowed
+
+    def _record_outcome(self, task: asyncio.Task) -> None:
+        if task.cancelled():
+            self.breaker.record_cancelled()
+        elif task.exception():
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    async def get(self, code: str) -> Optional[Result]:
+        assert self.task, "get() called before start()"
+        # Shielded, because other codes' lookups still need the batch when
+        # this code's lookup is finished by a different source first:
+        return (await asyncio.shield(self.task)).get(code)
+
+    async def cancel(self) -> None:
+        """
+        Cancel the query, if it's still running.
+        """
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
 
 
 def find_title_in_html(html: str) -> Optional[str]:
@@ -61,50 +185,329 @@ def find_title_in_html(html: str) -> Optional[str]:
     return None
 
 
-def make_client():
-    headers = {
-        "User-Agent": (
-            "ou-modules-bot / 0.0.0 (https://modules-bot.ou-stem.club/)"
-        )
-    }
-    return httpx.AsyncClient(headers=headers)
-
-
 def get_cache_json():
     cache_file = importlib.resources.files(oumodulesbot) / "cache.json"
     return json.load(cache_file.open("r"))
 
 
+def get_cache_json_digest() -> bytes:
+    cache_file = importlib.resources.files(oumodulesbot) / "cache.json"
+    return get_digest(cache_file.read_bytes())
+
+
+def get_cache(
+    binary_cache_path: Optional[str] = None,
+) -> Mapping[str, CacheItem]:
+    """
+    Load cache.json, or its binary version from `binary_cache_path` if it's
+    available and up to date.
+    """
+    if binary_cache_path:
+        try:
+            binary_cache = BinaryCache(binary_cache_path)
+        except (OSError, ValueError):
+            logger.warning(f"Can't use {binary_cache_path}", exc_info=True)
+        else:
+            if binary_cache.digest == get_cache_json_digest():
+                return binary_cache
+            logger.warning(f"{binary_cache_path} is out of date")
+    return {k: tuple(v) for k, v in get_cache_json().items()}
+
+
 class OUModulesBackend:
-    def __init__(self):
-        self.cache: Dict[str, CacheItem] = {
-            k: tuple(v) for k, v in get_cache_json().items()
+    def __init__(
+        self,
+        negative_cache_ttl: float = NEGATIVE_CACHE_TTL,
+        negative_cache_transient_ttl: float = NEGATIVE_CACHE_TRANSIENT_TTL,
+        negative_cache_size: int = NEGATIVE_CACHE_SIZE,
+        max_connections: int = MAX_CONNECTIONS,
+        max_connections_per_host: int = MAX_CONNECTIONS_PER_HOST,
+        keepalive_expiry: float = KEEPALIVE_EXPIRY,
+        http2: bool = False,
+        proxy: Optional[str] = None,
+        revalidate_interval: float = REVALIDATE_INTERVAL,
+        store_path: Optional[str] = None,
+        learned_max_age: float = LEARNED_MAX_AGE,
+        binary_cache_path: Optional[str] = None,
+        adaptive_sources: bool = True,
+        breaker_failure_threshold: int = FAILURE_THRESHOLD,
+        breaker_reset_timeout: float = RESET_TIMEOUT,
+        lookup_deadline: float = LOOKUP_DEADLINE,
+        index_titles: bool = True,
+    ):
+        # entries learned at runtime are kept in the first, writable map,
+        # on top of the read-only cache.json data (only the first map of
+        # a ChainMap is ever modified, so it's fine for the rest to be
+        # immutable):
+        self.cache: ChainMap[str, CacheItem] = ChainMap(
+            {}, get_cache(binary_cache_path)  # type: ignore[arg-type]
+        )
+        # entries learned at runtime, persisted if `store_path` is given,
+        # and looked up again after `learned_max_age` seconds:
+        self.store = CacheStore(store_path) if store_path else None
+        if self.store:
+            self.cache.update(
+                self.store.load(learned_max_age, base=self.cache.maps[1])
+            )
+        # full-text search of titles, built upfront if `index_titles`, or
+        # on first use otherwise:
+        self._title_index: Optional[TitleIndex] = None
+        if index_titles:
+            self.title_index
+        self.negative_cache_ttl = negative_cache_ttl
+        self.negative_cache_transient_ttl = negative_cache_transient_ttl
+        # code -> NegativeCacheEntry
+        self.negative_cache = pylru.lrucache(negative_cache_size)
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        # upstream_lookups - lookups which queried the upstream sources,
+        # coalesced_lookups - lookups which waited for one of those instead:
+        self.stats: Counter[str] = Counter()
+        self.metrics = BackendMetrics()
+        # learns which upstream source to try first for each kind of code,
+        # if enabled - otherwise all of them are always raced at once:
+        self.scheduler = (
+            SourceScheduler(UPSTREAM_SOURCES) if adaptive_sources else None
+        )
+        # stop querying sources which keep failing, for a while:
+        self.breakers = {
+            name: CircuitBreaker(
+                name, breaker_failure_threshold, breaker_reset_timeout
+            )
+            for name in UPSTREAM_SOURCES
         }
+        self.lookup_deadline = lookup_deadline
+        self.metrics.in_flight_lookups.set_function(
+            lambda: len(self._in_flight)
+        )
+        self.metrics.background_tasks.set_function(
+            lambda: len(self._background_tasks)
+        )
+        self.revalidate_interval = revalidate_interval
+        # code -> time.time() of the last background check of its URL:
+        self.url_checked_at: Dict[str, float] = {}
+        self._background_tasks: Set[asyncio.Task] = set()
+        self._make_client = functools.partial(
+            make_client,
+            max_connections=max_connections,
+            max_connections_per_host=max_connections_per_host,
+            keepalive_expiry=keepalive_expiry,
+            http2=http2,
+            proxy=proxy,
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Long-lived HTTP client shared by all lookups, so that connections
+        to open.ac.uk hosts are kept alive between them.
 
-    async def _try_cache(self, code) -> Optional[Result]:
+        Created on first use if `start` wasn't called.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = self._make_client()
+        return self._client
+
+    @property
+    def title_index(self) -> TitleIndex:
+        """
+        Index of all cached titles, kept up to date with learned entries.
+        """
+        if self._title_index is None:
+            self._title_index = TitleIndex.from_titles(
+                (code, title) for code, (title, _) in self.cache.items()
+            )
+        return self._title_index
+
+    async def start(self) -> None:
+        """
+        Startup hook - creates the shared HTTP client upfront.
+        """
+        self.client
+
+    async def aclose(self) -> None:
+        """
+        Shutdown hook - cancels lookups and background checks, writes
+        learned entries and closes pooled connections.
+        """
+        tasks = [*self._in_flight.values(), *self._background_tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.store:
+            await self.store.aclose()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self) -> "OUModulesBackend":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    def _try_negative_cache(self, code: str) -> Optional[NegativeCacheEntry]:
+        entry = self.negative_cache.get(code)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self.negative_cache[code]
+            return None
+        return entry
+
+    def _remember_failure(self, code: str, failures: Dict[str, str]) -> None:
+        transient = any(
+            reason != FAILURE_NOT_FOUND for reason in failures.values()
+        )
+        ttl = (
+            self.negative_cache_transient_ttl
+            if transient
+            else self.negative_cache_ttl
+        )
+        self.negative_cache[code] = NegativeCacheEntry(
+            time.monotonic() + ttl, dict(failures)
+        )
+        logger.info(f"{code} not found ({failures}), remembering for {ttl}s")
+
+    async def _try_source(
+        self,
+        name: str,
+        code: str,
+        lookup: Awaitable[Optional[Result]],
+        failures: Dict[str, str],
+        breaker: Optional[CircuitBreaker],
+    ) -> Optional[Result]:
+        """
+        Await a single source's `lookup`, recording in `failures` why it
+        didn't provide a result, if it didn't, its outcome and latency in
+        `metrics`, and whether it failed in `breaker`, if given.
+        """
+        metrics = self.metrics
+        metrics.in_flight_requests.inc(source=name)
+        start = time.perf_counter()
+        try:
+            result = await self._await_source(name, code, lookup, failures)
+        except asyncio.CancelledError:
+            # lost the race to another source
+            if breaker:
+                breaker.record_cancelled()
+            metrics.source_outcomes.inc(source=name, outcome="cancelled")
+            raise
+        finally:
+            metrics.in_flight_requests.dec(source=name)
+        metrics.source_duration.observe(
+            time.perf_counter() - start, source=name
+        )
+        outcome = failures.get(name, "found")
+        if breaker:
+            if outcome in (FAILURE_TIMEOUT, FAILURE_ERROR):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+        metrics.source_outcomes.inc(
+            source=name, outcome=outcome.replace(" ", "_")
+        )
+        return result
+
+    async def _await_source(
+        self,
+        name: str,
+        code: str,
+        lookup: Awaitable[Optional[Result]],
+        failures: Dict[str, str],
+    ) -> Optional[Result]:
+        try:
+            result = await lookup
+        except httpx.TimeoutException:
+            logger.warning(f"{name} timeout for {code}")
+            failures[name] = FAILURE_TIMEOUT
+            return None
+        except Exception:
+            logger.exception(f"{name} failed for {code}")
+            failures[name] = FAILURE_ERROR
+            return None
+        if not result:
+            failures[name] = FAILURE_NOT_FOUND
+        return result
+
+    def _try_cache(self, code) -> Optional[Result]:
         if code not in self.cache:
             logger.info(f"{code} not in cache")
             return None
         cached_result = self.cache[code]
         title = cached_result[0]
         url = cached_result[1]
-        # try to make sure URL really isn't reachable, by autogenerating one:
-        if (not url) and (active_url := await self._get_url_if_active(code)):
-            url = active_url
-            logger.info(f"{code} has no url in cache, but {url} is reachable")
-            self.cache[code] = (title, url)
+        if not url:
+            # answer from cache right away, but check in the background
+            # whether the module became active again:
+            self._schedule_url_revalidation(code)
         return Result(code, title, url)
 
+    def _schedule_url_revalidation(self, code: str) -> None:
+        checked_at = self.url_checked_at.get(code)
+        if (
+            checked_at is not None
+            and time.time() - checked_at < self.revalidate_interval
+        ):
+            return
+        # recorded upfront, so that concurrent hits don't repeat the check:
+        self.url_checked_at[code] = time.time()
+        self._add_background_task(self._revalidate_url(code))
+
+    def _add_background_task(self, coro: Coroutine) -> None:
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _revalidate_url(self, code: str) -> None:
+        """
+        Try to make sure a cached module's URL really isn't reachable,
+        by autogenerating one, and cache it if it is.
+        """
+        breaker = self.breakers["url"]
+        if not breaker.allow():
+            logger.info(f"Not checking {code} URL, url circuit is open")
+            # check again on the next cache hit instead:
+            del self.url_checked_at[code]
+            return
+        try:
+            active_url = await self._get_url_if_active(code)
+        except asyncio.CancelledError:
+            breaker.record_cancelled()
+            raise
+        except httpx.TimeoutException:
+            logger.warning(f"{code} URL check timeout")
+            breaker.record_failure()
+            return
+        except Exception:
+            logger.exception(f"{code} URL check failed")
+            breaker.record_failure()
+            return
+        breaker.record_success()
+        if active_url:
+            logger.info(f"{code} has no url in cache, but {active_url} is up")
+            title, _ = self.cache[code]
+            self._learn(code, (title, active_url))
+
+    def _learn(self, code: str, item: CacheItem) -> None:
+        self.cache[code] = item
+        if self._title_index is not None:
+            self._title_index.add(code, item[0])
+        if self.store:
+            self.store.put(code, item)
+
+    async def wait_for_background_tasks(self) -> None:
+        """
+        Wait until all background tasks scheduled so far are done.
+        """
+        while self._background_tasks:
+            await asyncio.gather(*self._background_tasks)
+
     async def _try_url(self, code) -> Optional[Result]:
         if active_url := await self._get_url_if_active(code):
-            async with make_client() as client:
-                try:
-                    result = await client.get(
-                        active_url, follow_redirects=True
-                    )
-                except httpx.ReadTimeout:
-                    logger.warning("www.open.ac.uk timeout")
-                    return None
+            result = await self.client.get(active_url, follow_redirects=True)
+            raise_for_server_error(result)
             if found_title := find_title_in_html(result.text):
                 logger.info(f"{code} found via {active_url}")
                 return Result(code, found_title, active_url)
@@ -113,18 +516,10 @@ class OUModulesBackend:
 
     async def _try_ouda(self, code) -> Optional[Result]:
         ouda_url = OUDA_URL_TEMPLATE.format(code)
-        try:
-            logger.info(f"Trying {ouda_url}")
-            async with make_client() as client:
-                try:
-                    response = await client.get(ouda_url)
-                except httpx.ReadTimeout:
-                    logger.warning("OUDA timeout")
-                    return None
-            html = response.content.decode("utf-8")
-        except Exception:
-            logger.exception(f"Failed fetching {ouda_url}")
-            return None
+        logger.info(f"Trying {ouda_url}")
+        response = await self.client.get(ouda_url)
+        raise_for_server_error(response)
+        html = response.content.decode("utf-8")
 
         if titles := MODULE_TITLE_OUDA_RE.findall(html):
             logger.info(f"{code} found via OUDA")
@@ -132,45 +527,251 @@ class OUModulesBackend:
         logger.info(f"{code} can't be found via {ouda_url}")
         return None
 
+    def search_titles(
+        self, query: str, limit: int = SEARCH_RESULTS_LIMIT
+    ) -> List[Result]:
+        """
+        Return results for up to `limit` cached titles best matching
+        `query`, best first.
+        """
+        start = time.perf_counter()
+        found = self.title_index.search(query, limit)
+        self.metrics.title_search_duration.observe(time.perf_counter() - start)
+        results = []
+        for code, _ in found:
+            title, url = self.cache[code]
+            results.append(Result(code, title, url))
+        return results
+
     async def find_result_for_code(self, code: str) -> Optional[Result]:
         """
         Returns a module title for given code, if available.
 
         Tries a lookup in cache, and if it fails then it attempts to query
         the Open University Digital Archive.
+
+        Codes which can't be found anywhere are remembered in the negative
+        cache for a while, to avoid repeating the upstream requests.
+        Concurrent lookups of the same code share a single upstream lookup.
+
+        Returns None if the upstream sources don't answer within
+        `lookup_deadline` - the lookup continues in the background, and
+        its result is cached once it's done.
         """
-        code = code.upper()
+        (result,) = await self.find_results_for_codes([code])
+        return result
 
-        # 1. Try cached title:
-        if cached_result := await self._try_cache(code):
-            return cached_result
+    async def find_results_for_codes(
+        self, codes: Iterable[str]
+    ) -> List[Optional[Result]]:
+        """
+        Returns results for multiple codes, in the same order as `codes`,
+        with None for codes which weren't found.
+
+        Works like `find_result_for_code`, but looks up each distinct code
+        once, and all cache misses at the same time - with a single batched
+        SPARQL query for all of them.
+        """
+        codes = [code.upper() for code in codes]
+        lookups = self.lookup_codes(codes)
+        if lookups:
+            await asyncio.wait(lookups.values(), timeout=self.lookup_deadline)
+        results: Dict[str, Optional[Result]] = {}
+        for code, lookup in lookups.items():
+            if lookup.done():
+                results[code] = lookup.result()
+            else:
+                logger.warning(f"{code} lookup deadline exceeded")
+                self.metrics.deadlines_exceeded.inc()
+                lookup.cancel()
+                results[code] = None
+        return [results[code] for code in codes]
+
+    def lookup_codes(
+        self, codes: Iterable[str]
+    ) -> Dict[str, "asyncio.Future[Optional[Result]]"]:
+        """
+        Start looking up distinct `codes` like `find_results_for_codes`,
+        and return a future with each code's result, by code.
+
+        Cancelling the futures doesn't stop the upstream lookups, so that
+        their results are still cached for subsequent lookups.
+        """
+        lookups: Dict[str, asyncio.Future[Optional[Result]]] = {}
+        misses = []
+        for code in dict.fromkeys(code.upper() for code in codes):
+            # 1. Try cached title:
+            if cached_result := self._try_cache(code):
+                self.metrics.lookups.inc(result="cache_hit")
+                self.metrics.source_wins.inc(source="cache")
+                lookups[code] = self._completed(cached_result)
+            elif negative := self._try_negative_cache(code):
+                logger.info(f"{code} recently not found ({negative.failures})")
+                self.metrics.lookups.inc(result="negative_cache_hit")
+                lookups[code] = self._completed(None)
+            # Only one upstream lookup per code at a time - concurrent
+            # callers share its result:
+            elif in_flight := self._in_flight.get(code):
+                logger.info(f"{code} lookup already in progress, waiting")
+                self.stats["coalesced_lookups"] += 1
+                self.metrics.lookups.inc(result="coalesced")
+                lookups[code] = asyncio.shield(in_flight)
+            else:
+                misses.append(code)
+
+        if misses:
+            for code, lookup in self._start_upstream_lookups(misses).items():
+                lookups[code] = asyncio.shield(lookup)
+        return lookups
+
+    @staticmethod
+    def _completed(
+        result: Optional[Result],
+    ) -> "asyncio.Future[Optional[Result]]":
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(result)
+        return future
+
+    def _start_upstream_lookups(
+        self, codes: Sequence[str]
+    ) -> Dict[str, asyncio.Task]:
+        batch = None
+        if len(codes) > 1:
+            batch = SparqlBatch(codes, self.client, self.breakers["sparql"])
+        lookups = {}
+        for code in codes:
+            lookup = asyncio.create_task(
+                self._find_result_upstream(code, batch)
+            )
+            self._in_flight[code] = lookup
+            lookup.add_done_callback(
+                functools.partial(self._forget_in_flight, code)
+            )
+            self.stats["upstream_lookups"] += 1
+            self.metrics.lookups.inc(result="upstream")
+            lookups[code] = lookup
+        if batch:
+            self._add_background_task(
+                self._finish_batch(batch, lookups.values())
+            )
+        return lookups
+
+    def _forget_in_flight(self, code: str, lookup: asyncio.Task) -> None:
+        self._in_flight.pop(code, None)
+
+    async def _finish_batch(
+        self, batch: SparqlBatch, lookups: Iterable[asyncio.Task]
+    ) -> None:
+        """
+        Cancel the batched SPARQL query once it's no longer needed.
+        """
+        await asyncio.wait(lookups)
+        await batch.cancel()
+
+    async def _find_result_upstream(
+        self, code: str, batch: Optional[SparqlBatch]
+    ) -> Optional[Result]:
+        start = time.perf_counter()
+        result = await self._race_sources(code, batch)
+        self.metrics.upstream_duration.observe(
+            time.perf_counter() - start,
+            result="found" if result else "not_found",
+        )
+        return result
+
+    async def _race_sources(
+        self, code: str, batch: Optional[SparqlBatch]
+    ) -> Optional[Result]:
+        """
+        Start the upstream sources as planned by the scheduler, and return
+        the first result found by any of them. SPARQL results are taken
+        from `batch`, if it's given.
 
+        Sources not started yet are started right away once any other
+        source finishes without a result.
+        """
+        lookups: Dict[str, Callable[[], Awaitable[Optional[Result]]]] = {
+            # 2. Try SPARQL queries:
+            "sparql": (
+                functools.partial(batch.get, code)
+                if batch
+                else functools.partial(
+                    find_module_or_qualification, code, self.client
+                )
+            ),
+            # 3. Try scraping URL with HTML description
+            #    (some results used to be missing from SPARQL results):
+            "url": functools.partial(self._try_url, code),
+            # 4. Try OUDA for old modules:
+            "ouda": functools.partial(self._try_ouda, code),
+        }
+        if self.scheduler:
+            waiting = self.scheduler.plan(code)
+        else:
+            waiting = [(name, 0.0) for name in UPSTREAM_SOURCES]
+        failures: Dict[str, str] = {}
+        # task -> source name, time.perf_counter() when it was started:
+        sources: Dict[asyncio.Task, Tuple[str, float]] = {}
+        unfinished: Set[asyncio.Task] = set()
+        hedge_now = False
+        start = time.perf_counter()
         async with asyncio.TaskGroup() as tg:  # type: ignore
-            unfinished = {
-                # 2. Try SPARQL queries:
-                tg.create_task(find_module_or_qualification(code)),
-                # 3. Try scraping URL with HTML description
-                #    (some results used to be missing from SPARQL results):
-                tg.create_task(self._try_url(code)),
-                # 4. Try OUDA for old modules:
-                tg.create_task(self._try_ouda(code)),
-            }
-
-            while unfinished:
+            while unfinished or waiting:
+                elapsed = time.perf_counter() - start
+                while waiting and (
+                    hedge_now or not unfinished or waiting[0][1] <= elapsed
+                ):
+                    name, _ = waiting.pop(0)
+                    breaker: Optional[CircuitBreaker]
+                    if name == "sparql" and batch:
+                        # recorded by the batch instead, once for all codes:
+                        allowed, breaker = batch.start(), None
+                    else:
+                        breaker = self.breakers[name]
+                        allowed = breaker.allow()
+                    if not allowed:
+                        # answer without it, rather than wait for a timeout
+                        logger.info(f"Skipping {name} for {code}, it's down")
+                        failures[name] = FAILURE_CIRCUIT_OPEN
+                        self.metrics.source_outcomes.inc(
+                            source=name, outcome="circuit_open"
+                        )
+                        hedge_now = True
+                        continue
+                    lookup = self._try_source(
+                        name, code, lookups[name](), failures, breaker
+                    )
+                    task = tg.create_task(lookup)
+                    sources[task] = name, time.perf_counter()
+                    unfinished.add(task)
+                if not unfinished:
+                    break
                 finished, unfinished = await asyncio.wait(
-                    unfinished, return_when=asyncio.FIRST_COMPLETED
+                    unfinished,
+                    timeout=waiting[0][1] - elapsed if waiting else None,
+                    return_when=asyncio.FIRST_COMPLETED,
                 )
                 for task in finished:
-                    result = task.result()
-                    if isinstance(result, Exception):
-                        continue
-                    if result:
+                    if result := task.result():
+                        name, started_at = sources[task]
+                        self.metrics.source_wins.inc(source=name)
+                        if self.scheduler:
+                            self.scheduler.record_win(
+                                code, name, time.perf_counter() - started_at
+                            )
                         for task in unfinished:
                             task.cancel()
-                        self.cache[code] = (result.title, result.url)
+                        for name, _ in waiting:
+                            self.metrics.source_outcomes.inc(
+                                source=name, outcome="skipped"
+                            )
+                        self._learn(code, (result.title, result.url))
                         return result
+                # don't wait any longer for a source which didn't answer:
+                hedge_now = hedge_now or bool(finished)
 
-        return result
+        self._remember_failure(code, failures)
+        return None
 
     async def _is_active_url(self, url: str, code: str) -> bool:
         """
@@ -184,19 +785,18 @@ class OUModulesBackend:
 
         Thus a compromise is used here by allowing redirects, but only if the
         destination page URL includes the module code.
+
+        Timeouts and 5xx responses are raised, so that they aren't mistaken
+        for inactive URLs.
         """
-        async with make_client() as client:
-            try:
-                response = await client.head(
-                    url,
-                    follow_redirects=True,
-                    timeout=3,
-                )
-            except httpx.ReadTimeout:
-                logger.warning("_is_active_url timeout")
-                return False
-            correct_redirect = code.lower() in str(response.url).lower()
-            return correct_redirect and response.status_code == 200
+        response = await self.client.head(
+            url,
+            follow_redirects=True,
+            timeout=3,
+        )
+        raise_for_server_error(response)
+        correct_redirect = code.lower() in str(response.url).lower()
+        return correct_redirect and response.status_code == 200
 
     async def _get_url_if_active(self, code: str) -> Optional[str]:
         """
@@ -212,9 +812,17 @@ class OUModulesBackend:
         if url:
             return url
 
-        # 2. Try constructing it from code
-        for try_url in get_possible_urls_from_code(code):
-            if await self._is_active_url(try_url, code):
+        # 2. Try constructing it from code, checking all candidates at once
+        candidates = list(get_possible_urls_from_code(code))
+        checks = await asyncio.gather(
+            *(self._is_active_url(url, code) for url in candidates),
+            return_exceptions=True,
+        )
+        for try_url, active in zip(candidates, checks):
+            if active is True:
                 return try_url
+        for active in checks:
+            if isinstance(active, BaseException):
+                raise active
 
         return None
@@ -0,0 +1,120 @@
+"""
+Compact binary version of cache.json, queried through `mmap` without parsing.
+
+Layout (little-endian):
+
+ * header: magic, format version, number of entries, SHA-256 of the
+   cache.json the file was built from,
+ * one record per entry, sorted by code: offsets of the code, title and URL
+   strings, and the end of the URL string, relative to the strings blob,
+ * strings blob: UTF-8 code, title and URL of each entry, one after another.
+
+Entries without URL (null or false in JSON) have an empty URL string.
+
+Because the file is mapped read-only, processes on the same host using it
+share its pages instead of each building their own dict.
+"""
+
+import bisect
+import hashlib
+import json
+import mmap
+import struct
+import sys
+from typing import Iterator, Mapping, Optional, Sequence, Tuple
+
+MAGIC = b"OUMC"
+VERSION = 1
+HEADER = struct.Struct("<4sII32s")
+RECORD = struct.Struct("<IIII")
+
+CacheItem = Tuple[str, Optional[str]]  # title, url
+
+
+def get_digest(json_bytes: bytes) -> bytes:
+    return hashlib.sha256(json_bytes).digest()
+
+
+def dump_binary_cache(cache: Mapping[str, Sequence], digest: bytes) -> bytes:
+    records = []
+    blob = bytearray()
+    for code, (title, url) in sorted(cache.items()):
+        key_offset = len(blob)
+        blob += code.encode()
+        title_offset = len(blob)
+        blob += title.encode()
+        url_offset = len(blob)
+        blob += (url or "").encode()
+        records.append(
+            RECORD.pack(key_offset, title_offset, url_offset, len(blob))
+        )
+    header = HEADER.pack(MAGIC, VERSION, len(records), digest)
+    return header + b"".join(records) + bytes(blob)
+
+
+class BinaryCache(Mapping[str, CacheItem]):
+    """
+    Read-only mapping of code -> (title, url) backed by a memory-mapped file
+    created by `dump_binary_cache`. Lookups are binary searches over the
+    sorted records.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._count, self.digest = HEADER.unpack_from(
+            self._mmap
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} isn't a version {VERSION} cache file")
+        self._blob_offset = HEADER.size + self._count * RECORD.size
+
+    def _record(self, index: int) -> Tuple[int, int, int, int]:
+        return RECORD.unpack_from(
+            self._mmap, HEADER.size + index * RECORD.size
+        )
+
+    def _string(self, start: int, end: int) -> bytes:
+        start += self._blob_offset
+        end += self._blob_offset
+        return self._mmap[start:end]
+
+    def _key(self, index: int) -> bytes:
+        key_offset, title_offset, _, _ = self._record(index)
+        return self._string(key_offset, title_offset)
+
+    def __getitem__(self, code: str) -> CacheItem:
+        key = code.encode()
+        index = bisect.bisect_left(range(self._count), key, key=self._key)
+        if index == self._count or self._key(index) != key:
+            raise KeyError(code)
+        _, title_offset, url_offset, end = self._record(index)
+        url = self._string(url_offset, end).decode()
+        return self._string(title_offset, url_offset).decode(), url or None
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self._count):
+            yield self._key(index).decode()
+
+    def __len__(self) -> int:
+        return self._count
+
+
+def main():
+    """
+    Build a binary cache file from a JSON one:
+
+        python -m oumodulesbot.binary_cache [cache.json [cache.bin]]
+    """
+    json_path = sys.argv[1] if len(sys.argv) > 1 else "cache.json"
+    binary_path = sys.argv[2] if len(sys.argv) > 2 else "cache.bin"
+    with open(json_path, "rb") as f:
+        json_bytes = f.read()
+    with open(binary_path, "wb") as f:
+        f.write(
+            dump_binary_cache(json.loads(json_bytes), get_digest(json_bytes))
+        )
+
+
+if __name__ == "__main__":
+    main()
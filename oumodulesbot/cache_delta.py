@@ -0,0 +1,116 @@
+"""
+Export entries learned at runtime (see CacheStore) which cache.json doesn't
+have, or has different, to a delta file loaded by the C++ fast path on top
+of its own copy of cache.json:
+
+    python -m oumodulesbot.cache_delta cache.db cache_delta.json [--every N]
+
+The delta is a JSON object with the format version, a version increasing
+with each export, and the entries, in the same format as cache.json. It's
+replaced atomically, so that readers never see a partially written file.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Dict, Mapping, Optional
+
+from oumodulesbot.backend import get_cache
+from oumodulesbot.cache_store import LEARNED_MAX_AGE, CacheItem, CacheStore
+
+DELTA_FORMAT = 1
+
+logger = logging.getLogger(__name__)
+
+
+def make_delta(
+    learned: Mapping[str, CacheItem], base: Mapping[str, CacheItem]
+) -> Dict[str, CacheItem]:
+    """
+    Return the `learned` entries which are missing from, or differ from,
+    the `base` cache.
+    """
+    return {
+        code: item
+        for code, item in learned.items()
+        if code not in base or tuple(base[code]) != tuple(item)
+    }
+
+
+def read_delta(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            delta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(delta, dict) or delta.get("format") != DELTA_FORMAT:
+        return None
+    return delta
+
+
+def write_delta(path: str, entries: Mapping[str, CacheItem]) -> bool:
+    """
+    Write `entries` to the delta file at `path` with a new version, unless
+    they're the same as in the current file. Returns whether it was written.
+    """
+    data = {code: list(item) for code, item in sorted(entries.items())}
+    current = read_delta(path)
+    if current is not None and current.get("entries") == data:
+        return False
+    version = time.time_ns() // 1_000_000
+    if current is not None and isinstance(current.get("version"), int):
+        # increasing even if the clock went back:
+        version = max(version, current["version"] + 1)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {"format": DELTA_FORMAT, "version": version, "entries": data},
+            f,
+            indent=1,
+        )
+    os.replace(tmp_path, path)
+    logger.info(f"Exported {len(data)} entries to {path}, version {version}")
+    return True
+
+
+def export_delta(
+    store_path: str, delta_path: str, base: Mapping[str, CacheItem]
+) -> bool:
+    store = CacheStore(store_path)
+    try:
+        learned = store.load(LEARNED_MAX_AGE, base=base)
+    finally:
+        store.close()
+    return write_delta(delta_path, make_delta(learned, base))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("store", help="SQLite file from OU_BOT_CACHE_DB")
+    parser.add_argument("output")
+    parser.add_argument(
+        "--every",
+        type=float,
+        help="keep exporting every this many seconds",
+    )
+    parser.add_argument(
+        "--binary-cache", default=os.environ.get("OU_BOT_BINARY_CACHE")
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level="INFO")
+
+    base = get_cache(args.binary_cache)
+    while True:
+        export_delta(args.store, args.output, base)
+        if args.every is None:
+            break
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Dict, Mapping, Optional, Tuple
+
+# How long to collect learned entries before writing them in one batch:
+FLUSH_DELAY = 5.0
+# How long learned entries are used for, before they're looked up again:
+LEARNED_MAX_AGE = 30 * 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+CacheItem = Tuple[str, Optional[str]]  # title, url
+
+
+def _is_superseded(item: CacheItem, base_item: CacheItem) -> bool:
+    title, url = item
+    base_title, base_url = base_item
+    # cache.json has both null and false for missing URLs:
+    return not url or bool(base_url) or title != base_title
+
+
+class CacheStore:
+    """
+    SQLite file with cache entries learned at runtime, so that they
+    survive restarts.
+
+    Entries are written behind: `put` only queues them, and they're written
+    in batches from a worker thread, off the event loop.
+    """
+
+    def __init__(self, path: str, flush_delay: float = FLUSH_DELAY):
+        self.path = path
+        self.flush_delay = flush_delay
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " code TEXT PRIMARY KEY,"
+            " title TEXT NOT NULL,"
+            " url TEXT,"
+            " updated_at REAL NOT NULL"
+            ")"
+        )
+        self._db.commit()
+        self._pending: Dict[str, CacheItem] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def load(
+        self,
+        max_age: Optional[float] = None,
+        base: Optional[Mapping[str, CacheItem]] = None,
+    ) -> Dict[str, CacheItem]:
+        """
+        Return stored entries, deleting outdated ones: written more than
+        `max_age` seconds ago, or superseded by the `base` cache they're
+        loaded on top of, e.g. after cache.json was regenerated.
+
+        Entries of codes which `base` has are only kept if they add a URL
+        to its entry without one, with the same title - as learned by URL
+        revalidation. Meant to be called once at startup.
+        """
+        oldest = time.time() - max_age if max_age is not None else None
+        rows = self._db.execute(
+            "SELECT code, title, url, updated_at FROM cache"
+        ).fetchall()
+        entries = {}
+        outdated = []
+        for code, title, url, updated_at in rows:
+            if (oldest is not None and updated_at < oldest) or (
+                base is not None
+                and code in base
+                and _is_superseded((title, url), base[code])
+            ):
+                outdated.append((code, updated_at))
+            else:
+                entries[code] = title, url
+        if outdated:
+            with self._db:
+                # unless written again since:
+                self._db.executemany(
+                    "DELETE FROM cache WHERE code = ? AND updated_at = ?",
+                    outdated,
+                )
+            logger.info(f"Deleted {len(outdated)} outdated entries")
+        return entries
+
+    def put(self, code: str, item: CacheItem) -> None:
+        """
+        Queue `item` to be written, and schedule a flush if there isn't one
+        scheduled already.
+        """
+        self._pending[code] = item
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_delay)
+        # shielded, so that `aclose` can't interrupt a write in progress:
+        await asyncio.shield(self.flush())
+
+    async def flush(self) -> None:
+        """
+        Write all queued entries in a single transaction.
+        """
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception:
+                logger.exception(f"Failed writing {len(batch)} entries")
+                # keep them for the next flush, unless overwritten since:
+                self._pending = dict(batch, **self._pending)
+            else:
+                logger.info(f"Stored {len(batch)} entries in {self.path}")
+
+    def _write(self, batch: Dict[str, CacheItem]) -> None:
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO cache (code, title, url, updated_at)"
+                " VALUES (?, ?, ?, ?)",
+                [
+                    (code, title, url, now)
+                    for code, (title, url) in batch.items()
+                ],
+            )
+
+    async def aclose(self) -> None:
+        """
+        Write any queued entries, and close the database.
+        """
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the database, without writing queued entries - e.g. if it was
+        only opened to `load` them.
+        """
+        self._db.close()
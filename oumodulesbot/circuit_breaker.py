@@ -0,0 +1,92 @@
+import logging
+import time
+
+# Consecutive failures after which requests to an upstream are stopped:
+FAILURE_THRESHOLD = 5
+# How long to stop them for, before probing the upstream again:
+RESET_TIMEOUT = 30
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Stops requests to an upstream which keeps failing, so that lookups
+    don't wait for it to time out every time.
+
+    Opens after `failure_threshold` consecutive failures. After
+    `reset_timeout` seconds it's half-open: a single probe request is let
+    through at a time, which closes it if it succeeds, or opens it again
+    if it fails.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        reset_timeout: float = RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        """
+        Whether requests are stopped, and not due to be probed yet.
+        """
+        return (
+            self.state == OPEN
+            and time.monotonic() - self.opened_at < self.reset_timeout
+        )
+
+    def allow(self) -> bool:
+        """
+        Return whether a request can be sent now. If it can, its outcome
+        must be reported with one of the `record_*` methods.
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if self.is_open:
+                return False
+            logger.info(f"{self.name} circuit half-open, probing")
+            self.state = HALF_OPEN
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self) -> None:
+        if self.state != CLOSED:
+            logger.info(f"{self.name} circuit closed")
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(
+                    f"{self.name} circuit open after {self.failures}"
+                    " consecutive failures"
+                )
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def record_cancelled(self) -> None:
+        """
+        Report a request abandoned before it finished, e.g. because another
+        source answered first - it says nothing about the upstream.
+        """
+        self._probing = False
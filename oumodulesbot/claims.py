@@ -0,0 +1,315 @@
+"""
+Message claims, making sure each message is replied to only once, even if
+it's received by multiple bot instances.
+
+Stores are picked with OU_BOT_CLAIM_STORE (see `get_claim_store`):
+
+ * firestore - shared by all instances, wherever they run (default),
+ * sqlite:PATH - shared by instances on the same host, through a file,
+ * memory - for a single instance,
+ * none - no deduplication at all (default if DISABLE_FIRESTORE=1).
+"""
+
+import abc
+import asyncio
+import contextlib
+import datetime
+import os
+import sqlite3
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import pylru
+
+MessageId = Union[int, str]
+
+FIRESTORE_PROJECT = "ou-modules-bot"
+FIRESTORE_COLLECTION = "message_ids"
+MEMORY_CLAIMS_SIZE = 10000
+# How long claims are kept in SQLite - Discord doesn't redeliver messages
+# after that long:
+SQLITE_RETENTION = 24 * 60 * 60
+
+
+class ClaimStore(abc.ABC):
+    """
+    Records which messages are being, or were, handled.
+
+    A claim can be released if handling fails before anything was posted,
+    so that the message can be claimed again, e.g. by another instance.
+    """
+
+    @abc.abstractmethod
+    async def claim(self, message_ids: Iterable[MessageId]) -> Set[str]:
+        """
+        Claim all messages not claimed yet at once, and return their ids.
+        """
+
+    @abc.abstractmethod
+    async def claimed(self, message_ids: Iterable[MessageId]) -> Set[str]:
+        """
+        Return ids of the messages which are claimed.
+        """
+
+    @abc.abstractmethod
+    async def release(self, message_id: MessageId) -> None:
+        """
+        Allow the message to be claimed again.
+        """
+
+    async def aclose(self) -> None:
+        pass
+
+    async def is_claimed(self, message_id: MessageId) -> bool:
+        return bool(await self.claimed([message_id]))
+
+    @contextlib.asynccontextmanager
+    async def claim_message(self, message_id: MessageId) -> AsyncIterator:
+        """
+        Claim a single message for the duration of the context, yielding
+        whether it was claimed - releasing the claim if handling it fails.
+        """
+        if not await self.claim([message_id]):
+            yield False
+            return
+        try:
+            yield True
+        except Exception:
+            # Nothing has been posted yet.
+            await self.release(message_id)
+            raise
+
+
+class NullClaimStore(ClaimStore):
+    """
+    Claims every message, and never considers any claimed.
+    """
+
+    async def claim(self, message_ids: Iterable[MessageId]) -> Set[str]:
+        return {str(message_id) for message_id in message_ids}
+
+    async def claimed(self, message_ids: Iterable[MessageId]) -> Set[str]:
+        return set()
+
+    async def release(self, message_id: MessageId) -> None:
+        pass
+
+
+class MemoryClaimStore(ClaimStore):
+    """
+    Claims kept in this process, for single-instance deployments. Only the
+    most recent `size` claims are remembered.
+    """
+
+    def __init__(self, size: int = MEMORY_CLAIMS_SIZE):
+        # message id -> whether it can be claimed again
+        self._claims = pylru.lrucache(size)
+
+    async def claim(self, message_ids: Iterable[MessageId]) -> Set[str]:
+        claimed = set()
+        for message_id in map(str, message_ids):
+            if self._claims.get(message_id, True):
+                self._claims[message_id] = False
+                claimed.add(message_id)
+        return claimed
+
+    async def claimed(self, message_ids: Iterable[MessageId]) -> Set[str]:
+        return {
+            message_id
+            for message_id in map(str, message_ids)
+            if self._claims.get(message_id) is False
+        }
+
+    async def release(self, message_id: MessageId) -> None:
+        self._claims[str(message_id)] = True
+
+
+class SqliteClaimStore(ClaimStore):
+    """
+    Claims kept in a SQLite file, shared by instances running on the same
+    host. Claims older than `retention` seconds are removed.
+    """
+
+    def __init__(self, path: str, retention: float = SQLITE_RETENTION):
+        self.path = path
+        self.retention = retention
+        # autocommit mode - transactions are managed explicitly:
+        self._db = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS claims ("
+            " message_id TEXT PRIMARY KEY,"
+            " claimed_at REAL NOT NULL,"
+            " can_retry INTEGER NOT NULL"
+            ")"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS claims_claimed_at"
+            " ON claims (claimed_at)"
+        )
+        self._lock = asyncio.Lock()
+
+    def _claim(self, message_ids: List[str]) -> Set[str]:
+        now = time.time()
+        claimed = set()
+        # IMMEDIATE, so that other processes wait for the whole batch:
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.execute(
+                "DELETE FROM claims WHERE claimed_at < ?",
+                (now - self.retention,),
+            )
+            for message_id in message_ids:
+                cursor = self._db.execute(
+                    "INSERT INTO claims (message_id, claimed_at, can_retry)"
+                    " VALUES (?, ?, 0)"
+                    " ON CONFLICT (message_id) DO UPDATE"
+                    " SET claimed_at = excluded.claimed_at, can_retry = 0"
+                    " WHERE can_retry",
+                    (message_id, now),
+                )
+                if cursor.rowcount:
+                    claimed.add(message_id)
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+        return claimed
+
+    def _claimed(self, message_ids: List[str]) -> Set[str]:
+        placeholders = ", ".join("?" * len(message_ids))
+        rows = self._db.execute(
+            "SELECT message_id FROM claims WHERE NOT can_retry"
+            f" AND message_id IN ({placeholders})",
+            message_ids,
+        )
+        return {message_id for (message_id,) in rows}
+
+    def _release(self, message_id: str) -> None:
+        self._db.execute(
+            "UPDATE claims SET can_retry = 1 WHERE message_id = ?",
+            (message_id,),
+        )
+
+    async def claim(self, message_ids: Iterable[MessageId]) -> Set[str]:
+        async with self._lock:
+            return await asyncio.to_thread(
+                self._claim, list(map(str, message_ids))
+            )
+
+    async def claimed(self, message_ids: Iterable[MessageId]) -> Set[str]:
+        async with self._lock:
+            return await asyncio.to_thread(
+                self._claimed, list(map(str, message_ids))
+            )
+
+    async def release(self, message_id: MessageId) -> None:
+        async with self._lock:
+            await asyncio.to_thread(self._release, str(message_id))
+
+    async def aclose(self) -> None:
+        async with self._lock:
+            self._db.close()
+
+
+class FirestoreClaimStore(ClaimStore):
+    """
+    Claims kept in Firestore, shared by all instances. Each batch of claims
+    is a single transaction.
+    """
+
+    def __init__(
+        self,
+        project: str = FIRESTORE_PROJECT,
+        collection: str = FIRESTORE_COLLECTION,
+    ):
+        self.project = project
+        self.collection = collection
+        self._db: Any = None
+        self._firestore: Any = None
+        self._collection: Any = None
+
+    def _connect(self) -> Tuple[Any, Any]:
+        """
+        Return the Firestore client and collection, created on first use -
+        importing and setting them up would slow down cold starts.
+        """
+        if self._db is None:
+            from google.cloud import firestore  # type: ignore
+
+            self._firestore = firestore
+            self._db = firestore.AsyncClient(project=self.project)
+            self._collection = self._db.collection(self.collection)
+        return self._db, self._collection
+
+    async def claim(self, message_ids: Iterable[MessageId]) -> Set[str]:
+        db, collection = self._connect()
+        refs = [collection.document(str(id_)) for id_ in message_ids]
+        if not refs:
+            return set()
+
+        @self._firestore.async_transactional
+        async def claim_in_transaction(transaction) -> Set[str]:
+            claimed = set()
+            data = {"claimed": datetime.datetime.now(), "can_retry": False}
+            # AsyncTransaction.get_all can't be iterated, as it awaits an
+            # async generator - reading through the client works:
+            async for snapshot in db.get_all(refs, transaction=transaction):
+                if snapshot.exists and not snapshot.get("can_retry"):
+                    continue
+                if snapshot.exists:
+                    transaction.update(snapshot.reference, data)
+                else:
+                    transaction.create(snapshot.reference, data)
+                claimed.add(snapshot.id)
+            return claimed
+
+        return await claim_in_transaction(db.transaction())
+
+    async def claimed(self, message_ids: Iterable[MessageId]) -> Set[str]:
+        db, collection = self._connect()
+        refs = [collection.document(str(id_)) for id_ in message_ids]
+        return {
+            snapshot.id
+            async for snapshot in db.get_all(refs)
+            if snapshot.exists and not snapshot.get("can_retry")
+        }
+
+    async def release(self, message_id: MessageId) -> None:
+        _, collection = self._connect()
+        await collection.document(str(message_id)).update({"can_retry": True})
+
+
+def get_claim_store(spec: Optional[str] = None) -> ClaimStore:
+    """
+    Create the claim store described by `spec` (see the module docstring),
+    by default taken from OU_BOT_CLAIM_STORE.
+    """
+    if spec is None:
+        spec = os.environ.get("OU_BOT_CLAIM_STORE")
+    if spec is None:
+        disabled = os.environ.get("DISABLE_FIRESTORE") == "1"
+        spec = "none" if disabled else "firestore"
+    kind, _, argument = spec.partition(":")
+    stores: Dict[str, type] = {
+        "firestore": FirestoreClaimStore,
+        "memory": MemoryClaimStore,
+        "none": NullClaimStore,
+    }
+    if kind == "sqlite" and argument:
+        return SqliteClaimStore(argument)
+    if kind in stores and not argument:
+        return stores[kind]()
+    raise ValueError(f"Unknown claim store: {spec}")
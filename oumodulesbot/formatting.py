@@ -0,0 +1,31 @@
+"""
+Formatting of results for posting to Discord - shared by the bot and the
+cloud function, without depending on discord.py.
+"""
+
+from oumodulesbot.ou_utils import Result
+
+
+def _format_result_url(result: Result) -> str:
+    if result.url:
+        return f"[{result.title}](<{result.url}>)"
+    else:
+        return f"{result.title}"
+
+
+def _format_result(result: Result, for_embed: bool) -> str:
+    text = _format_result_url(result)
+    if for_embed:
+        # add bullet points for embeds
+        return f" * {text} "
+    else:
+        return f"{result.code}: {text}"
+
+
+def format_result(result: Result, for_embed: bool = False) -> str:
+    """
+    Return a string describing a module ready for posting to Discord,
+    for given module `code` and `title`. Adds URL link if available.
+    """
+    # remove '!'s just in case, to avoid infinite circular bot invocation
+    return _format_result(result, for_embed).replace("!", "")
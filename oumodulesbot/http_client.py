@@ -0,0 +1,152 @@
+import asyncio
+import collections
+import importlib.util
+import logging
+import time
+from typing import AsyncIterator, Callable, DefaultDict, Optional
+
+import httpx
+
+USER_AGENT = "ou-modules-bot / 0.0.0 (https://modules-bot.ou-stem.club/)"
+
+MAX_CONNECTIONS = 50
+MAX_CONNECTIONS_PER_HOST = 10
+KEEPALIVE_EXPIRY = 60
+
+logger = logging.getLogger(__name__)
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """
+    Response body stream which calls `release` once the body is closed,
+    i.e. when the underlying connection is returned to the pool.
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release()
+
+
+class PerHostLimitTransport(httpx.AsyncBaseTransport):
+    """
+    Transport limiting the number of concurrent requests to each host.
+
+    httpx only supports limiting connections for the whole pool, which would
+    let a slow upstream (e.g. data.open.ac.uk being down) use up all of them.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, max_per_host: int):
+        self._transport = transport
+        self._semaphores: DefaultDict[str, asyncio.Semaphore] = (
+            collections.defaultdict(lambda: asyncio.Semaphore(max_per_host))
+        )
+
+    async def handle_async_request(
+        self, request: httpx.Request
+    ) -> httpx.Response:
+        semaphore = self._semaphores[request.url.host]
+        await semaphore.acquire()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+        assert isinstance(response.stream, httpx.AsyncByteStream)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, semaphore.release),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class TokenBucket:
+    """
+    Rate limiter allowing `rate` acquisitions per second on average,
+    with bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated_at) * self.rate,
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def raise_for_server_error(response: httpx.Response) -> None:
+    """
+    Raise httpx.HTTPStatusError for 5xx responses - unlike 4xx ones, they
+    mean the upstream is unavailable rather than that the page is missing.
+    """
+    if response.is_server_error:
+        response.raise_for_status()
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def make_client(
+    max_connections: int = MAX_CONNECTIONS,
+    max_connections_per_host: int = MAX_CONNECTIONS_PER_HOST,
+    keepalive_expiry: float = KEEPALIVE_EXPIRY,
+    http2: bool = False,
+    proxy: Optional[str] = None,
+) -> httpx.AsyncClient:
+    """
+    Create a client with keep-alive connection pooling, meant to be reused
+    for the whole lifetime of the process.
+
+    HTTP/2 is only enabled if requested and the optional `h2` package is
+    installed.
+
+    All requests go through `proxy`, if given - e.g. to local stand-ins of
+    the open.ac.uk hosts in benchmarks.
+    """
+    if http2 and not http2_available():
+        logger.warning("HTTP/2 requested, but h2 isn't installed")
+        http2 = False
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        http2=http2,
+        proxy=proxy,
+    )
+    return httpx.AsyncClient(
+        headers={"User-Agent": USER_AGENT},
+        transport=PerHostLimitTransport(transport, max_connections_per_host),
+    )
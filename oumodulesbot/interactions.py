@@ -0,0 +1,135 @@
+"""
+Replies to "find modules" interactions, forwarded by the C++ fast path in
+cloudfunctions-cc through Pub/Sub to the cloud function in
+cloudfunctions-py - with codes it couldn't find looked up by the backend.
+"""
+
+import dataclasses
+import logging
+import re
+from typing import Dict, List, Optional
+
+import httpx
+
+from oumodulesbot.backend import OUModulesBackend
+from oumodulesbot.claims import ClaimStore
+from oumodulesbot.formatting import format_result
+from oumodulesbot.ou_utils import (
+    MENTIONS_LIMIT,
+    MODULE_OR_QUALIFICATION_CODE_RE_TEMPLATE,
+    Result,
+)
+
+MODULE_OR_QUALIFICATION_CODE_RE = re.compile(
+    MODULE_OR_QUALIFICATION_CODE_RE_TEMPLATE
+)
+APPLICATION_ID = 511181619785236500
+
+log = logging.getLogger(__name__)
+
+
+def get_codes(data) -> Dict[str, Optional[Result]]:
+    """
+    Return distinct codes mentioned in the interaction's message, in order,
+    with results already found by the C++ fast path, or None for the codes
+    it doesn't know. Payloads without `items`, from older versions of the
+    fast path, only have the message.
+    """
+    if "items" in data:
+        items = data["items"]
+    else:
+        content = data["message"]["content"]
+        matches = MODULE_OR_QUALIFICATION_CODE_RE.findall(content)
+        items = [{"code": code} for code in matches]
+    codes: Dict[str, Optional[Result]] = {}
+    for item in items[:MENTIONS_LIMIT]:
+        code = item["code"].upper()
+        if "full_name" in item:
+            codes[code] = Result(code, item["full_name"], item["url"])
+        else:
+            codes.setdefault(code, None)
+    return codes
+
+
+async def find_modules(
+    data,
+    backend: OUModulesBackend,
+    webhook_client: httpx.AsyncClient,
+    claim_store: ClaimStore,
+) -> None:
+    """
+    Reply to the interaction with results for the codes in its message,
+    looking up only the ones the fast path didn't find, through `backend`.
+    """
+    codes = get_codes(data)
+    results = []
+    async with claim_store.claim_message(
+        f'{data["target_id"]}_{data["interaction_id"]}'
+    ) as claimed:
+        if not claimed:
+            # Avoid replying twice by two instances.
+            return
+        # Only look up the codes the fast path couldn't find:
+        misses = [code for code, result in codes.items() if result is None]
+        found = dict(zip(misses, await backend.find_results_for_codes(misses)))
+        for code, result in codes.items():
+            result = result or found[code]
+            if result:
+                results.append(result)
+            else:
+                results.append(Result(code, "Not found", None))
+        response = FoundModules(results).as_response_json(data)
+        log.info("Sending response: %s", response)
+        sent = await webhook_client.patch(
+            "https://discord.com/api/v10/webhooks/"
+            f"{APPLICATION_ID}/{data['token']}/messages/@original",
+            json=response,
+        )
+        log.info("Result: %s", sent.text)
+
+
+@dataclasses.dataclass
+class FoundModules:
+    modules_list: List[Result]
+
+    def as_response_json(self, input_data):
+        guild_id = input_data["guild_id"]
+        channel_id = input_data["message"]["channel_id"]
+        target_id = input_data["target_id"]
+        url = (
+            f"https://discord.com/channels/{guild_id}/{channel_id}/{target_id}"
+        )
+        data = {
+            "components": [
+                {
+                    "type": 1,
+                    "components": [
+                        {
+                            "type": 2,
+                            "style": 5,
+                            "label": "Jump to referenced message",
+                            "url": url,
+                        }
+                    ],
+                }
+            ],
+        }
+        if len(self.modules_list) > 1:
+            data["content"] = "Multiple results found."
+            data["embeds"] = self._multiple_modules_embeds()
+        else:
+            data["content"] = format_result(self.modules_list[0])
+        return data
+
+    def _multiple_modules_embeds(self):
+        return [
+            {
+                "fields": [
+                    {
+                        "name": m.code,
+                        "value": format_result(m, for_embed=True),
+                    }
+                    for m in self.modules_list
+                ],
+            }
+        ]
@@ -1,123 +1,121 @@
-import contextlib
-import datetime
+import asyncio
 import json
 import logging
 import os
-import re
-from typing import Iterable, List, Sequence
+from typing import Iterable, List, Optional, Sequence
 
 import discord
-import pylru
-from google.cloud import firestore  # type: ignore
 
-from .backend import OUModulesBackend, Result
-from .ou_utils import MODULE_OR_QUALIFICATION_CODE_RE_TEMPLATE
+from .backend import SEARCH_RESULTS_LIMIT, OUModulesBackend, Result
+from .claims import ClaimStore, get_claim_store
+from .formatting import format_result
+from .metrics import serve_metrics
+from .ou_utils import MENTIONS_LIMIT, extract_find_query, extract_mentions
+from .reply_map import MEMORY_BUDGET, ReplyMap
 
 logger = logging.getLogger(__name__)
 
-replies_cache = pylru.lrucache(1000)
-
-
-if os.environ.get("DISABLE_FIRESTORE") != "1":
-    firestore_db = firestore.AsyncClient(project="ou-modules-bot")
-
-
-@firestore.async_transactional
-async def _db_claim_message(transaction, message_id, value) -> bool:
-    doc_ref = firestore_db.collection("message_ids").document(str(message_id))
-    snapshot = await doc_ref.get(transaction=transaction)
-    claimed = snapshot.exists and not snapshot.get("can_retry")
-    if not claimed:
-        data = {"claimed": value, "can_retry": False}
-        if snapshot.exists:
-            transaction.update(doc_ref, data)
-        else:
-            transaction.create(doc_ref, data)
-    return not claimed
-
-
-@firestore.async_transactional
-async def _db_retry_message(transaction, message_id) -> None:
-    doc_ref = firestore_db.collection("message_ids").document(str(message_id))
-    transaction.update(doc_ref, {"can_retry": True})
-
-
-@contextlib.asynccontextmanager
-async def claim_message(message_id):
-    if os.environ.get("DISABLE_FIRESTORE") == "1":
-        yield True
-        return
-    transaction = firestore_db.transaction()
-    if await _db_claim_message(
-        transaction, message_id, datetime.datetime.now()
-    ):
-        try:
-            yield True
-        except Exception:
-            # Nothing has been posted yet.
-            await _db_retry_message(transaction, message_id)
-            raise
-    else:
-        yield False
-
-
-async def is_message_claimed(message_id):
-    if os.environ.get("DISABLE_FIRESTORE") == "1":
-        return False
-    doc_ref = firestore_db.collection("message_ids").document(str(message_id))
-    snapshot = await doc_ref.get()
-    return snapshot.exists and not snapshot.get("can_retry")
-
 
 class OUModulesBot(discord.Client):
-    MENTION_RE = re.compile(r"!" + MODULE_OR_QUALIFICATION_CODE_RE_TEMPLATE)
-    MODULES_COUNT_LIMIT = 5
-
-    def __init__(self, *args, **kwargs):
+    MODULES_COUNT_LIMIT = MENTIONS_LIMIT
+    FIND_RESULTS_LIMIT = SEARCH_RESULTS_LIMIT
+    NO_TITLES_FOUND = "No matching titles found."
+    # seconds to wait for all lookups for a message:
+    LOOKUP_DEADLINE = 8
+
+    def __init__(
+        self,
+        *args,
+        claim_store: Optional[ClaimStore] = None,
+        reply_map: Optional[ReplyMap] = None,
+        **kwargs,
+    ):
         kwargs["intents"] = discord.Intents(
             messages=True,
             message_content=True,
             guilds=True,
         )
         super().__init__(*args, **kwargs)
-        self.backend = OUModulesBackend()
+        self.backend = OUModulesBackend(
+            store_path=os.environ.get("OU_BOT_CACHE_DB"),
+            binary_cache_path=os.environ.get("OU_BOT_BINARY_CACHE"),
+        )
+        self._metrics_server = None
+        self.claims = claim_store or get_claim_store()
+        self.replies = reply_map or ReplyMap(
+            path=os.environ.get("OU_BOT_REPLIES_DB"),
+            memory_budget=int(
+                os.environ.get("OU_BOT_REPLIES_MEMORY", MEMORY_BUDGET)
+            ),
+        )
+
+    async def setup_hook(self) -> None:
+        await self.backend.start()
+        if port := os.environ.get("OU_BOT_METRICS_PORT"):
+            self._metrics_server = await serve_metrics(
+                self.backend.metrics, int(port)
+            )
+            logger.info(f"Serving metrics on port {port}")
+
+    async def close(self) -> None:
+        await super().close()
+        if self._metrics_server:
+            await self._metrics_server.cleanup()
+        await self.backend.aclose()
+        await self.claims.aclose()
+        await self.replies.aclose()
 
     async def process_mentions(self, message: discord.Message) -> None:
         """
         Process module code mentions from given `message`, and reply with
-        their names/URLs if any were found.
+        their names/URLs if any were found - or with titles matching the
+        words of a "!find <words>" message.
         """
         results: List[Result] = []
-        matches = list(
-            self.MENTION_RE.findall(message.content)[
-                : self.MODULES_COUNT_LIMIT
-            ]
+        query = extract_find_query(message.content)
+        codes = (
+            []
+            if query
+            else extract_mentions(message.content, self.MODULES_COUNT_LIMIT)
         )
-        if not matches:
+        if not codes and not query:
             return
 
         any_found = False
 
         async def process():
             nonlocal any_found
-            for code in matches:
-                code = code[1:].upper()
-                result = await self.backend.find_result_for_code(code)
-                if result:
+            if query:
+                results.extend(
+                    self.backend.search_titles(query, self.FIND_RESULTS_LIMIT)
+                )
+                any_found = bool(results)
+                return
+            lookups = self.backend.lookup_codes(codes)
+            # post what's been found by the deadline - the remaining lookups
+            # continue in the background, and will be cached once done:
+            await asyncio.wait(lookups.values(), timeout=self.LOOKUP_DEADLINE)
+            for code in codes:
+                lookup = lookups[code]
+                if not lookup.done():
+                    lookup.cancel()
+                    logger.warning(f"{code} lookup deadline exceeded")
+                    results.append(Result(code, "lookup timed out", None))
+                elif result := lookup.result():
                     any_found = True
                     results.append(result)
                 else:
                     results.append(Result(code, "not found", None))
 
         processed = False
-        if message.id in replies_cache:
+        if self.replies.get(message.id):
             # handle edited messages
-            if await is_message_claimed(message.id):
+            if await self.claims.is_claimed(message.id):
                 await process()
                 processed = True
 
         if not processed:
-            async with claim_message(message.id) as claimed:
+            async with self.claims.claim_message(message.id) as claimed:
                 if not claimed:
                     return
                 await process()
@@ -125,31 +123,12 @@ class OUModulesBot(discord.Client):
         if any_found:
             # don't spam unless we're sure we at least found some results
             await self.post_results(message, results)
+        elif query:
+            # searched explicitly, so replied to even if nothing's found -
+            # without echoing the query, which could mention anyone:
+            await self.post_reply(message, self.NO_TITLES_FOUND, [])
 
-    @classmethod
-    def _format_result_url(cls, result: Result) -> str:
-        if result.url:
-            return f"[{result.title}](<{result.url}>)"
-        else:
-            return f"{result.title}"
-
-    @classmethod
-    def _format_result(cls, result: Result, for_embed: bool) -> str:
-        text = cls._format_result_url(result)
-        if for_embed:
-            # add bullet points for embeds
-            return f" * {text} "
-        else:
-            return f"{result.code}: {text}"
-
-    @classmethod
-    def format_result(cls, result: Result, for_embed: bool = False) -> str:
-        """
-        Return a string describing a module ready for posting to Discord,
-        for given module `code` and `title`. Adds URL link if available.
-        """
-        # remove '!'s just in case, to avoid infinite circular bot invocation
-        return cls._format_result(result, for_embed).replace("!", "")
+    format_result = staticmethod(format_result)
 
     def embed_results(
         self, embed: discord.Embed, results: Iterable[Result]
@@ -174,10 +153,6 @@ class OUModulesBot(discord.Client):
         Message is updated instead of created if the input was already replied
         to, which means this time the input was edited.
         """
-        modify_message = None
-        if message.id in replies_cache:
-            modify_message = replies_cache[message.id]
-
         embed = discord.Embed()
         if len(results) > 1:
             content = " "  # force removal when modifying
@@ -191,12 +166,31 @@ class OUModulesBot(discord.Client):
             return
 
         embeds = [embed] if len(results) > 1 else []
-        if modify_message:
-            await modify_message.edit(content=content, embeds=embeds)
-        else:
-            replies_cache[message.id] = await message.reply(
-                content, embeds=embeds
-            )
+        await self.post_reply(message, content, embeds)
+
+    async def post_reply(
+        self,
+        message: discord.Message,
+        content: str,
+        embeds: List[discord.Embed],
+    ) -> None:
+        """
+        Reply to `message`, or update the existing reply to it.
+        """
+        if reply := self.replies.get(message.id):
+            channel_id, reply_id = reply
+            # edited without fetching it first:
+            modify_message = self.get_partial_messageable(
+                channel_id
+            ).get_partial_message(reply_id)
+            try:
+                await modify_message.edit(content=content, embeds=embeds)
+                return
+            except discord.NotFound:
+                # the reply was deleted - post a new one instead
+                await self.replies.forget(message.id)
+        sent = await message.reply(content, embeds=embeds)
+        await self.replies.put(message.id, sent.channel.id, sent.id)
 
     async def on_message(self, message: discord.Message) -> None:
         await self.process_mentions(message)
@@ -1,14 +1,47 @@
+import argparse
 import asyncio
+import collections
 import json
+import os
+import sys
+import time
 
+import httpx
+
+from oumodulesbot.binary_cache import dump_binary_cache, get_digest
+from oumodulesbot.http_client import TokenBucket, make_client
 from oumodulesbot.ou_sparql_utils import (
+    OLDCOURSE_QUERY,
+    QUERY_FORMAT_DEFAULTS,
+    XCRI_QUALIFICATIONS_QUERY,
+    XCRI_QUERY,
+    head_with_retries,
+    is_active_response,
     is_really_active,
-    query_oldcourses,
-    query_xcri,
+    iter_data_open_ac_uk,
 )
 
 PAGES = 165
 
+# URL checks in progress at the same time:
+CONCURRENCY = 8
+# Requests per second to each host:
+RATE_PER_HOST = 10
+PROGRESS_EVERY = 100
+
+# Queries streamed for the whole catalogue, in the order their results are
+# applied to the cache, with ORDER BY clauses making pagination stable:
+STREAMED_QUERIES = (
+    (OLDCOURSE_QUERY, "?id ?title"),
+    (XCRI_QUERY, "?id ?title ?url ?type"),
+    (XCRI_QUALIFICATIONS_QUERY, "?id ?title ?url ?type"),
+)
+
+# Incremental mode:
+META_PATH = "cache_meta.json"
+MAX_AGE = 7 * 86400
+CHECKPOINT_EVERY = 50
+
 
 def dump_readable_json(dictionary):
     res = ["{"]
@@ -22,16 +55,180 @@ def dump_readable_json(dictionary):
     return "\n".join(res + [""])
 
 
-async def main():
-    results_xcri = await query_xcri()
-    results_oldcourses = await query_oldcourses()
-    oldcache = json.load(open("cache.json"))
+def is_transient_error(response):
+    """
+    Check if `response` is an error which says nothing about the URL itself,
+    like rate limiting or a server error.
+    """
+    return response.status_code == 429 or response.status_code >= 500
+
+
+class UrlMetadata:
+    """
+    Per-code results of URL checks, stored in `path` next to cache.json, for
+    incremental runs: when the URL was last verified, whether it was active,
+    its final HTTP status and validators (ETag / Last-Modified).
+
+    Results newer than `max_age` seconds are reused without any request,
+    and older ones are re-checked with a conditional request. The file is
+    also saved periodically as a checkpoint, so that an interrupted run can
+    be resumed by running it again.
+    """
+
+    def __init__(self, path, max_age):
+        self.path = path
+        self.max_age = max_age
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+        self._unsaved = 0
+
+    def _entry(self, code, url):
+        entry = self.entries.get(code)
+        return entry if entry and entry["url"] == url else None
+
+    def get_fresh(self, code, url):
+        """
+        Return the recent result for `code` and `url`, if there's one.
+        """
+        entry = self._entry(code, url)
+        if entry and time.time() - entry["verified_at"] < self.max_age:
+            return entry["active"]
+        return None
+
+    def conditional_headers(self, code, url):
+        headers = {}
+        if entry := self._entry(code, url):
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def record(self, code, url, response, active):
+        self.entries[code] = {
+            "url": url,
+            "verified_at": time.time(),
+            "active": active,
+            "status": response.status_code,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        self._unsaved += 1
+        if self._unsaved >= CHECKPOINT_EVERY:
+            self.save()
+
+    def record_unchanged(self, code, url):
+        """
+        Mark the stored result as verified now, after a 304 response.
+        """
+        entry = self._entry(code, url)
+        entry["verified_at"] = time.time()
+        self._unsaved += 1
+        if self._unsaved >= CHECKPOINT_EVERY:
+            self.save()
+        return entry["active"]
+
+    def save(self):
+        # written atomically, so that an interrupted run can't corrupt it:
+        with open(f"{self.path}.tmp", "w") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(f"{self.path}.tmp", self.path)
+        self._unsaved = 0
+
+
+class UrlChecker:
+    """
+    Runs `is_really_active` checks concurrently, with at most `concurrency`
+    of them in progress, and at most `rate` requests per second to each
+    host.
+
+    If `metadata` is given, previous results are reused as described in
+    UrlMetadata.
+    """
+
+    def __init__(
+        self,
+        client,
+        concurrency=CONCURRENCY,
+        rate=RATE_PER_HOST,
+        metadata=None,
+    ):
+        self.client = client
+        self.rate = rate
+        self.metadata = metadata
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._rate_limiters = collections.defaultdict(
+            lambda: TokenBucket(self.rate)
+        )
+        self.checked = 0
+        self.reused = 0
+
+    async def is_really_active(self, url, code):
+        if not url:
+            return await is_really_active(url, code, self.client)
+        if not self.metadata:
+            async with self._semaphore:
+                active = await is_really_active(
+                    url,
+                    code,
+                    self.client,
+                    rate_limiter=self._rate_limiters[httpx.URL(url).host],
+                )
+            self.checked += 1
+            return active
+
+        if (active := self.metadata.get_fresh(code, url)) is not None:
+            self.reused += 1
+            return active
+        async with self._semaphore:
+            response = await head_with_retries(
+                url,
+                self.client,
+                rate_limiter=self._rate_limiters[httpx.URL(url).host],
+                headers=self.metadata.conditional_headers(code, url),
+            )
+        self.checked += 1
+        if response is None or is_transient_error(response):
+            # not recorded, to be retried by the next run
+            return False
+        if response.status_code == 304:
+            print(f"Trying {url} -> not modified")
+            return self.metadata.record_unchanged(code, url)
+        active = is_active_response(response, code)
+        final = f"{response.url}, {response.status_code}"
+        print(f"Trying {url} -> {active} ({final})")
+        self.metadata.record(code, url, response, active)
+        return active
+
 
-    seen_codes = set()
+class Progress:
+    def __init__(self, total, checker):
+        self.total = total
+        self.done = 0
+        self.checker = checker
 
-    for c in results_oldcourses + results_xcri:
-        code, title, url = c["id"], c["title"], c.get("url")
-        seen_codes.add(code)
+    def advance(self):
+        self.done += 1
+        if self.done % PROGRESS_EVERY == 0 or self.done == self.total:
+            print(
+                f"[progress] {self.done} / {self.total} codes processed,"
+                f" {self.checker.checked} URLs checked,"
+                f" {self.checker.reused} reused",
+                file=sys.stderr,
+            )
+
+
+async def update_code(oldcache, code, results, checker):
+    """
+    Update `oldcache` entry for `code` from its SPARQL `results`.
+
+    Entries are independent of each other, so this runs concurrently for
+    all codes, but each code's results are still applied in order.
+    """
+    for c in results:
+        title, url = c["title"], c.get("url")
         if oldcache.get(code, ["", url])[1] != url:
             print(
                 '"url" value different:',
@@ -49,7 +246,7 @@ async def main():
                     " - updating.",
                 )
                 oldcache[code][1] = None
-            elif is_really_active(url, code):
+            elif await checker.is_really_active(url, code):
                 # However, some of the newcourses are in fact not active, so
                 # we need the is_really_active check here.
                 print(
@@ -70,7 +267,7 @@ async def main():
             )
             oldcache[code] = (
                 title,
-                is_really_active(url, code) and url,
+                await checker.is_really_active(url, code) and url,
             )
         elif oldcache.get(code) != [title, url]:
             print(
@@ -79,20 +276,88 @@ async def main():
                 [title, url],
                 "mismatch - updating",
             )
-            oldcache[code] = (title, is_really_active(url, code) and url)
-
-    for code in oldcache:
-        _, url = oldcache[code]
-        if code in seen_codes or not url:
-            continue
-        # process unseen which have url set, which may be still valid
-        print(code, "missing - trying old url", url)
-        if not is_really_active(url, code):
-            print(code, "cached url failed - setting null")
-            oldcache[code][1] = None
-
-    with open("newcache.json", "w") as f:
-        f.write(dump_readable_json(oldcache))
+            oldcache[code] = (
+                title,
+                await checker.is_really_active(url, code) and url,
+            )
+
+
+async def check_unseen_code(oldcache, code, checker):
+    # process unseen which have url set, which may be still valid
+    url = oldcache[code][1]
+    print(code, "missing - trying old url", url)
+    if not await checker.is_really_active(url, code):
+        print(code, "cached url failed - setting null")
+        oldcache[code][1] = None
+
+
+async def main(incremental=False, max_age=MAX_AGE):
+    """
+    Write newcache.json and newcache.bin, with cache.json updated from
+    SPARQL results.
+
+    In `incremental` mode, results of URL checks are stored in
+    cache_meta.json and reused for `max_age` seconds.
+    """
+    metadata = UrlMetadata(META_PATH, max_age) if incremental else None
+    async with make_client() as client:
+        # results of each query, by code:
+        streamed = [collections.defaultdict(list) for _ in STREAMED_QUERIES]
+
+        async def collect(query, order_by, results):
+            async for c in iter_data_open_ac_uk(
+                query.format(**QUERY_FORMAT_DEFAULTS), order_by, client=client
+            ):
+                results[c["id"]].append(c)
+
+        await asyncio.gather(
+            *(
+                collect(query, order_by, results)
+                for (query, order_by), results in zip(
+                    STREAMED_QUERIES, streamed
+                )
+            )
+        )
+        oldcache = json.load(open("cache.json"))
+
+        results_by_code = collections.defaultdict(list)
+        for results in streamed:
+            for code, code_results in results.items():
+                results_by_code[code].extend(code_results)
+        unseen_codes = [
+            code
+            for code, (_, url) in oldcache.items()
+            if code not in results_by_code and url
+        ]
+
+        checker = UrlChecker(client, metadata=metadata)
+        progress = Progress(len(results_by_code) + len(unseen_codes), checker)
+
+        async def run(coro):
+            await coro
+            progress.advance()
+
+        try:
+            await asyncio.gather(
+                *(
+                    run(update_code(oldcache, code, results, checker))
+                    for code, results in results_by_code.items()
+                ),
+                *(
+                    run(check_unseen_code(oldcache, code, checker))
+                    for code in unseen_codes
+                ),
+            )
+        finally:
+            if metadata:
+                metadata.save()
+
+    json_bytes = dump_readable_json(oldcache).encode()
+    with open("newcache.json", "wb") as f:
+        f.write(json_bytes)
+    # precompiled version for fast startup, see binary_cache.py:
+    with open("newcache.bin", "wb") as f:
+        f.write(dump_binary_cache(oldcache, get_digest(json_bytes)))
     return
 
     # old scraping below, disabled for now:
@@ -123,4 +388,19 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(
+        description="Update cache.json from data.open.ac.uk."
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=f"reuse and store URL check results in {META_PATH}",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=MAX_AGE / 86400,
+        help="days after which URL check results are re-checked",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.incremental, args.max_age * 86400))
@@ -0,0 +1,193 @@
+"""
+Count code mentions in exported messages, found the same way as by the bot,
+e.g. to see which modules are discussed most, and which of them are missing
+from the cache:
+
+    python -m oumodulesbot.mention_stats messages.jsonl [more.jsonl.gz ...]
+
+Each line of the archives is a JSON object with the message text in its
+`content` field (see --field). Archives are read in chunks of lines, which
+are processed by a pool of worker processes.
+"""
+
+import argparse
+import collections
+import contextlib
+import dataclasses
+import gzip
+import json
+import multiprocessing
+import os
+import sys
+from typing import (
+    IO,
+    ContextManager,
+    Counter,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+)
+
+from oumodulesbot.ou_utils import MENTIONS_LIMIT, extract_mentions
+
+CHUNK_LINES = 10000
+# Chunks queued for each worker process, at most:
+CHUNKS_PER_PROCESS = 2
+TOP = 50
+
+
+@dataclasses.dataclass
+class MentionStats:
+    mentions: Counter[str] = dataclasses.field(
+        default_factory=collections.Counter
+    )
+    messages: int = 0
+    invalid_lines: int = 0
+
+    def update(self, other: "MentionStats") -> None:
+        self.mentions.update(other.mentions)
+        self.messages += other.messages
+        self.invalid_lines += other.invalid_lines
+
+
+def _open_archive(path: str) -> ContextManager[IO[bytes]]:
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin.buffer)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")  # type: ignore[return-value]
+    return open(path, "rb")
+
+
+def iter_chunks(paths: Sequence[str], chunk_lines: int) -> Iterator[List]:
+    chunk: List[bytes] = []
+    for path in paths:
+        with _open_archive(path) as f:
+            for line in f:
+                chunk.append(line)
+                if len(chunk) >= chunk_lines:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+def count_chunk(lines: List[bytes], field: str, limit: int) -> MentionStats:
+    """
+    Count mentions in messages from `lines` of JSON, with message text
+    found under the dot-separated `field` path.
+    """
+    stats = MentionStats()
+    path = field.split(".")
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            content = json.loads(line)
+            for key in path:
+                content = content[key]
+        except (ValueError, LookupError, TypeError):
+            stats.invalid_lines += 1
+            continue
+        if not isinstance(content, str):
+            stats.invalid_lines += 1
+            continue
+        stats.messages += 1
+        stats.mentions.update(extract_mentions(content, limit))
+    return stats
+
+
+def count_mentions(
+    paths: Sequence[str],
+    field: str = "content",
+    limit: int = MENTIONS_LIMIT,
+    processes: Optional[int] = None,
+    chunk_lines: int = CHUNK_LINES,
+) -> MentionStats:
+    """
+    Count mentions in all messages from `paths`, with at most a few chunks
+    per process read ahead, so that archives of any size can be processed.
+    """
+    processes = processes or os.cpu_count() or 1
+    total = MentionStats()
+    with multiprocessing.Pool(processes) as pool:
+        pending: collections.deque = collections.deque()
+        for chunk in iter_chunks(paths, chunk_lines):
+            pending.append(
+                pool.apply_async(count_chunk, (chunk, field, limit))
+            )
+            if len(pending) >= processes * CHUNKS_PER_PROCESS:
+                total.update(pending.popleft().get())
+        while pending:
+            total.update(pending.popleft().get())
+    return total
+
+
+def print_report(
+    stats: MentionStats, cache: Mapping[str, object], top: int
+) -> None:
+    mentions_count = sum(stats.mentions.values())
+    print(
+        f"{stats.messages} messages, {mentions_count} mentions"
+        f" of {len(stats.mentions)} codes"
+        f" ({stats.invalid_lines} invalid lines skipped)"
+    )
+    for code, count in stats.mentions.most_common(top):
+        in_cache = "" if code in cache else "  not in cache"
+        print(f"{code:<10} {count:>8}{in_cache}")
+    cached_codes = [code for code in stats.mentions if code in cache]
+    cached_mentions = sum(stats.mentions[code] for code in cached_codes)
+    print(
+        f"Cache coverage: {len(cached_codes)} / {len(stats.mentions)} codes"
+        f" ({len(cached_codes) / max(len(stats.mentions), 1):.1%}),"
+        f" {cached_mentions} / {mentions_count} mentions"
+        f" ({cached_mentions / max(mentions_count, 1):.1%})"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("archives", nargs="+", help="JSONL files, or -")
+    parser.add_argument(
+        "--field",
+        default="content",
+        help="dot-separated path to the message text in each JSON object",
+    )
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--top", type=int, default=TOP)
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=MENTIONS_LIMIT,
+        help="mentions counted per message, like the bot handles",
+    )
+    parser.add_argument(
+        "--misses-output",
+        help="write codes missing from the cache here, most mentioned first",
+    )
+    parser.add_argument(
+        "--binary-cache", default=os.environ.get("OU_BOT_BINARY_CACHE")
+    )
+    args = parser.parse_args()
+
+    # imported here, so that worker processes don't need to:
+    from oumodulesbot.backend import get_cache
+
+    stats = count_mentions(
+        args.archives, args.field, args.limit, args.processes
+    )
+    cache = get_cache(args.binary_cache)
+    print_report(stats, cache, args.top)
+    if args.misses_output:
+        with open(args.misses_output, "w") as f:
+            for code, count in stats.mentions.most_common():
+                if code not in cache:
+                    f.write(f"{code}\t{count}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+Minimal Prometheus-style metrics, rendered in the text exposition format,
+so that they can be scraped without depending on prometheus_client.
+"""
+
+import abc
+import math
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latencies from cache-speed to upstream timeouts, in seconds:
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric(abc.ABC):
+    type = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} needs labels {self.labelnames}, got {labels}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(
+        self, key: LabelValues, extra: Sequence[Tuple[str, str]] = ()
+    ) -> str:
+        pairs = [*zip(self.labelnames, key), *extra]
+        if not pairs:
+            return ""
+        labels = ",".join(f'{name}="{_escape(v)}"' for name, v in pairs)
+        return f"{{{labels}}}"
+
+    @abc.abstractmethod
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """
+        Yield (name suffix, formatted labels, value) of each sample.
+        """
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for key, value in sorted(self._values.items()):
+            yield "", self._format_labels(key), value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def get(self, **labels: str) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._key(labels), 0)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        Compute the (unlabelled) value with `function` whenever it's read.
+        """
+        self._function = function
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        if self._function is not None:
+            yield "", "", self._function()
+            return
+        for key, value in sorted(self._values.items()):
+            yield "", self._format_labels(key), value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = (*sorted(buckets), math.inf)
+        # label values -> (count in each bucket, sum of observed values):
+        self._values: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        self._values[key] = counts, total + value
+
+    def count(self, **labels: str) -> int:
+        counts, _ = self._values.get(self._key(labels), ([], 0))
+        return sum(counts)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = (("le", _format_value(bound)),)
+                yield "_bucket", self._format_labels(key, le), cumulative
+            yield "_sum", self._format_labels(key), total
+            yield "_count", self._format_labels(key), cumulative
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class BackendMetrics(Registry):
+    """
+    Metrics of OUModulesBackend lookups.
+
+    Sources are "cache" and the upstream ones: "sparql", "url" and "ouda".
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.lookups = Counter(
+            "oumodulesbot_lookups_total",
+            "Code lookups, by how they were answered.",
+            ["result"],
+        )
+        self.cache_hit_ratio = Gauge(
+            "oumodulesbot_cache_hit_ratio",
+            "Fraction of code lookups answered from cache.",
+        )
+        self.cache_hit_ratio.set_function(self._cache_hit_ratio)
+        self.source_wins = Counter(
+            "oumodulesbot_source_wins_total",
+            "Lookups answered by each source.",
+            ["source"],
+        )
+        self.source_outcomes = Counter(
+            "oumodulesbot_source_outcomes_total",
+            "Finished or cancelled upstream source lookups, by outcome.",
+            ["source", "outcome"],
+        )
+        self.source_duration = Histogram(
+            "oumodulesbot_source_duration_seconds",
+            "Time taken by finished upstream source lookups.",
+            ["source"],
+        )
+        self.upstream_duration = Histogram(
+            "oumodulesbot_upstream_lookup_duration_seconds",
+            "Time taken by lookups of codes missing from cache.",
+            ["result"],
+        )
+        self.deadlines_exceeded = Counter(
+            "oumodulesbot_lookup_deadlines_exceeded_total",
+            "Lookups given up on after the lookup deadline.",
+        )
+        self.title_search_duration = Histogram(
+            "oumodulesbot_title_search_duration_seconds",
+            "Time taken by title searches.",
+            buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01),
+        )
+        self.in_flight_requests = Gauge(
+            "oumodulesbot_in_flight_source_lookups",
+            "Upstream source lookups in progress.",
+            ["source"],
+        )
+        self.in_flight_lookups = Gauge(
+            "oumodulesbot_in_flight_lookups",
+            "Lookups of codes missing from cache in progress.",
+        )
+        self.background_tasks = Gauge(
+            "oumodulesbot_background_tasks",
+            "Background tasks in progress, e.g. URL checks.",
+        )
+        for metric in (
+            self.lookups,
+            self.cache_hit_ratio,
+            self.source_wins,
+            self.source_outcomes,
+            self.source_duration,
+            self.upstream_duration,
+            self.deadlines_exceeded,
+            self.title_search_duration,
+            self.in_flight_requests,
+            self.in_flight_lookups,
+            self.background_tasks,
+        ):
+            self.register(metric)
+
+    def _cache_hit_ratio(self) -> float:
+        total = self.lookups.total()
+        return self.lookups.get(result="cache_hit") / total if total else 0
+
+
+async def serve_metrics(registry: Registry, port: int, host: str = ""):
+    """
+    Serve `registry` at /metrics on the running event loop, e.g. alongside
+    the discord client. Returns the aiohttp runner, to be cleaned up on
+    shutdown.
+    """
+    # discord.py's own dependency - imported here, only when it's needed:
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render().encode(),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host or None, port).start()
+    return runner
@@ -1,10 +1,16 @@
+import asyncio
+import collections
+import contextlib
+import json
 import logging
-import time
+import random
+import re
 import urllib.parse
-from typing import Optional
+from typing import AsyncIterator, Deque, Dict, Iterable, Optional, Set, Tuple
 
 import httpx
 
+from .http_client import make_client, raise_for_server_error
 from .ou_utils import Result
 
 XCRI_QUERY = """
@@ -56,25 +62,62 @@ FROM <http://data.open.ac.uk/context/oldcourses> WHERE {{
 
 QUERY_FORMAT_DEFAULTS = {"addfilter": ""}
 
+# Queries used to resolve codes, in order of priority:
+RESOLUTION_QUERIES = (
+    ("xcri courses", XCRI_QUERY),
+    ("xcri qualifications", XCRI_QUALIFICATIONS_QUERY),
+    ("oldcourses", OLDCOURSE_QUERY),
+)
+# A code can have a few rows in results, e.g. one for each of its types:
+BATCH_ROWS_PER_CODE = 10
+
+# Paginated queries:
+PAGE_SIZE = 1000
+MAX_PAGES_IN_FLIGHT = 2
+BINDINGS_START_RE = re.compile(r'"bindings"\s*:\s*\[')
+_PAGE_END = object()
+
 logger = logging.getLogger(__name__)
 
 
-async def query_data_open_ac_uk(query, offset, limit):
+@contextlib.asynccontextmanager
+async def _client_or_temporary(client: Optional[httpx.AsyncClient]):
+    if client is not None:
+        yield client
+    else:
+        async with make_client() as temporary_client:
+            yield temporary_client
+
+
+async def query_data_open_ac_uk(
+    query, offset, limit, ignore_timeout=True, client=None
+):
+    """
+    Run a SPARQL `query` against data.open.ac.uk and return its bindings.
+
+    Timeouts, connection errors and 5xx responses result in an empty list,
+    unless `ignore_timeout` is False, in which case they are raised so that
+    callers can tell them apart from queries which simply have no results.
+
+    Uses the shared `client` if given, or a temporary one otherwise.
+    """
     q = {"query": "{} offset {} limit {}".format(query, offset, limit)}
-    async with httpx.AsyncClient() as client:
+    async with _client_or_temporary(client) as client:
         try:
             http_result = await client.get(
                 f"http://data.open.ac.uk/sparql?{urllib.parse.urlencode(q)}",
                 follow_redirects=True,
                 headers={"Accept": "application/sparql-results+json"},
             )
-        except httpx.ReadTimeout:
-            logger.warning("data.open.ac.uk timeout")
+            raise_for_server_error(http_result)
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            logger.warning(f"data.open.ac.uk unavailable: {e!r}")
+            if not ignore_timeout:
+                raise
             return []
     retval = []
     try:
-        json = http_result.json()
-        bindings = json["results"]["bindings"]
+        bindings = http_result.json()["results"]["bindings"]
         for result in bindings:
             retval.append({k: result[k]["value"] for k in result})
     except Exception:
@@ -83,63 +126,289 @@ async def query_data_open_ac_uk(query, offset, limit):
     return retval
 
 
-async def query_xcri(limit=3000, **format_kwargs):
+async def _iter_bindings(
+    chunks: AsyncIterator[str],
+) -> AsyncIterator[Dict[str, str]]:
+    """
+    Parse SPARQL JSON results incrementally from text `chunks`, yielding
+    each binding as soon as it's complete, without keeping the whole
+    document in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    in_bindings = False
+    async for chunk in chunks:
+        buffer += chunk
+        if not in_bindings:
+            if not (match := BINDINGS_START_RE.search(buffer)):
+                continue
+            start = match.end()
+            buffer = buffer[start:]
+            in_bindings = True
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if buffer.startswith("]", pos):
+                return
+            try:
+                binding, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # incomplete - wait for more data
+                break
+            yield {k: binding[k]["value"] for k in binding}
+        buffer = buffer[pos:]
+
+
+async def _stream_page(client, query, offset, limit, queue) -> None:
+    """
+    Put bindings of one page of `query` results in `queue` as they're
+    parsed, followed by _PAGE_END (also if the request fails).
+    """
+    q = {"query": "{} offset {} limit {}".format(query, offset, limit)}
+    try:
+        async with client.stream(
+            "GET",
+            f"http://data.open.ac.uk/sparql?{urllib.parse.urlencode(q)}",
+            follow_redirects=True,
+            headers={"Accept": "application/sparql-results+json"},
+        ) as response:
+            response.raise_for_status()
+            async for binding in _iter_bindings(response.aiter_text()):
+                queue.put_nowait(binding)
+    finally:
+        queue.put_nowait(_PAGE_END)
+
+
+async def iter_data_open_ac_uk(
+    query: str,
+    order_by: str,
+    page_size: int = PAGE_SIZE,
+    max_pages_in_flight: int = MAX_PAGES_IN_FLIGHT,
+    client: Optional[httpx.AsyncClient] = None,
+) -> AsyncIterator[Dict[str, str]]:
+    """
+    Yield all bindings of a SPARQL `query`, fetching them page by page,
+    so that results aren't silently cut off at a fixed limit.
+
+    `order_by` must order results deterministically, for pages not to
+    overlap. Up to `max_pages_in_flight` pages are requested ahead, and
+    bindings are yielded in order, as soon as they're parsed.
+
+    Errors are raised, as partial results could look complete.
+    """
+    query = f"{query} ORDER BY {order_by}"
+    pages: Deque[Tuple[asyncio.Task, asyncio.Queue]] = collections.deque()
+    next_offset = 0
+    async with _client_or_temporary(client) as client:
+
+        def request_page() -> None:
+            nonlocal next_offset
+            queue: asyncio.Queue = asyncio.Queue()
+            task = asyncio.create_task(
+                _stream_page(client, query, next_offset, page_size, queue)
+            )
+            pages.append((task, queue))
+            next_offset += page_size
+
+        try:
+            for _ in range(max_pages_in_flight):
+                request_page()
+            while pages:
+                task, queue = pages.popleft()
+                count = 0
+                while (binding := await queue.get()) is not _PAGE_END:
+                    count += 1
+                    yield binding
+                await task  # raises errors, if any
+                if count < page_size:
+                    # last page - the ones requested ahead are empty
+                    break
+                request_page()
+        finally:
+            for task, _ in pages:
+                task.cancel()
+            await asyncio.gather(
+                *(task for task, _ in pages), return_exceptions=True
+            )
+
+
+async def query_xcri(
+    limit=3000, ignore_timeout=True, client=None, **format_kwargs
+):
     format_ = dict(QUERY_FORMAT_DEFAULTS, **format_kwargs)
-    courses = await query_data_open_ac_uk(
-        XCRI_QUERY.format(**format_), 0, limit
-    )
-    qualifications = await query_data_open_ac_uk(
-        XCRI_QUALIFICATIONS_QUERY.format(**format_),
-        0,
-        limit,
+    courses, qualifications = await asyncio.gather(
+        query_data_open_ac_uk(
+            XCRI_QUERY.format(**format_), 0, limit, ignore_timeout, client
+        ),
+        query_data_open_ac_uk(
+            XCRI_QUALIFICATIONS_QUERY.format(**format_),
+            0,
+            limit,
+            ignore_timeout,
+            client,
+        ),
     )
     return courses + qualifications
 
 
-async def query_oldcourses(limit=3000, **format_kwargs):
+async def query_oldcourses(
+    limit=3000, ignore_timeout=True, client=None, **format_kwargs
+):
     format_ = dict(QUERY_FORMAT_DEFAULTS, **format_kwargs)
     return await query_data_open_ac_uk(
-        OLDCOURSE_QUERY.format(**format_), 0, limit
+        OLDCOURSE_QUERY.format(**format_), 0, limit, ignore_timeout, client
     )
 
 
-async def find_module_or_qualification(code) -> Optional[Result]:
+async def _resolve_codes(
+    codes: Set[str],
+    addfilter: str,
+    limit: int,
+    client: Optional[httpx.AsyncClient],
+) -> Dict[str, Result]:
+    """
+    Run RESOLUTION_QUERIES concurrently with given `addfilter`, and return
+    results for `codes`, taking each code's result from the first of them
+    which has one. Remaining queries are cancelled as soon as all codes
+    are resolved.
+
+    Timeouts and errors are raised rather than reported as missing results,
+    unless all codes are resolved by other queries.
+    """
+    tasks = {
+        name: asyncio.create_task(
+            query_data_open_ac_uk(
+                query.format(addfilter=addfilter),
+                0,
+                limit,
+                ignore_timeout=False,
+                client=client,
+            )
+        )
+        for name, query in RESOLUTION_QUERIES
+    }
+    found: Dict[str, Result] = {}
+    error = None
+    try:
+        for name, task in tasks.items():
+            try:
+                results = await task
+            except Exception as e:
+                logger.warning(f"{name} query failed for {codes}: {e!r}")
+                error = error or e
+                continue
+            for result in results:
+                code = result["id"]
+                if code in codes and code not in found:
+                    logger.info(f"{name} result: {result}")
+                    found[code] = Result(
+                        code, result["title"], result.get("url")
+                    )
+            if len(found) == len(codes):
+                break
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    if error and len(found) < len(codes):
+        raise error
+    return found
+
+
+async def find_module_or_qualification(code, client=None) -> Optional[Result]:
+    """
+    Look up a single module or qualification code via SPARQL.
+
+    Queries xcri courses, xcri qualifications and oldcourses concurrently,
+    and returns the result from the first of them which has one, in that
+    order of priority.
+    """
     code = code.upper()
     filter_ = f'FILTER(?id = "{code}")'
 
-    logger.info(f"Querying {code} from xcri")
-    if results_xcri := await query_xcri(addfilter=filter_, limit=1):
-        result = results_xcri[0]
-        logger.info(f"xcri result: {result}")
-        return Result(code, result["title"], result.get("url"))
+    logger.info(f"Querying {code} from xcri and oldcourses")
+    if result := (await _resolve_codes({code}, filter_, 1, client)).get(code):
+        return result
+    logger.info(f"Querying {code} from SPARQL returned no results")
+    return None
 
-    logger.info(f"Querying {code} from oldcourses")
-    if results_old := await query_oldcourses(addfilter=filter_, limit=1):
-        result = results_old[0]
-        logger.info(f"oldcourses result: {result}")
-        return Result(code, result["title"], result.get("url"))
 
-    logger.info(f"Querying {code} from SPARQL returned no results")
+async def find_modules_or_qualifications(
+    codes: Iterable[str], client=None
+) -> Dict[str, Result]:
+    """
+    Look up multiple codes at once, with a single query to each graph.
+
+    Returns results by code, for codes which were found, picked in the same
+    order of priority as `find_module_or_qualification`.
+    """
+    unique_codes = {code.upper() for code in codes}
+    values = " ".join(f'"{code}"' for code in sorted(unique_codes))
+    filter_ = f"VALUES ?id {{ {values} }}"
+
+    logger.info(f"Querying {values} from xcri and oldcourses")
+    return await _resolve_codes(
+        unique_codes, filter_, BATCH_ROWS_PER_CODE * len(unique_codes), client
+    )
+
+
+async def head_with_retries(
+    url, client, retries=2, backoff=0.5, rate_limiter=None, headers=None
+) -> Optional[httpx.Response]:
+    """
+    Send a HEAD request to `url`, following redirects, and retrying failed
+    requests with exponential backoff and jitter. Returns None if all
+    attempts failed.
+
+    `rate_limiter`, if given, is acquired before each request.
+    """
+    for retry_num in range(retries + 1):
+        if retry_num:
+            delay = backoff * 2 ** (retry_num - 1)
+            await asyncio.sleep(delay + random.uniform(0, delay))
+        if rate_limiter:
+            await rate_limiter.acquire()
+        try:
+            return await client.head(
+                url, follow_redirects=True, headers=headers
+            )
+        except Exception as e:
+            print(
+                f"Trying {url} -> failed ({e!r})"
+                f" - attempt {retry_num + 1} / {retries + 1}"
+            )
     return None
 
 
-def is_really_active(url, code, retries=2, retry_num=0):
+def is_active_response(response: httpx.Response, code: str) -> bool:
+    """
+    Check if `response` is from an active page for given `code`, like
+    OUModulesBackend._is_active_url.
+    """
+    correct_redirect = code.lower() in str(response.url).lower()
+    return correct_redirect and response.status_code == 200
+
+
+async def is_really_active(
+    url, code, client, retries=2, backoff=0.5, rate_limiter=None
+):
+    """
+    Check if `url` is an active page for given `code`, retrying failed
+    requests as described in `head_with_retries`.
+    """
     if not url:
         # no point in checking if API returns it as 'oldcourse'
         return None
-    print(f"Trying {url} -> ", end=" ")
-    time.sleep(0.1)  # lame rate limiting
-    try:
-        result = httpx.head(url, follow_redirects=True)
-    except Exception as e:
-        print("failed (%s)" % e, end=" ")
-        retry_num += 1
-        if retry_num <= retries:
-            print(f"- retrying ({retry_num} / {retries})")
-            return is_really_active(url, code, retries, retry_num=retry_num)
-        really_active = False
-    else:
-        correct_redirect = code.lower() in str(result.url).lower()
-        really_active = correct_redirect and result.status_code == 200
-        print(f"{really_active} ({result.url}, {result.status_code})")
+    response = await head_with_retries(
+        url, client, retries, backoff, rate_limiter
+    )
+    if response is None:
+        return False
+    really_active = is_active_response(response, code)
+    print(
+        f"Trying {url} -> {really_active}"
+        f" ({response.url}, {response.status_code})"
+    )
     return really_active
@@ -1,6 +1,6 @@
 import re
 from collections import namedtuple
-from typing import Iterable
+from typing import Iterable, List, Optional
 
 Result = namedtuple("Result", "code,title,url")
 
@@ -14,6 +14,28 @@ QUALIFICATION_CODE_RE = re.compile(rf"^({QUALIFICATION_CODE_RE_TEMPLATE})$")
 MODULE_OR_QUALIFICATION_CODE_RE_TEMPLATE = (
     rf"(?:{MODULE_CODE_RE_TEMPLATE}|{QUALIFICATION_CODE_RE_TEMPLATE})"
 )
+# Codes mentioned in messages, like !M208:
+MENTION_RE = re.compile(r"!" + MODULE_OR_QUALIFICATION_CODE_RE_TEMPLATE)
+# Mentions handled per message, at most:
+MENTIONS_LIMIT = 5
+
+
+def extract_mentions(content: str, limit: int = MENTIONS_LIMIT) -> List[str]:
+    """
+    Return the normalised codes mentioned in a message's `content`, as
+    handled by the bot - the first `limit` ones, uppercase, in order.
+    """
+    return [match[1:].upper() for match in MENTION_RE.findall(content)[:limit]]
+
+
+def extract_find_query(content: str) -> Optional[str]:
+    """
+    Return the words searched for by a "!find <words>" message, if it's one.
+    """
+    parts = content.split(maxsplit=1)
+    if len(parts) != 2 or parts[0].lower() != "!find":
+        return None
+    return parts[1].strip()
 
 
 def get_possible_qualification_urls(code: str) -> Iterable[str]:
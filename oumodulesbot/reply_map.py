@@ -0,0 +1,158 @@
+import asyncio
+import collections
+import logging
+import sqlite3
+import time
+from typing import Optional, OrderedDict, Tuple
+
+# How long edits of a message update the bot's reply, instead of being
+# ignored:
+REPLIES_TTL = 7 * 24 * 60 * 60
+MEMORY_BUDGET = 16 * 1024 * 1024
+# Approximate memory taken by each entry - see `ReplyMap`:
+ENTRY_SIZE = 300
+
+logger = logging.getLogger(__name__)
+
+MessageId = int  # Discord snowflake
+Reply = Tuple[MessageId, MessageId]  # channel id, reply message id
+
+
+class ReplyMap:
+    """
+    Maps ids of messages replied to, to ids of the bot's replies, so that
+    replies can be updated when messages are edited.
+
+    Only ids are kept - the reply is edited through a partial message built
+    from them, without fetching it. Entries expire after `ttl` seconds,
+    and the oldest ones are evicted early to stay within `memory_budget`
+    bytes. If `path` is given, entries are also written to a SQLite file,
+    so that they survive restarts.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: float = REPLIES_TTL,
+        memory_budget: int = MEMORY_BUDGET,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max(memory_budget // ENTRY_SIZE, 1)
+        # message id -> (channel id, reply id, expiry time), oldest first:
+        self._entries: OrderedDict[
+            MessageId, Tuple[MessageId, MessageId, float]
+        ] = collections.OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = asyncio.Lock()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS replies ("
+                " message_id PRIMARY KEY,"
+                " channel_id NOT NULL,"
+                " reply_id NOT NULL,"
+                " expires_at REAL NOT NULL"
+                ")"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS replies_expires_at"
+                " ON replies (expires_at)"
+            )
+            self._db.commit()
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _load(self) -> None:
+        assert self._db
+        rows = self._db.execute(
+            "SELECT message_id, channel_id, reply_id, expires_at"
+            " FROM replies WHERE expires_at > ?"
+            " ORDER BY expires_at DESC LIMIT ?",
+            (time.time(), self.max_entries),
+        ).fetchall()
+        for message_id, channel_id, reply_id, expires_at in reversed(rows):
+            self._entries[message_id] = channel_id, reply_id, expires_at
+        logger.info(f"Loaded {len(rows)} replies from {self.path}")
+
+    def _evict(self, now: float) -> None:
+        while self._entries:
+            _, _, expires_at = next(iter(self._entries.values()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    def get(self, message_id: MessageId) -> Optional[Reply]:
+        """
+        Return (channel id, reply id) of the reply to the message, if it
+        hasn't expired.
+        """
+        entry = self._entries.get(message_id)
+        if entry is None:
+            return None
+        channel_id, reply_id, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[message_id]
+            return None
+        return channel_id, reply_id
+
+    async def put(
+        self, message_id: MessageId, channel_id: MessageId, reply_id: MessageId
+    ) -> None:
+        now = time.time()
+        entry = channel_id, reply_id, now + self.ttl
+        # re-added at the end, to keep the entries ordered by expiry:
+        self._entries.pop(message_id, None)
+        self._entries[message_id] = entry
+        self._evict(now)
+        if self._db:
+            await self._run(self._write, message_id, entry, now)
+
+    async def forget(self, message_id: MessageId) -> None:
+        """
+        Remove the message's reply, e.g. because it was deleted.
+        """
+        self._entries.pop(message_id, None)
+        if self._db:
+            await self._run(self._delete, message_id)
+
+    async def _run(self, function, *args) -> None:
+        async with self._lock:
+            try:
+                await asyncio.to_thread(function, *args)
+            except sqlite3.Error:
+                # still kept in memory, until restarted:
+                logger.exception(f"Failed writing replies to {self.path}")
+
+    def _write(
+        self,
+        message_id: MessageId,
+        entry: Tuple[MessageId, MessageId, float],
+        now: float,
+    ) -> None:
+        assert self._db
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO replies"
+                " (message_id, channel_id, reply_id, expires_at)"
+                " VALUES (?, ?, ?, ?)",
+                (message_id, *entry),
+            )
+            self._db.execute(
+                "DELETE FROM replies WHERE expires_at <= ?", (now,)
+            )
+
+    def _delete(self, message_id: MessageId) -> None:
+        assert self._db
+        with self._db:
+            self._db.execute(
+                "DELETE FROM replies WHERE message_id = ?", (message_id,)
+            )
+
+    async def aclose(self) -> None:
+        if self._db:
+            async with self._lock:
+                self._db.close()
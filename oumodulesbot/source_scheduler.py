@@ -0,0 +1,121 @@
+import collections
+import dataclasses
+import itertools
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+import pylru
+
+from oumodulesbot.ou_utils import get_module_level
+
+# Wins needed for a code shape before sources stop being raced all at once:
+MIN_OBSERVATIONS = 20
+# Share of recent wins the likely winner needs, to be started on its own:
+MIN_WIN_SHARE = 0.8
+# Older wins count less, so that changes upstream are picked up:
+WIN_DECAY = 0.98
+# The other sources are started once the likely winner takes longer than
+# this quantile of its recent winning latencies:
+HEDGE_QUANTILE = 0.95
+MIN_HEDGE_DELAY = 0.05
+MAX_HEDGE_DELAY = 2.0
+LATENCY_WINDOW = 100
+SHAPES_SIZE = 1000
+
+Shape = Tuple[str, Optional[int]]  # code prefix, level
+Plan = List[Tuple[str, float]]  # source name, delay before starting it
+
+
+@dataclasses.dataclass
+class ShapeStats:
+    # source name -> decayed number of wins:
+    wins: Dict[str, float] = dataclasses.field(default_factory=dict)
+    # source name -> latencies of its recent wins, in seconds:
+    latencies: Dict[str, Deque[float]] = dataclasses.field(
+        default_factory=dict
+    )
+    observations: int = 0
+
+
+def get_code_shape(code: str) -> Shape:
+    """
+    Return what the likely source of a code's result depends on: its letter
+    prefix, and level if it's a module code - e.g. ("M", 2) for M208.
+    """
+    code = code.upper()
+    prefix = "".join(itertools.takewhile(str.isalpha, code))
+    try:
+        level: Optional[int] = get_module_level(code)
+    except ValueError:
+        level = None
+    return prefix, level
+
+
+class SourceScheduler:
+    """
+    Learns which source answers lookups of each code shape, so that only
+    the likely winner is started right away, and the other sources are
+    only started (hedged) if it doesn't answer within its usual time.
+
+    Until a shape has enough wins recorded, or if no source wins most of
+    them, all sources are started at once.
+    """
+
+    def __init__(
+        self,
+        sources: Sequence[str],
+        min_observations: int = MIN_OBSERVATIONS,
+        min_win_share: float = MIN_WIN_SHARE,
+        hedge_quantile: float = HEDGE_QUANTILE,
+        min_hedge_delay: float = MIN_HEDGE_DELAY,
+        max_hedge_delay: float = MAX_HEDGE_DELAY,
+        shapes_size: int = SHAPES_SIZE,
+    ):
+        self.sources = tuple(sources)
+        self.min_observations = min_observations
+        self.min_win_share = min_win_share
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        # Shape -> ShapeStats
+        self.shapes = pylru.lrucache(shapes_size)
+
+    def plan(self, code: str) -> Plan:
+        """
+        Return all sources in the order to start them in, with the delay
+        after which to start each one.
+        """
+        stats = self.shapes.get(get_code_shape(code))
+        race = [(source, 0.0) for source in self.sources]
+        if stats is None or stats.observations < self.min_observations:
+            return race
+        favourite = max(self.sources, key=lambda s: stats.wins.get(s, 0))
+        share = stats.wins.get(favourite, 0) / sum(stats.wins.values())
+        latencies = stats.latencies.get(favourite)
+        if share < self.min_win_share or not latencies:
+            return race
+        ordered = sorted(latencies)
+        index = min(int(len(ordered) * self.hedge_quantile), len(ordered) - 1)
+        delay = min(
+            max(ordered[index], self.min_hedge_delay), self.max_hedge_delay
+        )
+        return [(favourite, 0.0)] + [
+            (source, delay) for source in self.sources if source != favourite
+        ]
+
+    def record_win(self, code: str, source: str, latency: float) -> None:
+        """
+        Record that `source` answered a lookup of `code`, `latency` seconds
+        after it was started.
+        """
+        shape = get_code_shape(code)
+        stats = self.shapes.get(shape)
+        if stats is None:
+            stats = self.shapes[shape] = ShapeStats()
+        for name in stats.wins:
+            stats.wins[name] *= WIN_DECAY
+        stats.wins[source] = stats.wins.get(source, 0) + 1
+        stats.observations += 1
+        latencies = stats.latencies.setdefault(
+            source, collections.deque(maxlen=LATENCY_WINDOW)
+        )
+        latencies.append(latency)
@@ -0,0 +1,156 @@
+"""
+Full-text search of module and qualification titles, e.g. to find the code
+of "the calculus one".
+"""
+
+import collections
+import heapq
+import math
+import re
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Set, Tuple
+
+# BM25 parameters - term frequency saturation, and length normalisation:
+K1 = 1.2
+B = 0.75
+# Query terms beyond these are ignored:
+MAX_QUERY_TERMS = 10
+# Scoring stops after this long, with the rarest terms scored first:
+SEARCH_BUDGET = 0.01
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Plurals are treated the same as singulars: "-ies" as "-y", "-es" after
+# these endings dropped, as well as "-s" after anything but these endings -
+# e.g. in "calculus" or "analysis":
+ES_PLURAL_ENDINGS = ("sses", "xes", "zes", "ches", "shes")
+SINGULAR_ENDINGS = ("ss", "us", "is")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from in into is it of on one or the to"
+    " what whats which with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split `text` into normalised terms - lowercase, without accents,
+    stopwords or plural endings.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = text.replace("'", "").replace("’", "")
+    terms = []
+    for token in TOKEN_RE.findall(text):
+        if token in STOPWORDS:
+            continue
+        terms.append(singular(token))
+    return terms
+
+
+def singular(token: str) -> str:
+    if len(token) <= 3 or not token.endswith("s"):
+        return token
+    if token.endswith("ies"):
+        return token[:-3] + "y"
+    if token.endswith(ES_PLURAL_ENDINGS):
+        return token[:-2]
+    if token.endswith(SINGULAR_ENDINGS):
+        return token
+    return token[:-1]
+
+
+class TitleIndex:
+    """
+    Inverted index of titles by code, ranking matches with BM25.
+    """
+
+    def __init__(
+        self,
+        k1: float = K1,
+        b: float = B,
+        search_budget: float = SEARCH_BUDGET,
+    ):
+        self.k1 = k1
+        self.b = b
+        self.search_budget = search_budget
+        # term -> {code: term frequency in the code's title}
+        self.postings: Dict[str, Dict[str, int]] = collections.defaultdict(
+            dict
+        )
+        # code -> number of terms in its title
+        self.lengths: Dict[str, int] = {}
+        # code -> distinct terms in its title, to remove its postings
+        self._terms: Dict[str, List[str]] = {}
+        self._total_length = 0
+
+    @classmethod
+    def from_titles(
+        cls, titles: Iterable[Tuple[str, str]], **kwargs
+    ) -> "TitleIndex":
+        index = cls(**kwargs)
+        for code, title in titles:
+            index.add(code, title)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, code: str, title: str) -> None:
+        """
+        Index `title` of `code`, replacing its previous title if any.
+        """
+        self.remove(code)
+        terms = collections.Counter(tokenize(title))
+        for term, frequency in terms.items():
+            self.postings[term][code] = frequency
+        length = sum(terms.values())
+        self.lengths[code] = length
+        self._terms[code] = list(terms)
+        self._total_length += length
+
+    def remove(self, code: str) -> None:
+        length = self.lengths.pop(code, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in self._terms.pop(code):
+            del self.postings[term][code]
+            if not self.postings[term]:
+                del self.postings[term]
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[str, float]]:
+        """
+        Return up to `limit` (code, score) pairs of the titles best matching
+        `query`, best first.
+
+        Terms are scored from the rarest, until `search_budget` seconds have
+        passed - so under load, common terms may not count.
+        """
+        deadline = time.perf_counter() + self.search_budget
+        terms: Set[str] = set(tokenize(query)[:MAX_QUERY_TERMS])
+        postings = [self.postings[t] for t in terms if t in self.postings]
+        postings.sort(key=len)
+        documents = len(self.lengths)
+        average_length = self._total_length / max(documents, 1)
+        scores: Dict[str, float] = collections.defaultdict(float)
+        for codes in postings:
+            idf = math.log(
+                1 + (documents - len(codes) + 0.5) / (len(codes) + 0.5)
+            )
+            for code, frequency in codes.items():
+                norm = (
+                    1 - self.b + self.b * self.lengths[code] / average_length
+                )
+                scores[code] += (
+                    idf
+                    * frequency
+                    * (self.k1 + 1)
+                    / (frequency + self.k1 * norm)
+                )
+            # the rarest term is always scored:
+            if time.perf_counter() > deadline:
+                break
+        # ties broken by code, so that results are stable:
+        return heapq.nsmallest(
+            limit, scores.items(), key=lambda item: (-item[1], item[0])
+        )
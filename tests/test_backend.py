@@ -1,6 +1,12 @@
+import asyncio
+import json
+import time
+from unittest import mock
+
+import httpx
 import pytest
 
-from oumodulesbot import backend
+from oumodulesbot import backend, binary_cache, circuit_breaker
 
 
 @pytest.mark.parametrize(
@@ -28,3 +34,375 @@ from oumodulesbot import backend
 )
 def test_html_title_in_html(html, expected_name):
     assert backend.find_title_in_html(html) == expected_name
+
+
+@pytest.mark.asyncio
+@mock.patch.object(backend.OUModulesBackend, "_try_ouda")
+@mock.patch.object(backend.OUModulesBackend, "_try_url")
+@mock.patch.object(backend, "find_module_or_qualification")
+async def test_negative_cache(sparql_mock, url_mock, ouda_mock):
+    sparql_mock.return_value = None
+    url_mock.return_value = None
+    ouda_mock.return_value = None
+    modules_backend = backend.OUModulesBackend()
+
+    assert await modules_backend.find_result_for_code("XYZ999") is None
+    assert await modules_backend.find_result_for_code("xyz999") is None
+
+    # the second lookup is answered from the negative cache:
+    sparql_mock.assert_called_once_with("XYZ999", modules_backend.client)
+    url_mock.assert_called_once_with("XYZ999")
+    ouda_mock.assert_called_once_with("XYZ999")
+    assert modules_backend.negative_cache["XYZ999"].failures == {
+        "sparql": backend.FAILURE_NOT_FOUND,
+        "url": backend.FAILURE_NOT_FOUND,
+        "ouda": backend.FAILURE_NOT_FOUND,
+    }
+
+
+@pytest.mark.asyncio
+@mock.patch.object(backend.OUModulesBackend, "_try_ouda")
+@mock.patch.object(backend.OUModulesBackend, "_try_url")
+@mock.patch.object(backend, "find_module_or_qualification")
+async def test_negative_cache_transient(sparql_mock, url_mock, ouda_mock):
+    sparql_mock.side_effect = httpx.ReadTimeout("timeout")
+    url_mock.return_value = None
+    ouda_mock.side_effect = ValueError("unexpected")
+    modules_backend = backend.OUModulesBackend(
+        negative_cache_ttl=1000, negative_cache_transient_ttl=0
+    )
+
+    assert await modules_backend.find_result_for_code("XYZ999") is None
+    assert modules_backend.negative_cache["XYZ999"].failures == {
+        "sparql": backend.FAILURE_TIMEOUT,
+        "url": backend.FAILURE_NOT_FOUND,
+        "ouda": backend.FAILURE_ERROR,
+    }
+
+    # failures caused by timeouts/errors expire sooner:
+    assert await modules_backend.find_result_for_code("XYZ999") is None
+    assert sparql_mock.call_count == 2
+
+
+@pytest.mark.asyncio
+@mock.patch.object(backend.OUModulesBackend, "_try_ouda")
+@mock.patch.object(backend.OUModulesBackend, "_try_url")
+@mock.patch.object(backend, "find_module_or_qualification")
+async def test_concurrent_lookups_coalesced(sparql_mock, url_mock, ouda_mock):
+    result = backend.Result("XYZ999", "Some Random Module", None)
+    release = asyncio.Event()
+
+    async def slow_ouda(code):
+        await release.wait()
+        return result
+
+    sparql_mock.return_value = None
+    url_mock.return_value = None
+    ouda_mock.side_effect = slow_ouda
+    modules_backend = backend.OUModulesBackend()
+
+    lookups = [
+        asyncio.create_task(modules_backend.find_result_for_code("XYZ999"))
+        for _ in range(5)
+    ]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*lookups) == [result] * 5
+    ouda_mock.assert_called_once_with("XYZ999")
+    assert modules_backend.stats["upstream_lookups"] == 1
+    assert modules_backend.stats["coalesced_lookups"] == 4
+
+
+@pytest.mark.asyncio
+@mock.patch.object(backend.OUModulesBackend, "_try_ouda")
+@mock.patch.object(backend.OUModulesBackend, "_try_url")
+@mock.patch.object(backend, "find_module_or_qualification")
+async def test_learned_entries_persisted(
+    sparql_mock, url_mock, ouda_mock, tmp_path
+):
+    sparql_mock.return_value = None
+    url_mock.return_value = None
+    ouda_mock.return_value = backend.Result("XYZ999", "Some Module", None)
+    store_path = str(tmp_path / "cache.db")
+
+    async with backend.OUModulesBackend(store_path=store_path) as first:
+        await first.find_result_for_code("XYZ999")
+
+    # learned entries are loaded on top of cache.json after a restart:
+    async with backend.OUModulesBackend(store_path=store_path) as second:
+        assert second.cache["XYZ999"] == ("Some Module", None)
+        assert second.cache["M208"] == first.cache["M208"]
+        assert await second.find_result_for_code("XYZ999") == (
+            backend.Result("XYZ999", "Some Module", None)
+        )
+    ouda_mock.assert_called_once_with("XYZ999")
+
+
+def test_binary_cache(tmp_path):
+    json_cache = backend.get_cache()
+    json_bytes = json.dumps(
+        {code: list(item) for code, item in json_cache.items()}
+    ).encode()
+    binary_path = tmp_path / "cache.bin"
+    binary_path.write_bytes(
+        binary_cache.dump_binary_cache(
+            json_cache, backend.get_cache_json_digest()
+        )
+    )
+
+    loaded = backend.get_cache(str(binary_path))
+    assert isinstance(loaded, binary_cache.BinaryCache)
+    # cache.json has both null and false for missing URLs:
+    assert dict(loaded) == {
+        code: (title, url or None) for code, (title, url) in json_cache.items()
+    }
+    assert "XYZ999" not in loaded
+
+    # binary files built from a different cache.json aren't used:
+    binary_path.write_bytes(
+        binary_cache.dump_binary_cache(
+            json_cache, binary_cache.get_digest(json_bytes)
+        )
+    )
+    assert backend.get_cache(str(binary_path)) == json_cache
+
+
+@pytest.mark.asyncio
+@mock.patch.object(backend.OUModulesBackend, "_try_ouda")
+@mock.patch.object(backend.OUModulesBackend, "_try_url")
+@mock.patch.object(backend, "find_module_or_qualification")
+@mock.patch.object(backend, "find_modules_or_qualifications")
+async def test_find_results_for_codes(
+    batch_sparql_mock, sparql_mock, url_mock, ouda_mock
+):
+    found = backend.Result("XYZ1", "Some Module", "url")
+    batch_sparql_mock.return_value = {"XYZ1": found}
+    url_mock.return_value = None
+    ouda_mock.return_value = None
+    modules_backend = backend.OUModulesBackend()
+
+    results = await modules_backend.find_results_for_codes(
+        ["xyz1", "M208", "XYZ2", "XYZ1"]
+    )
+
+    assert results == [
+        found,
+        backend.Result("M208", *modules_backend.cache["M208"]),
+        None,
+        found,
+    ]
+    # misses are looked up once, with a single batched SPARQL query:
+    batch_sparql_mock.assert_called_once_with(
+        ["XYZ1", "XYZ2"], modules_backend.client
+    )
+    sparql_mock.assert_not_called()
+    assert url_mock.call_count == 2
+    assert modules_backend.stats["upstream_lookups"] == 2
+
+
+@pytest.mark.asyncio
+@mock.patch.object(backend.OUModulesBackend, "_try_ouda")
+@mock.patch.object(backend.OUModulesBackend, "_try_url")
+@mock.patch.object(backend, "find_module_or_qualification")
+async def test_metrics(sparql_mock, url_mock, ouda_mock):
+    release = asyncio.Event()
+
+    async def slow_url(code):
+        await release.wait()
+
+    sparql_mock.side_effect = httpx.ReadTimeout("timeout")
+    url_mock.side_effect = slow_url
+    ouda_mock.return_value = backend.Result("XYZ999", "Some Module", None)
+    modules_backend = backend.OUModulesBackend()
+    metrics = modules_backend.metrics
+
+    assert await modules_backend.find_result_for_code("XYZ999")
+    assert await modules_backend.find_result_for_code("XYZ999")
+
+    assert metrics.lookups.get(result="upstream") == 1
+    assert metrics.lookups.get(result="cache_hit") == 1
+    assert metrics.cache_hit_ratio.get() == 0.5
+    assert metrics.source_wins.get(source="ouda") == 1
+    assert metrics.source_wins.get(source="cache") == 1
+    assert metrics.source_outcomes.get(source="sparql", outcome="timeout")
+    assert metrics.source_outcomes.get(source="url", outcome="cancelled")
+    assert metrics.source_outcomes.get(source="ouda", outcome="found")
+    assert metrics.source_duration.count(source="ouda") == 1
+    # cancelled lookups have no meaningful duration:
+    assert metrics.source_duration.count(source="url") == 0
+    assert metrics.in_flight_requests.get(source="url") == 0
+    assert metrics.in_flight_lookups.get() == 0
+    assert (
+        'oumodulesbot_source_wins_total{source="ouda"} 1.0' in metrics.render()
+    )
+
+
+@pytest.mark.asyncio
+@mock.patch.object(backend.OUModulesBackend, "_try_ouda")
+@mock.patch.object(backend.OUModulesBackend, "_try_url")
+@mock.patch.object(backend, "find_module_or_qualification")
+async def test_adaptive_sources(sparql_mock, url_mock, ouda_mock):
+    sparql_mock.return_value = None
+    url_mock.return_value = None
+    ouda_mock.side_effect = lambda code: backend.Result(code, "Old", None)
+    modules_backend = backend.OUModulesBackend()
+    modules_backend.scheduler = backend.SourceScheduler(
+        backend.UPSTREAM_SOURCES, min_observations=2, min_hedge_delay=0.01
+    )
+
+    # all sources are raced until OUDA is known to answer for XYZ1xx:
+    await modules_backend.find_result_for_code("XYZ101")
+    await modules_backend.find_result_for_code("XYZ102")
+    assert sparql_mock.call_count == url_mock.call_count == 2
+
+    assert await modules_backend.find_result_for_code("XYZ103")
+    assert ouda_mock.call_count == 3
+    assert sparql_mock.call_count == url_mock.call_count == 2
+    assert modules_backend.metrics.source_outcomes.get(
+        source="url", outcome="skipped"
+    )
+
+    # the other sources are started once OUDA doesn't answer:
+    ouda_mock.side_effect = lambda code: None
+    assert await modules_backend.find_result_for_code("XYZ104") is None
+    assert sparql_mock.call_count == url_mock.call_count == 3
+
+
+@pytest.mark.asyncio
+@mock.patch.object(backend.OUModulesBackend, "_try_ouda")
+@mock.patch.object(backend.OUModulesBackend, "_try_url")
+@mock.patch.object(backend, "find_modules_or_qualifications")
+async def test_adaptive_sources_batch(batch_sparql_mock, url_mock, ouda_mock):
+    batch_sparql_mock.return_value = {}
+    url_mock.return_value = None
+    ouda_mock.side_effect = lambda code: backend.Result(code, "Old", None)
+    modules_backend = backend.OUModulesBackend()
+    modules_backend.scheduler = backend.SourceScheduler(
+        backend.UPSTREAM_SOURCES, min_observations=2, min_hedge_delay=1
+    )
+    for code in ("XYZ101", "XYZ102"):
+        modules_backend.scheduler.record_win(code, "ouda", 0.01)
+
+    results = await modules_backend.find_results_for_codes(
+        ["XYZ103", "XYZ104"]
+    )
+
+    # the batch follows the plan, so it isn't sent once OUDA answers:
+    assert [result.code for result in results] == ["XYZ103", "XYZ104"]
+    batch_sparql_mock.assert_not_called()
+    url_mock.assert_not_called()
+
+
+@pytest.mark.asyncio
+@mock.patch.object(backend.OUModulesBackend, "_try_ouda")
+@mock.patch.object(backend.OUModulesBackend, "_try_url")
+@mock.patch.object(backend, "find_module_or_qualification")
+async def test_circuit_breaker_skips_failing_source(
+    sparql_mock, url_mock, ouda_mock
+):
+    sparql_mock.side_effect = httpx.ConnectError("connection refused")
+    url_mock.return_value = None
+    ouda_mock.return_value = None
+    modules_backend = backend.OUModulesBackend(
+        breaker_failure_threshold=2, negative_cache_transient_ttl=0
+    )
+
+    for code in ("XYZ101", "XYZ102", "XYZ103"):
+        assert await modules_backend.find_result_for_code(code) is None
+
+    # not queried again once its circuit is open:
+    assert sparql_mock.call_count == 2
+    assert url_mock.call_count == ouda_mock.call_count == 3
+    assert modules_backend.negative_cache["XYZ103"].failures == {
+        "sparql": backend.FAILURE_CIRCUIT_OPEN,
+        "url": backend.FAILURE_NOT_FOUND,
+        "ouda": backend.FAILURE_NOT_FOUND,
+    }
+
+
+@pytest.mark.asyncio
+@mock.patch.object(backend.OUModulesBackend, "_try_ouda")
+@mock.patch.object(backend.OUModulesBackend, "_try_url")
+@mock.patch.object(backend, "find_modules_or_qualifications")
+async def test_circuit_breaker_batch(batch_sparql_mock, url_mock, ouda_mock):
+    codes = ["XYZ101", "XYZ102", "XYZ103", "XYZ104", "XYZ105"]
+    batch_sparql_mock.side_effect = httpx.ConnectError("connection refused")
+    url_mock.return_value = None
+    ouda_mock.return_value = None
+    modules_backend = backend.OUModulesBackend(negative_cache_transient_ttl=0)
+    breaker = modules_backend.breakers["sparql"]
+
+    # a failed batch is a single failure, however many codes it has:
+    assert await modules_backend.find_results_for_codes(codes) == [None] * 5
+    assert breaker.failures == 1
+    assert breaker.state == circuit_breaker.CLOSED
+
+    # when half-open, the batch is the only probe, shared by all codes:
+    breaker.state = circuit_breaker.OPEN
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout
+    batch_sparql_mock.side_effect = None
+    batch_sparql_mock.return_value = {
+        code: backend.Result(code, "Some Module", None) for code in codes
+    }
+    results = await modules_backend.find_results_for_codes(codes)
+    assert [result.code for result in results] == codes
+    assert batch_sparql_mock.call_count == 2
+    assert breaker.state == circuit_breaker.CLOSED
+    assert not modules_backend.metrics.source_outcomes.get(
+        source="sparql", outcome="circuit_open"
+    )
+
+
+@pytest.mark.asyncio
+@mock.patch.object(backend.OUModulesBackend, "_try_ouda")
+@mock.patch.object(backend.OUModulesBackend, "_try_url")
+@mock.patch.object(backend, "find_module_or_qualification")
+async def test_lookup_deadline(sparql_mock, url_mock, ouda_mock):
+    release = asyncio.Event()
+
+    async def slow_ouda(code):
+        await release.wait()
+        return backend.Result(code, "Slow Module", None)
+
+    sparql_mock.return_value = None
+    url_mock.return_value = None
+    ouda_mock.side_effect = slow_ouda
+    modules_backend = backend.OUModulesBackend(lookup_deadline=0.01)
+
+    assert await modules_backend.find_result_for_code("XYZ999") is None
+    assert modules_backend.metrics.deadlines_exceeded.get() == 1
+
+    # the lookup continues after the deadline, and its result is cached:
+    release.set()
+    await asyncio.sleep(0.01)
+    assert modules_backend.cache["XYZ999"] == ("Slow Module", None)
+
+
+@pytest.mark.asyncio
+@mock.patch.object(backend.OUModulesBackend, "_try_ouda")
+@mock.patch.object(backend.OUModulesBackend, "_try_url")
+@mock.patch.object(backend, "find_module_or_qualification")
+async def test_search_titles(sparql_mock, url_mock, ouda_mock):
+    sparql_mock.return_value = None
+    url_mock.return_value = None
+    ouda_mock.return_value = backend.Result(
+        "XYZ999", "Quantum basket weaving", None
+    )
+    modules_backend = backend.OUModulesBackend()
+
+    assert modules_backend.search_titles("pure mathematics", 1) == [
+        backend.Result(
+            "M208",
+            "Pure mathematics",
+            "http://www.open.ac.uk/courses/modules/m208",
+        )
+    ]
+    assert modules_backend.search_titles("basket weaving") == []
+
+    # learned entries are searchable too:
+    await modules_backend.find_result_for_code("XYZ999")
+    assert modules_backend.search_titles("basket weaving") == [
+        backend.Result("XYZ999", "Quantum basket weaving", None)
+    ]
+    assert modules_backend.metrics.title_search_duration.count() == 3
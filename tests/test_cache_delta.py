@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from oumodulesbot import cache_delta
+from oumodulesbot.cache_store import CacheStore
+
+
+def test_make_delta():
+    base = {"M208": ("Pure mathematics", None), "A1": ("Same", "url")}
+    learned = {
+        "M208": ("Pure mathematics", "m208_url"),
+        "A1": ("Same", "url"),
+        "M999": ("Learned", None),
+    }
+    assert cache_delta.make_delta(learned, base) == {
+        "M208": ("Pure mathematics", "m208_url"),
+        "M999": ("Learned", None),
+    }
+
+
+def test_write_delta(tmp_path):
+    path = str(tmp_path / "cache_delta.json")
+    assert cache_delta.write_delta(path, {"M999": ("Learned", None)})
+    with open(path) as f:
+        first = json.load(f)
+    assert first["format"] == cache_delta.DELTA_FORMAT
+    assert first["entries"] == {"M999": ["Learned", None]}
+
+    # unchanged, so not rewritten:
+    assert not cache_delta.write_delta(path, {"M999": ("Learned", None)})
+
+    assert cache_delta.write_delta(path, {"M998": ("Learned too", "url")})
+    with open(path) as f:
+        second = json.load(f)
+    assert second["version"] > first["version"]
+    assert second["entries"] == {"M998": ["Learned too", "url"]}
+    assert not (tmp_path / "cache_delta.json.tmp").exists()
+
+
+@pytest.mark.asyncio
+async def test_export_delta(tmp_path):
+    store_path = str(tmp_path / "cache.db")
+    store = CacheStore(store_path)
+    store.put("M208", ("Pure mathematics", None))
+    store.put("M999", ("Learned", None))
+    await store.aclose()
+
+    delta_path = str(tmp_path / "cache_delta.json")
+    base = {"M208": ("Pure mathematics", None)}
+    assert cache_delta.export_delta(store_path, delta_path, base)
+    with open(delta_path) as f:
+        assert json.load(f)["entries"] == {"M999": ["Learned", None]}
@@ -0,0 +1,60 @@
+from unittest import mock
+
+import pytest
+
+from oumodulesbot import cache_store
+from oumodulesbot.cache_store import CacheStore
+
+pytestmark = pytest.mark.asyncio
+
+
+async def write(path, now, entries):
+    store = CacheStore(path)
+    with mock.patch.object(cache_store.time, "time", return_value=now):
+        for code, item in entries.items():
+            store.put(code, item)
+        await store.aclose()
+
+
+async def test_load_max_age(tmp_path):
+    path = str(tmp_path / "cache.db")
+    await write(path, 1000, {"XYZ1": ("Old", None)})
+    await write(path, 2000, {"XYZ2": ("New", None)})
+
+    store = CacheStore(path)
+    with mock.patch.object(cache_store.time, "time", return_value=2500):
+        assert store.load(max_age=1000) == {"XYZ2": ("New", None)}
+    # expired entries are deleted:
+    assert store.load() == {"XYZ2": ("New", None)}
+    store.close()
+
+
+async def test_load_superseded_by_base(tmp_path):
+    path = str(tmp_path / "cache.db")
+    await write(
+        path,
+        1000,
+        {
+            "A111": ("Module", "http://learned/a111"),
+            "A112": ("Old title", "http://learned/a112"),
+            "A113": ("Module", "http://learned/a113"),
+            "A114": ("Module", "http://learned/a114"),
+            "XYZ1": ("Learned", None),
+        },
+    )
+    base = {
+        # a URL found by revalidation, still missing from cache.json:
+        "A111": ("Module", False),
+        # cache.json regenerated with a new title, or its own URL:
+        "A112": ("New title", None),
+        "A113": ("Module", "http://base/a113"),
+        "A114": ("Module", "http://learned/a114"),
+    }
+
+    store = CacheStore(path)
+    assert store.load(base=base) == {
+        "A111": ("Module", "http://learned/a111"),
+        "XYZ1": ("Learned", None),
+    }
+    assert set(store.load()) == {"A111", "XYZ1"}
+    store.close()
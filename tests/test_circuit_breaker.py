@@ -0,0 +1,39 @@
+from unittest import mock
+
+from oumodulesbot import circuit_breaker
+from oumodulesbot.circuit_breaker import CircuitBreaker
+
+
+@mock.patch.object(circuit_breaker.time, "monotonic")
+def test_circuit_breaker(monotonic_mock):
+    monotonic_mock.return_value = 1000
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_success()
+    # only consecutive failures count:
+    breaker.record_failure()
+    assert breaker.state == circuit_breaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == circuit_breaker.OPEN
+    assert not breaker.allow()
+
+    # a single probe is let through once it's half-open:
+    monotonic_mock.return_value = 1030
+    assert breaker.allow()
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_cancelled()
+    assert breaker.allow()
+    # and a failed probe opens it again right away:
+    breaker.record_failure()
+    assert breaker.state == circuit_breaker.OPEN
+    assert not breaker.allow()
+
+    monotonic_mock.return_value = 1060
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == circuit_breaker.CLOSED
+    assert breaker.allow() and breaker.allow()
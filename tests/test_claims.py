@@ -0,0 +1,165 @@
+import dataclasses
+import types
+from typing import Any, Dict, Optional
+
+import pytest
+import pytest_asyncio
+
+from oumodulesbot import claims
+
+pytestmark = pytest.mark.asyncio
+
+
+@dataclasses.dataclass
+class FakeSnapshot:
+    reference: "FakeDocument"
+    data: Optional[Dict[str, Any]]
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self.data is not None
+
+    def get(self, field):
+        return self.data[field]
+
+
+@dataclasses.dataclass
+class FakeDocument:
+    db: "FakeFirestore"
+    id: str
+
+    async def update(self, data):
+        self.db.documents[self.id].update(data)
+
+
+class FakeTransaction:
+    def __init__(self, db):
+        self._client = db
+        self.writes = []
+
+    async def get_all(self, references):
+        # like google.cloud.firestore's AsyncTransaction.get_all:
+        return await self._client.get_all(references, transaction=self)
+
+    def create(self, reference, data):
+        assert reference.id not in self._client.documents
+        self.writes.append((reference.id, data))
+
+    def update(self, reference, data):
+        self.writes.append((reference.id, data))
+
+
+class FakeFirestore:
+    """
+    Just enough of firestore.AsyncClient for FirestoreClaimStore, keeping
+    documents in memory.
+    """
+
+    def __init__(self) -> None:
+        self.documents: Dict[str, Dict[str, Any]] = {}
+
+    def collection(self, name):
+        return types.SimpleNamespace(
+            document=lambda id_: FakeDocument(self, id_)
+        )
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    async def get_all(self, references, transaction=None):
+        for reference in references:
+            yield FakeSnapshot(reference, self.documents.get(reference.id))
+
+    @staticmethod
+    def async_transactional(function):
+        async def run(transaction):
+            result = await function(transaction)
+            for id_, data in transaction.writes:
+                transaction._client.documents.setdefault(id_, {}).update(data)
+            return result
+
+        return run
+
+
+def make_firestore_store(db):
+    store = claims.FirestoreClaimStore()
+    store._db = db
+    store._collection = db.collection(store.collection)
+    store._firestore = db
+    return store
+
+
+@pytest_asyncio.fixture(params=["memory", "sqlite", "firestore"])
+async def stores(request, tmp_path):
+    """
+    Two stores sharing claims, like two instances of the bot would.
+    """
+    if request.param == "memory":
+        store = claims.MemoryClaimStore()
+        pair = [store, store]
+    elif request.param == "firestore":
+        db = FakeFirestore()
+        pair = [make_firestore_store(db), make_firestore_store(db)]
+    else:
+        path = str(tmp_path / "claims.db")
+        pair = [claims.SqliteClaimStore(path), claims.SqliteClaimStore(path)]
+    yield pair
+    for store in pair:
+        await store.aclose()
+
+
+async def test_claim(stores):
+    first, second = stores
+
+    assert await first.claim([1, 2, 2]) == {"1", "2"}
+    assert await second.claim([2, 3]) == {"3"}
+    assert await second.claimed([1, 3, 4]) == {"1", "3"}
+
+    await first.release(2)
+    assert not await second.is_claimed(2)
+    assert await second.claim([1, 2]) == {"2"}
+
+
+async def test_claim_message_released_on_error(stores):
+    first, second = stores
+
+    with pytest.raises(ValueError):
+        async with first.claim_message(123) as claimed:
+            assert claimed
+            raise ValueError("failed before posting anything")
+
+    async with second.claim_message(123) as claimed:
+        assert claimed
+    async with first.claim_message(123) as claimed:
+        assert not claimed
+
+
+async def test_sqlite_retention(tmp_path):
+    store = claims.SqliteClaimStore(str(tmp_path / "claims.db"), retention=0)
+    assert await store.claim([1]) == {"1"}
+    # expired claims are removed on the next claim:
+    assert await store.claim([2, 1]) == {"1", "2"}
+    await store.aclose()
+
+
+@pytest.mark.parametrize(
+    "spec, expected",
+    [
+        ("memory", claims.MemoryClaimStore),
+        ("none", claims.NullClaimStore),
+        ("sqlite:{tmp_path}/claims.db", claims.SqliteClaimStore),
+    ],
+)
+async def test_get_claim_store(spec, expected, tmp_path):
+    store = claims.get_claim_store(spec.format(tmp_path=tmp_path))
+    assert isinstance(store, expected)
+    await store.aclose()
+
+
+async def test_get_claim_store_invalid():
+    with pytest.raises(ValueError):
+        claims.get_claim_store("sqlite")
@@ -0,0 +1,103 @@
+import asyncio
+from unittest import mock
+
+import httpx
+import pytest
+
+from oumodulesbot import http_client
+from oumodulesbot.http_client import PerHostLimitTransport, TokenBucket
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_client(handler, max_per_host=1):
+    transport = PerHostLimitTransport(
+        httpx.MockTransport(handler), max_per_host
+    )
+    return httpx.AsyncClient(transport=transport)
+
+
+async def test_per_host_limit():
+    release = asyncio.Event()
+    started = []
+
+    async def handler(request):
+        started.append(request.url.host)
+        if request.url.host == "slow.example":
+            await release.wait()
+        return httpx.Response(200, content=b"ok")
+
+    async with make_client(handler) as client:
+        first = asyncio.create_task(client.get("http://slow.example/1"))
+        second = asyncio.create_task(client.get("http://slow.example/2"))
+        await asyncio.sleep(0.01)
+        assert started == ["slow.example"]
+
+        # other hosts aren't limited by it:
+        await asyncio.wait_for(client.get("http://fast.example/"), 1)
+
+        release.set()
+        await asyncio.wait_for(asyncio.gather(first, second), 1)
+        assert started == ["slow.example", "fast.example", "slow.example"]
+
+
+async def test_per_host_limit_released():
+    async def handler(request):
+        if request.url.path == "/error":
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200, content=b"ok")
+
+    async with make_client(handler) as client:
+
+        async def open_stream():
+            async with client.stream("GET", "http://host/"):
+                pass
+
+        # after the body is read:
+        response = await asyncio.wait_for(client.get("http://host/"), 1)
+        assert response.content == b"ok"
+
+        # after a streamed response is closed without reading it:
+        await asyncio.wait_for(open_stream(), 1)
+
+        # after the request raises:
+        with pytest.raises(httpx.ConnectError):
+            await asyncio.wait_for(client.get("http://host/error"), 1)
+
+        response = await asyncio.wait_for(client.get("http://host/"), 1)
+        assert response.status_code == 200
+
+
+async def test_token_bucket():
+    now = 0.0
+    sleeps = []
+
+    async def sleep(delay):
+        nonlocal now
+        sleeps.append(delay)
+        now += delay
+
+    with (
+        mock.patch.object(http_client.time, "monotonic", lambda: now),
+        mock.patch.object(http_client.asyncio, "sleep", sleep),
+    ):
+        bucket = TokenBucket(rate=4, capacity=2)
+
+        # a burst of up to `capacity`, then one acquisition per 1 / `rate`:
+        for _ in range(4):
+            await bucket.acquire()
+        assert sleeps == [0.25, 0.25]
+
+        # refilled at `rate`, but only up to `capacity`:
+        sleeps.clear()
+        now += 0.375
+        await bucket.acquire()
+        assert sleeps == []
+        await bucket.acquire()
+        assert sleeps == [0.125]
+
+        sleeps.clear()
+        now += 60
+        for _ in range(3):
+            await bucket.acquire()
+        assert sleeps == [0.25]
@@ -0,0 +1,67 @@
+"""
+Guards cold starts of the cloud function, which only needs the modules
+below - they must not pull in discord.py or Firestore when imported.
+"""
+
+import subprocess
+import sys
+
+IMPORT_LIGHT_MODULES = [
+    "oumodulesbot.backend",
+    "oumodulesbot.claims",
+    "oumodulesbot.formatting",
+    "oumodulesbot.interactions",
+]
+HEAVY_MODULES = ["discord", "aiohttp", "google.cloud.firestore", "grpc"]
+# Generous, as the machine running the tests may be slow - what's imported
+# is checked more precisely below:
+IMPORT_TIME_BUDGET = 1.5  # seconds
+
+
+def import_times(code):
+    """
+    Run `code` in a fresh interpreter with -X importtime, and return
+    a {module name: cumulative import time in seconds} dict of all modules
+    imported, and the names of ones imported directly rather than by other
+    modules.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    top_level = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # nested imports are indented:
+        if not name[1:].startswith(" "):
+            top_level.add(name.strip())
+        times[name.strip()] = int(cumulative) / 1e6
+    return times, top_level
+
+
+def test_import_time():
+    times, top_level = import_times(
+        "; ".join(f"import {module}" for module in IMPORT_LIGHT_MODULES)
+        # also check that the claim store connects only when it's used:
+        + '; oumodulesbot.claims.get_claim_store("firestore")'
+    )
+    for module in IMPORT_LIGHT_MODULES:
+        assert module in times
+    imported_heavy = [
+        name
+        for name in times
+        if any(
+            name == heavy or name.startswith(f"{heavy}.")
+            for heavy in HEAVY_MODULES
+        )
+    ]
+    assert not imported_heavy
+    total = sum(
+        times[name] for name in top_level if name.startswith("oumodulesbot")
+    )
+    assert total < IMPORT_TIME_BUDGET
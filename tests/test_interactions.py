@@ -0,0 +1,96 @@
+from unittest import mock
+
+import pytest
+
+from oumodulesbot import interactions
+from oumodulesbot.claims import MemoryClaimStore
+from oumodulesbot.ou_utils import MENTIONS_LIMIT, Result
+
+M208 = Result("M208", "Pure mathematics", "http://example.com/m208")
+
+
+def make_interaction(content, items=None):
+    data = {
+        "target_id": "target",
+        "interaction_id": content,
+        "token": "token",
+        "guild_id": "guild",
+        "message": {"channel_id": "channel", "content": content},
+    }
+    if items is not None:
+        data["items"] = items
+    return data
+
+
+def make_backend(results):
+    backend = mock.Mock()
+    backend.find_results_for_codes = mock.AsyncMock(return_value=results)
+    return backend
+
+
+def make_webhook_client():
+    webhook_client = mock.Mock()
+    webhook_client.patch = mock.AsyncMock()
+    return webhook_client
+
+
+def test_get_codes():
+    known = {"code": "M208", "full_name": M208.title, "url": M208.url}
+    items = [{"code": "xyz1"}, known, {"code": "XYZ1"}]
+    items += [{"code": f"XYZ{n}"} for n in range(2, MENTIONS_LIMIT + 1)]
+    # the limit applies to mentions, before they're de-duplicated:
+    assert interactions.get_codes(make_interaction("", items)) == {
+        "XYZ1": None,
+        "M208": M208,
+        **{f"XYZ{n}": None for n in range(2, MENTIONS_LIMIT - 1)},
+    }
+
+
+@pytest.mark.asyncio
+async def test_find_modules():
+    data = make_interaction(
+        "XYZ1, M208, XYZ2 - and M208 again",
+        items=[
+            {"code": "XYZ1"},
+            {"code": "M208", "full_name": M208.title, "url": M208.url},
+            {"code": "XYZ2"},
+            {"code": "M208", "full_name": M208.title, "url": M208.url},
+        ],
+    )
+    found = Result("XYZ1", "Found by the backend", None)
+    backend = make_backend([found, None])
+    webhook_client = make_webhook_client()
+    claim_store = MemoryClaimStore()
+
+    await interactions.find_modules(data, backend, webhook_client, claim_store)
+
+    # only the codes unknown to the fast path are looked up:
+    backend.find_results_for_codes.assert_awaited_once_with(["XYZ1", "XYZ2"])
+    response = webhook_client.patch.call_args.kwargs["json"]
+    (embed,) = response["embeds"]
+    # in the order they were mentioned:
+    assert embed["fields"] == [
+        {"name": "XYZ1", "value": " * Found by the backend "},
+        {"name": "M208", "value": f" * [{M208.title}](<{M208.url}>) "},
+        {"name": "XYZ2", "value": " * Not found "},
+    ]
+
+    # replied to only once:
+    await interactions.find_modules(data, backend, webhook_client, claim_store)
+    webhook_client.patch.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_find_modules_without_items():
+    # from older versions of the fast path, with the message only:
+    data = make_interaction("Is M208 worth it?")
+    backend = make_backend([M208])
+    webhook_client = make_webhook_client()
+
+    await interactions.find_modules(
+        data, backend, webhook_client, MemoryClaimStore()
+    )
+
+    backend.find_results_for_codes.assert_awaited_once_with(["M208"])
+    response = webhook_client.patch.call_args.kwargs["json"]
+    assert response["content"] == f"M208: [{M208.title}](<{M208.url}>)"
@@ -0,0 +1,160 @@
+import json
+from unittest import mock
+
+import httpx
+import pytest
+
+from oumodulesbot import make_cache
+
+pytestmark = pytest.mark.asyncio
+
+
+OLD_CACHE = {
+    "A111": ["Module with changed URL", "http://www.open.ac.uk/old/a111"],
+    "A112": ["Module with changed title", None],
+    "B321": ["Module with changed URL, inactive", None],
+    "M208": ["Unseen module", "http://www.open.ac.uk/courses/modules/m208"],
+}
+XCRI = [
+    {
+        "id": "A111",
+        "title": "Module with changed URL",
+        "url": "http://www.open.ac.uk/courses/modules/a111",
+    },
+    {"id": "A112", "title": "Module with new title"},
+    {
+        "id": "B321",
+        "title": "Module with changed URL, inactive",
+        "url": "http://www.open.ac.uk/courses/modules/b321",
+    },
+    {
+        "id": "NEW1",
+        "title": "New module",
+        "url": "http://www.open.ac.uk/courses/modules/new1",
+    },
+]
+
+
+def mock_streams(xcri):
+    async def iter_data_open_ac_uk(query, order_by, **kwargs):
+        if query == make_cache.XCRI_QUERY.format(addfilter=""):
+            for result in xcri:
+                yield result
+
+    return mock.patch.object(
+        make_cache, "iter_data_open_ac_uk", iter_data_open_ac_uk
+    )
+
+
+ACTIVE = {
+    "http://www.open.ac.uk/courses/modules/a111",
+    "http://www.open.ac.uk/courses/modules/new1",
+}
+
+
+async def test_main(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "cache.json").write_text(json.dumps(OLD_CACHE))
+    attempts = []
+
+    async def head(url, **kwargs):
+        attempts.append(url)
+        if attempts.count(url) == 1 and url.endswith("new1"):
+            raise httpx.ConnectError("flaky")
+        return mock.Mock(url=url, status_code=200 if url in ACTIVE else 404)
+
+    with (
+        mock_streams(XCRI),
+        mock.patch("httpx.AsyncClient.head", side_effect=head),
+        mock.patch("asyncio.sleep"),
+    ):
+        await make_cache.main()
+
+    assert json.loads((tmp_path / "newcache.json").read_text()) == {
+        "A111": [
+            "Module with changed URL",
+            "http://www.open.ac.uk/courses/modules/a111",
+        ],
+        "A112": ["Module with new title", None],
+        "B321": ["Module with changed URL, inactive", None],
+        "M208": ["Unseen module", None],
+        "NEW1": ["New module", "http://www.open.ac.uk/courses/modules/new1"],
+    }
+    # failed checks are retried:
+    assert attempts.count("http://www.open.ac.uk/courses/modules/new1") == 2
+
+
+async def test_main_incremental(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "cache.json").write_text(json.dumps(OLD_CACHE))
+    requests = []
+
+    async def head(url, headers=None, **kwargs):
+        requests.append((url, headers))
+        if headers and headers.get("If-None-Match") == f'"{url}"':
+            return mock.Mock(url=url, status_code=304, headers={})
+        return mock.Mock(
+            url=url,
+            status_code=200 if url in ACTIVE else 404,
+            headers={"ETag": f'"{url}"'},
+        )
+
+    async def run(max_age):
+        requests.clear()
+        with (
+            mock_streams(XCRI),
+            mock.patch("httpx.AsyncClient.head", side_effect=head),
+        ):
+            await make_cache.main(incremental=True, max_age=max_age)
+        return (tmp_path / "newcache.json").read_text()
+
+    first = await run(max_age=3600)
+    assert len(requests) == 4
+    metadata = json.loads((tmp_path / make_cache.META_PATH).read_text())
+    assert metadata["NEW1"]["active"] is True
+    assert metadata["M208"]["status"] == 404
+
+    # recent results are reused without any requests:
+    assert await run(max_age=3600) == first
+    assert requests == []
+
+    # stale results are re-checked with conditional requests:
+    assert await run(max_age=0) == first
+    assert len(requests) == 4
+    assert all(
+        headers["If-None-Match"] == f'"{url}"' for url, headers in requests
+    )
+
+
+async def test_main_incremental_transient_error(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "cache.json").write_text(json.dumps(OLD_CACHE))
+    new1 = "http://www.open.ac.uk/courses/modules/new1"
+    requests = []
+    unavailable = True
+
+    async def head(url, headers=None, **kwargs):
+        requests.append(url)
+        if url == new1 and unavailable:
+            return mock.Mock(url=url, status_code=503, headers={})
+        return mock.Mock(
+            url=url, status_code=200 if url in ACTIVE else 404, headers={}
+        )
+
+    async def run():
+        requests.clear()
+        with (
+            mock_streams(XCRI),
+            mock.patch("httpx.AsyncClient.head", side_effect=head),
+        ):
+            await make_cache.main(incremental=True, max_age=3600)
+        return json.loads((tmp_path / "newcache.json").read_text())
+
+    assert not (await run())["NEW1"][1]
+    metadata = json.loads((tmp_path / make_cache.META_PATH).read_text())
+    assert "NEW1" not in metadata
+
+    # checked again by the next run, despite max_age:
+    unavailable = False
+    assert (await run())["NEW1"] == ["New module", new1]
+    assert requests == [new1]
@@ -0,0 +1,48 @@
+import gzip
+import json
+
+from oumodulesbot import mention_stats
+from oumodulesbot.ou_utils import extract_mentions
+
+
+def test_extract_mentions():
+    assert extract_mentions("!m208 and !MST124, not M269 or !!TM129") == [
+        "M208",
+        "MST124",
+        "TM129",
+    ]
+    assert extract_mentions("!A1 !A2 !A3 !A4 !A5 !A6") == [
+        "A1",
+        "A2",
+        "A3",
+        "A4",
+        "A5",
+    ]
+
+
+def test_count_mentions(tmp_path):
+    messages = [
+        {"content": "!m208 !M208 !mst124"},
+        {"content": "no mentions"},
+        {"content": "!Q62"},
+        {"no content": "!XYZ999"},
+    ]
+    archive = tmp_path / "messages.jsonl"
+    archive.write_text(
+        "\n".join(json.dumps(message) for message in messages) + "\nnot json"
+    )
+    nested_archive = tmp_path / "nested.jsonl.gz"
+    with gzip.open(nested_archive, "wt") as f:
+        f.write(json.dumps({"message": {"content": "!MST124"}}))
+
+    stats = mention_stats.count_mentions(
+        [str(archive)], processes=2, chunk_lines=2
+    )
+    assert stats.mentions == {"M208": 2, "MST124": 1, "Q62": 1}
+    assert stats.messages == 3
+    assert stats.invalid_lines == 2
+
+    nested_stats = mention_stats.count_mentions(
+        [str(nested_archive)], field="message.content", processes=1
+    )
+    assert nested_stats.mentions == {"MST124": 1}
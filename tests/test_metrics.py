@@ -0,0 +1,35 @@
+from oumodulesbot import metrics
+
+
+def test_render():
+    registry = metrics.Registry()
+    counter = registry.register(
+        metrics.Counter("lookups_total", "Lookups.", ["result"])
+    )
+    gauge = registry.register(metrics.Gauge("in_flight", "In flight."))
+    histogram = registry.register(
+        metrics.Histogram("duration_seconds", "Duration.", buckets=[0.1, 1])
+    )
+    counter.inc(result="cache_hit")
+    counter.inc(2, result='say "hi"')
+    gauge.set_function(lambda: 3)
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert registry.render() == (
+        "# HELP lookups_total Lookups.\n"
+        "# TYPE lookups_total counter\n"
+        'lookups_total{result="cache_hit"} 1.0\n'
+        'lookups_total{result="say \\"hi\\""} 2.0\n'
+        "# HELP in_flight In flight.\n"
+        "# TYPE in_flight gauge\n"
+        "in_flight 3.0\n"
+        "# HELP duration_seconds Duration.\n"
+        "# TYPE duration_seconds histogram\n"
+        'duration_seconds_bucket{le="0.1"} 1.0\n'
+        'duration_seconds_bucket{le="1.0"} 2.0\n'
+        'duration_seconds_bucket{le="+Inf"} 3.0\n'
+        "duration_seconds_sum 5.55\n"
+        "duration_seconds_count 3.0\n"
+    )
@@ -0,0 +1,195 @@
+import asyncio
+import json
+from unittest import mock
+
+import httpx
+import pytest
+
+from oumodulesbot import ou_sparql_utils
+from oumodulesbot.ou_utils import Result
+
+pytestmark = pytest.mark.asyncio
+
+
+def mock_queries(results_by_query):
+    async def query_data_open_ac_uk(query, *args, **kwargs):
+        for name, sparql in ou_sparql_utils.RESOLUTION_QUERIES:
+            if query == sparql.format(addfilter='FILTER(?id = "A123")'):
+                await asyncio.sleep(0)
+                result = results_by_query[name]
+                if isinstance(result, Exception):
+                    raise result
+                return result
+
+    return mock.patch.object(
+        ou_sparql_utils,
+        "query_data_open_ac_uk",
+        side_effect=query_data_open_ac_uk,
+    )
+
+
+@pytest.mark.parametrize(
+    "results_by_query, expected",
+    [
+        (
+            {
+                "xcri courses": [
+                    {"id": "A123", "title": "Course", "url": "url1"}
+                ],
+                "xcri qualifications": [
+                    {"id": "A123", "title": "Qualification"}
+                ],
+                "oldcourses": [{"id": "A123", "title": "Old course"}],
+            },
+            Result("A123", "Course", "url1"),
+        ),
+        (
+            {
+                "xcri courses": [],
+                "xcri qualifications": [],
+                "oldcourses": [{"id": "A123", "title": "Old course"}],
+            },
+            Result("A123", "Old course", None),
+        ),
+        (
+            {
+                "xcri courses": httpx.ReadTimeout("timeout"),
+                "xcri qualifications": [],
+                "oldcourses": [{"id": "A123", "title": "Old course"}],
+            },
+            Result("A123", "Old course", None),
+        ),
+        (
+            {
+                "xcri courses": [],
+                "xcri qualifications": [],
+                "oldcourses": [],
+            },
+            None,
+        ),
+    ],
+)
+async def test_find_module_or_qualification(results_by_query, expected):
+    with mock_queries(results_by_query) as query_mock:
+        assert (
+            await ou_sparql_utils.find_module_or_qualification("a123")
+            == expected
+        )
+    # all queries are started at once:
+    assert query_mock.call_count == 3
+
+
+async def test_find_module_or_qualification_timeout():
+    with mock_queries(
+        {
+            "xcri courses": [],
+            "xcri qualifications": httpx.ReadTimeout("timeout"),
+            "oldcourses": [],
+        }
+    ):
+        with pytest.raises(httpx.ReadTimeout):
+            await ou_sparql_utils.find_module_or_qualification("A123")
+
+
+async def test_find_modules_or_qualifications():
+    with mock.patch.object(
+        ou_sparql_utils, "query_data_open_ac_uk"
+    ) as query_mock:
+        query_mock.side_effect = [
+            [{"id": "A123", "title": "Course", "url": "url1"}],
+            [],
+            [
+                {"id": "A123", "title": "Old A123"},
+                {"id": "B321", "title": "Old B321"},
+            ],
+        ]
+        assert await ou_sparql_utils.find_modules_or_qualifications(
+            ["b321", "A123", "C999"]
+        ) == {
+            "A123": Result("A123", "Course", "url1"),
+            "B321": Result("B321", "Old B321", None),
+        }
+    assert query_mock.call_count == 3
+    assert 'VALUES ?id { "A123" "B321" "C999" }' in (
+        query_mock.call_args.args[0]
+    )
+
+
+async def test_iter_data_open_ac_uk():
+    rows = [
+        {"id": f"A{i}", "title": f"Module [{i}], {{...}}"} for i in range(5)
+    ]
+    offsets = []
+
+    async def chunked(text):
+        encoded = text.encode()
+        while encoded:
+            chunk, encoded = encoded[:7], encoded[7:]
+            yield chunk
+
+    def handler(request):
+        query = request.url.params["query"]
+        assert "ORDER BY ?id" in query
+        offset = int(query.split(" offset ")[1].split()[0])
+        offsets.append(offset)
+        page = rows[offset:][:2]
+        body = json.dumps(
+            {
+                "head": {"vars": ["id", "title"]},
+                "results": {
+                    "bindings": [
+                        {
+                            k: {"type": "literal", "value": v}
+                            for k, v in r.items()
+                        }
+                        for r in page
+                    ]
+                },
+            },
+            indent=1,
+        )
+        return httpx.Response(200, content=chunked(body))
+
+    async with httpx.AsyncClient(
+        transport=httpx.MockTransport(handler)
+    ) as client:
+        results = [
+            binding
+            async for binding in ou_sparql_utils.iter_data_open_ac_uk(
+                "SELECT ?id ?title WHERE { }",
+                "?id",
+                page_size=2,
+                client=client,
+            )
+        ]
+
+    assert results == rows
+    assert offsets[:3] == [0, 2, 4]
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        httpx.Response(503, text="Service Unavailable"),
+        httpx.ConnectError("connection refused"),
+    ],
+)
+async def test_query_data_open_ac_uk_unavailable(response):
+    def handler(request):
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    async with httpx.AsyncClient(
+        transport=httpx.MockTransport(handler)
+    ) as client:
+        assert (
+            await ou_sparql_utils.query_data_open_ac_uk(
+                "SELECT", 0, 1, client=client
+            )
+            == []
+        )
+        with pytest.raises((httpx.HTTPStatusError, httpx.ConnectError)):
+            await ou_sparql_utils.query_data_open_ac_uk(
+                "SELECT", 0, 1, ignore_timeout=False, client=client
+            )
@@ -1,3 +1,4 @@
+import asyncio
 import json
 from collections import namedtuple
 from unittest import mock
@@ -35,12 +36,9 @@ E2E_EXAMPLES = [
         "A123: [Mocked active module](<fake_url1>)",
     ),
     ModuleExample("B321", False, "B321: Mocked inactive module"),
+    # answered from cache, while the URL is re-checked in the background:
     ModuleExample(
-        "B31",
-        False,
-        "B31: [Mocked inactive-actually-active qualification](<{url}>)".format(
-            url=QUALIFICATION_URL_TPL.format(code="b31"),
-        ),
+        "B31", False, "B31: Mocked inactive-actually-active qualification"
     ),
     ModuleExample(
         "A012",
@@ -55,11 +53,11 @@ E2E_EXAMPLES = [
 ]
 
 
-def create_mock_message(contents, send_result="foo", id_override=None):
+def create_mock_message(contents, send_result=None, id_override=None):
     message = mock.Mock(spec=discord.Message)
     message.content = contents
     message.reply = mock.AsyncMock()
-    message.reply.return_value = send_result
+    message.reply.return_value = send_result or mock.Mock(spec=discord.Message)
     message.id = id_override or contents
     return message
 
@@ -71,10 +69,12 @@ async def process_message(bot, message, result):
     """
 
     with mock.patch("httpx.AsyncClient.head") as head_mock:
+        head_mock.return_value.is_server_error = False
         if "actually-active" in result.result:
             head_mock.return_value.status_code = 200
             head_mock.return_value.url = result.code
         await bot.on_message(message)
+        await bot.backend.wait_for_background_tasks()
         if not result.active:
             code = result.code.lower()
             # inactive results are double-checked with http to provide a link
@@ -121,6 +121,12 @@ async def test_end_to_end_update():
     first_post, updates = E2E_EXAMPLES[0], E2E_EXAMPLES[1:]
     bot = OUModulesBot()
     result_message = mock.Mock(spec=discord.Message)
+    result_message.channel.id = "channel_id"
+    result_message.id = "reply_id"
+    # the reply is edited through a partial message with the same ids:
+    bot.get_partial_messageable = mock.Mock()
+    channel = bot.get_partial_messageable.return_value
+    channel.get_partial_message.return_value = result_message
     message = create_mock_message(
         f"foo !{first_post.code}",
         # result_message is our bot's response here:
@@ -137,12 +143,41 @@ async def test_end_to_end_update():
         )
         await process_message(bot, update_message, update)
         # verify that the bot's response is updated:
+        bot.get_partial_messageable.assert_called_with("channel_id")
+        channel.get_partial_message.assert_called_with("reply_id")
         result_message.edit.assert_called_once_with(
             content=update.result, embeds=[]
         )
+        update_message.reply.assert_not_called()
         result_message.edit.reset_mock()
 
 
+async def test_end_to_end_revalidated_url():
+    """
+    Ensure a module found active by the background check is linked
+    in subsequent replies.
+    """
+    bot = OUModulesBot()
+    stale = E2E_EXAMPLES[2]
+    revalidated = ModuleExample(
+        "B31",
+        True,
+        "B31: [Mocked inactive-actually-active qualification](<{url}>)".format(
+            url=QUALIFICATION_URL_TPL.format(code="b31"),
+        ),
+    )
+    message = create_mock_message(f"stale !{stale.code}")
+    await process_message(bot, message, stale)
+    message.reply.assert_called_once_with(stale.result, embeds=[])
+
+    message = create_mock_message(f"revalidated !{revalidated.code}")
+    with mock.patch("httpx.AsyncClient.head") as head_mock:
+        await bot.on_message(message)
+        # checked at most once per `revalidate_interval`:
+        head_mock.assert_not_called()
+    message.reply.assert_called_once_with(revalidated.result, embeds=[])
+
+
 @mock.patch("httpx.AsyncClient.get")
 async def test_end_to_end_missing_module(get_mock):
     bot = OUModulesBot()
@@ -156,6 +191,7 @@ async def test_end_to_end_missing_module(get_mock):
     # return matching data from httpx:
     get_mock.side_effect = lambda url, **kw: {
         expected_url: mock.Mock(
+            is_server_error=False,
             # OUDA HTML:
             content=(
                 "not really html but matches the regex:"
@@ -166,6 +202,7 @@ async def test_end_to_end_missing_module(get_mock):
     }.get(
         url,
         mock.Mock(
+            is_server_error=False,
             # Empty SPARQL:
             json=lambda: {"results": {"bindings": []}},
         ),
@@ -180,3 +217,97 @@ async def test_end_to_end_missing_module(get_mock):
         # ignore SPARQL calls
         expected_url
     )
+
+
+async def test_end_to_end_lookup_deadline():
+    """
+    Ensure results found by the deadline are posted, even if some lookups
+    for the same message take longer.
+    """
+    bot = OUModulesBot()
+    bot.LOOKUP_DEADLINE = 0.1
+    message = create_mock_message("foo !A123 !XYZ999 !a123")
+
+    async def hanging_get(*args, **kwargs):
+        await asyncio.Event().wait()
+
+    with (
+        mock.patch(
+            "httpx.AsyncClient.head",
+            return_value=mock.Mock(is_server_error=False),
+        ),
+        mock.patch("httpx.AsyncClient.get", side_effect=hanging_get),
+    ):
+        await bot.on_message(message)
+        await bot.backend.aclose()
+
+    message.reply.assert_called_once()
+    embed = message.reply.call_args.kwargs["embeds"][0]
+    assert [(field.name, field.value) for field in embed.fields] == [
+        ("A123", " * [Mocked active module](<fake_url1>) "),
+        ("XYZ999", " * lookup timed out "),
+        ("A123", " * [Mocked active module](<fake_url1>) "),
+    ]
+
+
+async def test_end_to_end_deleted_reply():
+    """
+    Ensure a new reply is posted if the message is edited after the
+    original reply was deleted.
+    """
+    bot = OUModulesBot()
+    first_post, update = E2E_EXAMPLES[0], E2E_EXAMPLES[3]
+    message = create_mock_message(
+        f"foo !{first_post.code}", id_override="deleted_reply_id"
+    )
+    await process_message(bot, message, first_post)
+
+    deleted = mock.Mock(spec=discord.Message)
+    deleted.edit.side_effect = discord.NotFound(
+        mock.Mock(status=404, reason="Not Found"), "Unknown Message"
+    )
+    bot.get_partial_messageable = mock.Mock()
+    channel = bot.get_partial_messageable.return_value
+    channel.get_partial_message.return_value = deleted
+    update_message = create_mock_message(
+        f"foo !{update.code}", id_override="deleted_reply_id"
+    )
+    await process_message(bot, update_message, update)
+    update_message.reply.assert_called_once_with(update.result, embeds=[])
+    reply = update_message.reply.return_value
+    assert bot.replies.get("deleted_reply_id") == (
+        reply.channel.id,
+        reply.id,
+    )
+
+
+async def test_end_to_end_find():
+    """
+    Ensure "!find <words>" replies with the titles matching the words,
+    or says that none were found.
+    """
+    bot = OUModulesBot()
+    message = create_mock_message("!find the Actually one")
+    await bot.on_message(message)
+    message.reply.assert_called_once_with(
+        "B31: Mocked inactive-actually-active qualification", embeds=[]
+    )
+
+    message = create_mock_message("!find active modules")
+    await bot.on_message(message)
+    embed = message.reply.call_args.kwargs["embeds"][0]
+    # best matches first:
+    assert [field.name for field in embed.fields] == [
+        "A123",
+        "A888",
+        "B321",
+        "A012",
+        "B31",
+    ]
+
+    # the query isn't echoed, so that it can't make the bot mention anyone:
+    message = create_mock_message("!find @everyone <@&1234> nothing")
+    await bot.on_message(message)
+    message.reply.assert_called_once_with(
+        OUModulesBot.NO_TITLES_FOUND, embeds=[]
+    )
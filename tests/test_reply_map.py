@@ -0,0 +1,76 @@
+from unittest import mock
+
+import pytest
+
+from oumodulesbot import reply_map
+from oumodulesbot.reply_map import ReplyMap
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_put_get():
+    replies = ReplyMap()
+    await replies.put(1, 10, 100)
+    await replies.put(2, 20, 200)
+    assert replies.get(1) == (10, 100)
+    assert replies.get(3) is None
+
+    await replies.forget(1)
+    assert replies.get(1) is None
+    assert replies.get(2) == (20, 200)
+
+
+async def test_ttl():
+    replies = ReplyMap(ttl=10)
+    with mock.patch("time.time", return_value=1000):
+        await replies.put(1, 10, 100)
+    with mock.patch("time.time", return_value=1005):
+        await replies.put(2, 20, 200)
+        assert replies.get(1) == (10, 100)
+    with mock.patch("time.time", return_value=1010):
+        assert replies.get(1) is None
+        assert replies.get(2) == (20, 200)
+        # expired entries are evicted on writes too:
+        await replies.put(3, 30, 300)
+    with mock.patch("time.time", return_value=1015):
+        await replies.put(4, 40, 400)
+    assert len(replies) == 2
+
+
+async def test_memory_budget():
+    replies = ReplyMap(memory_budget=2 * reply_map.ENTRY_SIZE)
+    await replies.put(1, 10, 100)
+    await replies.put(2, 20, 200)
+    # updated, so it's evicted last:
+    await replies.put(1, 10, 101)
+    await replies.put(3, 30, 300)
+    assert len(replies) == 2
+    assert replies.get(1) == (10, 101)
+    assert replies.get(2) is None
+    assert replies.get(3) == (30, 300)
+
+
+async def test_persistence(tmp_path):
+    path = str(tmp_path / "replies.db")
+    replies = ReplyMap(path)
+    await replies.put(1, 10, 100)
+    await replies.put(2, 20, 200)
+    await replies.put(3, 30, 300)
+    await replies.forget(2)
+    await replies.aclose()
+
+    # only the most recent entries are loaded, within the budget:
+    replies = ReplyMap(path, memory_budget=reply_map.ENTRY_SIZE)
+    assert replies.get(3) == (30, 300)
+    assert replies.get(1) is None
+    await replies.aclose()
+
+    replies = ReplyMap(path)
+    assert replies.get(1) == (10, 100)
+    assert replies.get(2) is None
+    await replies.aclose()
+
+    with mock.patch("time.time", return_value=2**40):
+        replies = ReplyMap(path)
+    assert len(replies) == 0
+    await replies.aclose()
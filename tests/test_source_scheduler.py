@@ -0,0 +1,45 @@
+import pytest
+
+from oumodulesbot.source_scheduler import SourceScheduler, get_code_shape
+
+SOURCES = ("sparql", "url", "ouda")
+
+
+@pytest.mark.parametrize(
+    "code, expected",
+    [("M208", ("M", 2)), ("tm129", ("TM", 1)), ("QD", ("QD", None))],
+)
+def test_get_code_shape(code, expected):
+    assert get_code_shape(code) == expected
+
+
+def test_plan_cold_start():
+    scheduler = SourceScheduler(SOURCES, min_observations=3)
+    scheduler.record_win("A111", "ouda", 0.1)
+    scheduler.record_win("A112", "ouda", 0.1)
+
+    assert scheduler.plan("A113") == [(source, 0) for source in SOURCES]
+
+
+def test_plan_hedges_after_likely_winner():
+    scheduler = SourceScheduler(
+        SOURCES, min_observations=3, min_hedge_delay=0.01
+    )
+    for latency in (0.1, 0.2, 0.3):
+        scheduler.record_win("A111", "ouda", latency)
+
+    assert scheduler.plan("A199") == [
+        ("ouda", 0),
+        ("sparql", 0.3),
+        ("url", 0.3),
+    ]
+    # different level, different shape:
+    assert scheduler.plan("A299") == [(source, 0) for source in SOURCES]
+
+
+def test_plan_races_without_clear_winner():
+    scheduler = SourceScheduler(SOURCES, min_observations=4)
+    for source in ("ouda", "sparql", "ouda", "sparql"):
+        scheduler.record_win("A111", source, 0.1)
+
+    assert scheduler.plan("A111") == [(source, 0) for source in SOURCES]
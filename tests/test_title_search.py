@@ -0,0 +1,101 @@
+import json
+import pathlib
+
+import pytest
+
+from oumodulesbot.ou_utils import extract_find_query
+from oumodulesbot.title_search import TitleIndex, tokenize
+
+
+def test_tokenize():
+    assert tokenize("What's the Café's calculus one?") == ["cafe", "calculus"]
+    assert tokenize("Essential Mathematics 2") == [
+        "essential",
+        "mathematic",
+        "2",
+    ]
+    assert tokenize("Systems and processes") == ["system", "process"]
+    assert tokenize("Business studies, analysis and approaches") == [
+        "business",
+        "study",
+        "analysis",
+        "approach",
+    ]
+    assert tokenize("Process, study, approach") == tokenize(
+        "Processes, studies, approaches"
+    )
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        ("!find calculus", "calculus"),
+        ("!FIND  pure\nmaths ", "pure\nmaths"),
+        ("!find", None),
+        ("!M208 !find calculus", None),
+        ("!finding calculus", None),
+    ],
+)
+def test_extract_find_query(content, expected):
+    assert extract_find_query(content) == expected
+
+
+def test_search():
+    index = TitleIndex.from_titles(
+        [
+            ("M208", "Pure mathematics"),
+            ("MS221", "Exploring mathematics"),
+            ("MST124", "Essential mathematics 1"),
+            ("MS283", "An introduction to calculus"),
+            ("M820", "Calculus of variations and advanced calculus"),
+        ]
+    )
+    assert [code for code, _ in index.search("the calculus one")] == [
+        "M820",
+        "MS283",
+    ]
+    assert [code for code, _ in index.search("pure maths", limit=1)] == [
+        "M208"
+    ]
+    assert index.search("nothing like that") == []
+    assert index.search("process") == []
+    index.add("T215", "Communication processes")
+    assert index.search("process")[0][0] == "T215"
+    index.remove("T215")
+
+    # titles are replaced when they change:
+    index.add("M208", "Impure mathematics")
+    assert index.search("pure") == []
+    assert index.search("impure")[0][0] == "M208"
+    index.remove("M208")
+    assert index.search("impure") == []
+    assert len(index) == 4
+
+
+def test_search_budget():
+    index = TitleIndex.from_titles(
+        [
+            ("A1", "Common rare"),
+            ("A2", "Common"),
+            ("A3", "Common"),
+        ],
+        search_budget=0,
+    )
+    # only the rarest term is scored, once over the budget:
+    assert [code for code, _ in index.search("common rare")] == ["A1"]
+
+
+def test_search_cache():
+    # latency is measured by benchmarks/title_search.py instead:
+    cache_path = (
+        pathlib.Path(__file__).parent.parent / "oumodulesbot" / "cache.json"
+    )
+    with open(cache_path) as f:
+        cache = json.load(f)
+    index = TitleIndex.from_titles(
+        (code, title) for code, (title, _) in cache.items()
+    )
+    found = index.search(
+        "introduction to computing and information technology"
+    )
+    assert found[0][0] in ("TM111", "TM112")